@@ -0,0 +1,1260 @@
+"""
+Almacén persistente de reportes
+Guarda los reportes en una base SQLite en modo WAL, de modo que sobreviven
+a los reinicios y todos los workers de gunicorn ven los mismos datos. Cada
+reporte se guarda como el JSON compacto de su modelo.Escaneo. La misma base
+guarda los perfiles de tiempo aprendidos para cada red, los escaneos
+programados y los que tienen en curso, las reservas de los presupuestos de
+tráfico y las métricas. Los datos de los reportes fríos (ver retencion.py)
+se guardan comprimidos en archivos aparte y se leen de ellos al consultarlos
+"""
+
+import base64
+import binascii
+import gzip
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+import modelo
+
+# Configuración
+RUTA_BASE_DATOS = os.environ.get("RUTA_BASE_DATOS", "reportes.db")
+ESPERA_BLOQUEO_MS = int(os.environ.get("ESPERA_BLOQUEO_MS", 5000))
+MAX_ESCANEOS_CACHE = int(os.environ.get("MAX_ESCANEOS_CACHE", 64))
+# Bytes de datos (sin decodificar) de los escaneos que caben en la caché
+MEMORIA_ESCANEOS_CACHE = int(os.environ.get("MEMORIA_ESCANEOS_CACHE", 64 * 1024 * 1024))
+CARPETA_REPORTES_FRIOS = os.environ.get(
+    "CARPETA_REPORTES_FRIOS", RUTA_BASE_DATOS + "-frios"
+)
+NIVEL_COMPRESION_FRIOS = int(os.environ.get("NIVEL_COMPRESION_FRIOS", 6))
+LIMITE_REPORTES = int(os.environ.get("LIMITE_REPORTES", 100))
+MAX_LIMITE_REPORTES = int(os.environ.get("MAX_LIMITE_REPORTES", 1000))
+# Segundos durante los que un reporte completo sirve para un escaneo idéntico
+TTL_CACHE_RESULTADOS = int(os.environ.get("TTL_CACHE_RESULTADOS", 300))
+
+# Columnas de metadatos (todo menos los datos del escaneo)
+COLUMNAS_METADATOS = (
+    "id",
+    "nombre",
+    "fecha",
+    "timestamp",
+    "host",
+    "puerto",
+    "scripts",
+    "tipo",
+    "argumentos",
+    "tamano",
+    "parcial",
+    "huella",
+)
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS reportes (
+    id TEXT PRIMARY KEY,
+    nombre TEXT NOT NULL,
+    datos TEXT NOT NULL,
+    fecha TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    host TEXT,
+    puerto TEXT,
+    scripts TEXT,
+    tipo TEXT,
+    argumentos TEXT,
+    tamano INTEGER NOT NULL DEFAULT 0,
+    parcial INTEGER NOT NULL DEFAULT 0,
+    huella TEXT,
+    clave TEXT,
+    rendimiento TEXT,
+    -- 1 si los datos están comprimidos en CARPETA_REPORTES_FRIOS
+    frio INTEGER NOT NULL DEFAULT 0,
+    -- Última consulta, para enfriar primero los menos usados
+    accedido TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_reportes_host ON reportes (host, timestamp, id);
+CREATE INDEX IF NOT EXISTS idx_reportes_tipo ON reportes (tipo, timestamp, id);
+CREATE INDEX IF NOT EXISTS idx_reportes_timestamp ON reportes (timestamp, id);
+CREATE INDEX IF NOT EXISTS idx_reportes_clave ON reportes (clave, timestamp);
+CREATE INDEX IF NOT EXISTS idx_reportes_accedido ON reportes (frio, accedido);
+
+-- Contador de cambios compartido por todos los procesos
+CREATE TABLE IF NOT EXISTS version_almacen (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    version INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO version_almacen (id, version) VALUES (0, 0);
+CREATE TRIGGER IF NOT EXISTS reportes_insertados AFTER INSERT ON reportes
+BEGIN UPDATE version_almacen SET version = version + 1; END;
+-- Solo cuentan los cambios en columnas que ven los clientes
+CREATE TRIGGER IF NOT EXISTS reportes_actualizados AFTER UPDATE OF nombre, fecha,
+    timestamp, host, puerto, scripts, tipo, argumentos, tamano, parcial, huella
+    ON reportes
+BEGIN UPDATE version_almacen SET version = version + 1; END;
+CREATE TRIGGER IF NOT EXISTS reportes_eliminados AFTER DELETE ON reportes
+BEGIN UPDATE version_almacen SET version = version + 1; END;
+
+-- Medidas de red aprendidas de escaneos anteriores (ver perfiles.py);
+-- inicio y fin son las direcciones extremas en hexadecimal de ancho fijo
+CREATE TABLE IF NOT EXISTS perfiles_red (
+    red TEXT PRIMARY KEY,
+    inicio TEXT NOT NULL,
+    fin TEXT NOT NULL,
+    medidas TEXT NOT NULL,
+    ajuste TEXT,
+    muestras INTEGER NOT NULL DEFAULT 0,
+    actualizado TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_perfiles_red_inicio ON perfiles_red (inicio, fin);
+
+-- Escaneos programados (ver planificador.py); prevista es la hora nominal
+-- de la próxima ejecución y proxima, la misma hora con el jitter aplicado
+CREATE TABLE IF NOT EXISTS programaciones (
+    id TEXT PRIMARY KEY,
+    nombre TEXT,
+    parametros TEXT NOT NULL,
+    cron TEXT,
+    intervalo INTEGER,
+    jitter INTEGER NOT NULL DEFAULT 0,
+    max_simultaneos INTEGER NOT NULL DEFAULT 1,
+    activa INTEGER NOT NULL DEFAULT 1,
+    prevista TEXT,
+    proxima TEXT,
+    ultima_ejecucion TEXT,
+    ultimo_trabajo TEXT,
+    ultimo_error TEXT,
+    ejecuciones INTEGER NOT NULL DEFAULT 0,
+    omitidas INTEGER NOT NULL DEFAULT 0,
+    creada TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_programaciones_proxima
+    ON programaciones (activa, proxima);
+
+-- Escaneos lanzados por las programaciones que siguen en curso, con el
+-- proceso que los ejecuta: los topes de simultáneos se cuentan aquí para
+-- que valgan entre workers y tras un reinicio. trabajo_id es NULL mientras
+-- se lanza y estado, el del trabajo la última vez que se miró
+CREATE TABLE IF NOT EXISTS ejecuciones_programadas (
+    id TEXT PRIMARY KEY,
+    programacion_id TEXT NOT NULL,
+    trabajo_id TEXT,
+    pid INTEGER NOT NULL,
+    estado TEXT NOT NULL,
+    lanzada TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_ejecuciones_programacion
+    ON ejecuciones_programadas (programacion_id);
+
+-- Reservas de los presupuestos de tráfico (ver presupuesto.py): una por
+-- proceso nmap o escaneo asyncio en marcha o esperando su parte
+CREATE TABLE IF NOT EXISTS reservas_presupuesto (
+    id TEXT PRIMARY KEY,
+    claves TEXT NOT NULL,
+    pps INTEGER,
+    sondas INTEGER,
+    ajustable INTEGER NOT NULL DEFAULT 0,
+    activa INTEGER NOT NULL DEFAULT 0,
+    pid INTEGER NOT NULL,
+    creada TEXT NOT NULL
+);
+
+-- Contadores e histogramas de /metrics (ver metricas.py), sumados entre
+-- todos los workers; serie es "" en los contadores y el límite del cubo,
+-- "sum" o "count" en los histogramas
+CREATE TABLE IF NOT EXISTS metricas (
+    nombre TEXT NOT NULL,
+    etiquetas TEXT NOT NULL,
+    serie TEXT NOT NULL,
+    valor REAL NOT NULL,
+    PRIMARY KEY (nombre, etiquetas, serie)
+);
+
+-- Último valor de los indicadores de cada worker (cola, procesos nmap...)
+CREATE TABLE IF NOT EXISTS indicadores_procesos (
+    pid INTEGER NOT NULL,
+    nombre TEXT NOT NULL,
+    valor REAL NOT NULL,
+    actualizado TEXT NOT NULL,
+    PRIMARY KEY (pid, nombre)
+);
+"""
+
+# Una conexión por hilo: sqlite3 no permite compartirlas entre hilos
+conexiones = threading.local()
+
+# Escaneos ya decodificados (con su texto memorizado), del menos al más usado,
+# y el tamaño de los datos de cada uno
+cache_escaneos = OrderedDict()
+tamanos_cache = {}
+memoria_cache = 0
+lock_cache = threading.Lock()
+
+# Reportes consultados desde el último volcado: {id: fecha ISO}
+accesos_pendientes = {}
+
+
+def conexion():
+    """Devuelve la conexión del hilo actual, abriéndola si hace falta"""
+    conn = getattr(conexiones, "conn", None)
+    if conn is None:
+        os.makedirs(os.path.dirname(RUTA_BASE_DATOS) or ".", exist_ok=True)
+        conn = sqlite3.connect(
+            RUTA_BASE_DATOS, timeout=ESPERA_BLOQUEO_MS / 1000, isolation_level=None
+        )
+        conn.row_factory = sqlite3.Row
+        # WAL: los lectores no bloquean al escritor, ni entre procesos
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={ESPERA_BLOQUEO_MS}")
+        _migrar(conn)
+        conn.executescript(ESQUEMA)
+        conexiones.conn = conn
+    return conn
+
+
+def _migrar(conn):
+    """Añade las columnas nuevas a las bases creadas antes de que existieran"""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        columnas = [fila[1] for fila in conn.execute("PRAGMA table_info(reportes)")]
+        if columnas and "huella" not in columnas:
+            conn.execute("ALTER TABLE reportes ADD COLUMN huella TEXT")
+            for fila in conn.execute("SELECT id, datos FROM reportes").fetchall():
+                conn.execute(
+                    "UPDATE reportes SET huella = ? WHERE id = ?",
+                    (calcular_huella(fila[1]), fila[0]),
+                )
+        if columnas and "clave" not in columnas:
+            conn.execute("ALTER TABLE reportes ADD COLUMN clave TEXT")
+        if columnas and "rendimiento" not in columnas:
+            conn.execute("ALTER TABLE reportes ADD COLUMN rendimiento TEXT")
+        if columnas and "frio" not in columnas:
+            conn.execute(
+                "ALTER TABLE reportes ADD COLUMN frio INTEGER NOT NULL DEFAULT 0"
+            )
+        if columnas and "accedido" not in columnas:
+            conn.execute("ALTER TABLE reportes ADD COLUMN accedido TEXT")
+            conn.execute("UPDATE reportes SET accedido = timestamp")
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def calcular_huella(datos):
+    """Huella de los datos guardados de un reporte (base de sus ETags)"""
+    return hashlib.sha1(datos.encode("utf-8")).hexdigest()
+
+
+def _a_reporte(fila):
+    """Convierte una fila en el diccionario de reporte que usa la API"""
+    reporte = dict(fila)
+    reporte["tamaño"] = reporte.pop("tamano")
+    reporte["parcial"] = bool(reporte["parcial"])
+    return reporte
+
+
+def _descartar_de_cache(reporte_id):
+    """Quita un escaneo de la caché; hay que tener lock_cache"""
+    global memoria_cache
+    cache_escaneos.pop(reporte_id, None)
+    memoria_cache -= tamanos_cache.pop(reporte_id, 0)
+
+
+def _recordar_escaneo(reporte_id, escaneo, tamano):
+    """
+    Guarda un escaneo en la caché LRU del proceso y anota su uso
+
+    La memoria se estima por el tamaño de sus datos: se descartan los menos
+    usados hasta quedar por debajo de MAX_ESCANEOS_CACHE escaneos y de
+    MEMORIA_ESCANEOS_CACHE bytes
+    """
+    global memoria_cache
+    with lock_cache:
+        accesos_pendientes[reporte_id] = datetime.now().isoformat()
+        _descartar_de_cache(reporte_id)
+        # Un escaneo que no cabe se sirve sin desplazar a todos los demás
+        if tamano > MEMORIA_ESCANEOS_CACHE:
+            return
+        cache_escaneos[reporte_id] = escaneo
+        tamanos_cache[reporte_id] = tamano
+        memoria_cache += tamano
+        while (
+            len(cache_escaneos) > MAX_ESCANEOS_CACHE
+            or memoria_cache > MEMORIA_ESCANEOS_CACHE
+        ):
+            _descartar_de_cache(next(iter(cache_escaneos)))
+
+
+def _olvidar_escaneos(*reporte_ids):
+    """Quita escaneos de la caché (sin IDs, la vacía entera)"""
+    global memoria_cache
+    with lock_cache:
+        if not reporte_ids:
+            cache_escaneos.clear()
+            tamanos_cache.clear()
+            memoria_cache = 0
+        for reporte_id in reporte_ids:
+            _descartar_de_cache(reporte_id)
+
+
+def _ruta_fria(reporte_id, huella):
+    """Archivo comprimido con los datos de un reporte frío"""
+    return os.path.join(CARPETA_REPORTES_FRIOS, f"{reporte_id}-{huella}.json.gz")
+
+
+def _borrar_archivo_frio(reporte_id, huella):
+    """Borra el archivo de un reporte frío, si existe"""
+    try:
+        os.remove(_ruta_fria(reporte_id, huella))
+    except FileNotFoundError:
+        pass
+
+
+def _leer_datos(reporte_id):
+    """
+    JSON de los datos de un reporte, de la base o de su archivo si está
+    frío, o None si no existe
+    """
+    fila = (
+        conexion()
+        .execute("SELECT datos, frio, huella FROM reportes WHERE id = ?", (reporte_id,))
+        .fetchone()
+    )
+    if fila is None:
+        return None
+    if not fila["frio"]:
+        return fila["datos"]
+    try:
+        with gzip.open(
+            _ruta_fria(reporte_id, fila["huella"]), "rt", encoding="utf-8"
+        ) as archivo:
+            return archivo.read()
+    except FileNotFoundError:
+        # Eliminado o reemplazado mientras se leía
+        return None
+
+
+def guardar_reporte(reporte):
+    """
+    Guarda (o reemplaza) un reporte
+
+    Args:
+        reporte (dict): Metadatos del reporte y su modelo.Escaneo en "escaneo"
+
+    Returns:
+        int: Tamaño en bytes de los datos guardados
+    """
+    datos = json.dumps(
+        reporte["escaneo"].a_dict(), ensure_ascii=False, separators=(",", ":")
+    )
+    tamano = len(datos.encode("utf-8"))
+    huella = calcular_huella(datos)
+    conn = conexion()
+    anterior = conn.execute(
+        "SELECT huella, frio FROM reportes WHERE id = ?", (reporte["id"],)
+    ).fetchone()
+    conn.execute(
+        "INSERT OR REPLACE INTO reportes (id, nombre, datos, fecha, timestamp,"
+        " host, puerto, scripts, tipo, argumentos, tamano, parcial, huella, clave,"
+        " accedido) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (
+            reporte["id"],
+            reporte["nombre"],
+            datos,
+            reporte["fecha"],
+            reporte["timestamp"],
+            reporte["host"],
+            str(reporte["puerto"]),
+            reporte["scripts"],
+            reporte["tipo"],
+            reporte["argumentos"],
+            tamano,
+            int(bool(reporte.get("parcial"))),
+            huella,
+            reporte.get("clave"),
+            datetime.now().isoformat(),
+        ),
+    )
+    # Con la misma huella el archivo puede estar enfriándose otra vez
+    if anterior is not None and anterior["frio"] and anterior["huella"] != huella:
+        _borrar_archivo_frio(reporte["id"], anterior["huella"])
+    _recordar_escaneo(reporte["id"], reporte["escaneo"], tamano)
+    return tamano
+
+
+def obtener_metadatos(reporte_id):
+    """Devuelve los metadatos de un reporte (sin leer sus datos) o None"""
+    fila = (
+        conexion()
+        .execute(
+            f"SELECT {', '.join(COLUMNAS_METADATOS)} FROM reportes WHERE id = ?",
+            (reporte_id,),
+        )
+        .fetchone()
+    )
+    if fila is None:
+        _olvidar_escaneos(reporte_id)
+        return None
+    return _a_reporte(fila)
+
+
+def obtener_reporte(reporte_id, metadatos=None):
+    """
+    Devuelve los metadatos del reporte y su modelo.Escaneo en "escaneo",
+    o None si no existe
+
+    Los datos solo se leen y decodifican si el escaneo no está en la caché
+
+    Args:
+        reporte_id (str): ID del reporte
+        metadatos (dict): Metadatos ya leídos con obtener_metadatos
+    """
+    reporte = dict(metadatos) if metadatos else obtener_metadatos(reporte_id)
+    if reporte is None:
+        return None
+
+    with lock_cache:
+        escaneo = cache_escaneos.get(reporte_id)
+    if escaneo is None:
+        datos = _leer_datos(reporte_id)
+        if datos is None:
+            return None
+        escaneo = modelo.Escaneo.desde_dict(json.loads(datos))
+    _recordar_escaneo(reporte_id, escaneo, reporte["tamaño"])
+    reporte["escaneo"] = escaneo
+    return reporte
+
+
+def _codificar_cursor(reporte):
+    """Cursor opaco que apunta justo después del reporte indicado"""
+    clave = json.dumps([reporte["timestamp"], reporte["id"]])
+    return base64.urlsafe_b64encode(clave.encode("utf-8")).decode("ascii")
+
+
+def _decodificar_cursor(cursor):
+    """Devuelve (timestamp, id) de un cursor o lanza ValueError si no es válido"""
+    try:
+        timestamp, reporte_id = json.loads(base64.urlsafe_b64decode(cursor))
+    except (binascii.Error, UnicodeDecodeError, TypeError, ValueError):
+        raise ValueError("Cursor no válido")
+    if not isinstance(timestamp, str) or not isinstance(reporte_id, str):
+        raise ValueError("Cursor no válido")
+    return timestamp, reporte_id
+
+
+def listar_reportes(
+    limite=LIMITE_REPORTES, cursor=None, host=None, tipo=None, desde=None, hasta=None
+):
+    """
+    Lista una página de metadatos de reportes, del más reciente al más antiguo
+
+    La página se recorre por el índice (timestamp, id), así que su coste no
+    depende del número total de reportes guardados
+
+    Args:
+        limite (int): Máximo de reportes de la página
+        cursor (str): Cursor "siguiente" de la página anterior
+        host (str): Solo reportes de este objetivo
+        tipo (str): Solo reportes de este tipo de escaneo
+        desde (str): Timestamp ISO mínimo (incluido)
+        hasta (str): Timestamp ISO máximo (incluido)
+
+    Returns:
+        tuple: (reportes, siguiente) donde siguiente es el cursor de la
+               página siguiente o None si no hay más
+
+    Raises:
+        ValueError: Si el cursor no es válido
+    """
+    condiciones = []
+    parametros = []
+    for columna, valor in (("host", host), ("tipo", tipo)):
+        if valor is not None:
+            condiciones.append(f"{columna} = ?")
+            parametros.append(valor)
+    if desde is not None:
+        condiciones.append("timestamp >= ?")
+        parametros.append(desde)
+    if hasta is not None:
+        condiciones.append("timestamp <= ?")
+        parametros.append(hasta)
+    if cursor:
+        condiciones.append("(timestamp, id) < (?, ?)")
+        parametros.extend(_decodificar_cursor(cursor))
+
+    consulta = f"SELECT {', '.join(COLUMNAS_METADATOS)} FROM reportes"
+    if condiciones:
+        consulta += " WHERE " + " AND ".join(condiciones)
+    # Se pide uno de más para saber si hay página siguiente
+    consulta += " ORDER BY timestamp DESC, id DESC LIMIT ?"
+    parametros.append(limite + 1)
+
+    reportes = [_a_reporte(fila) for fila in conexion().execute(consulta, parametros)]
+    siguiente = None
+    if len(reportes) > limite:
+        reportes = reportes[:limite]
+        siguiente = _codificar_cursor(reportes[-1])
+    return reportes, siguiente
+
+
+def iterar_reportes(host=None, tipo=None, desde=None, hasta=None, lote=500):
+    """
+    Recorre todos los reportes que cumplen los filtros, del más reciente al
+    más antiguo, leyendo y decodificando uno cada vez
+
+    Los escaneos no pasan por la caché, para que una exportación grande no
+    desplace a los reportes que se están consultando
+
+    Yields:
+        tuple: (metadatos, modelo.Escaneo)
+    """
+    cursor = None
+    while True:
+        pagina, cursor = listar_reportes(
+            limite=lote, cursor=cursor, host=host, tipo=tipo, desde=desde, hasta=hasta
+        )
+        for metadatos in pagina:
+            datos = _leer_datos(metadatos["id"])
+            # Puede haberse eliminado mientras se recorría
+            if datos is not None:
+                yield metadatos, modelo.Escaneo.desde_dict(json.loads(datos))
+        if cursor is None:
+            return
+
+
+def leer_reportes(reporte_ids):
+    """
+    Recorre unos reportes por su ID, leyendo y decodificando uno cada vez
+    sin pasar por la caché; los que ya no existen se omiten
+
+    Yields:
+        tuple: (metadatos, modelo.Escaneo)
+    """
+    for reporte_id in reporte_ids:
+        metadatos = obtener_metadatos(reporte_id)
+        datos = _leer_datos(reporte_id) if metadatos is not None else None
+        if datos is not None:
+            yield metadatos, modelo.Escaneo.desde_dict(json.loads(datos))
+
+
+def _ultimo_reporte_completo(clave, desde=""):
+    """ID del reporte completo más reciente con la clave dada, o None"""
+    fila = (
+        conexion()
+        .execute(
+            "SELECT id FROM reportes WHERE clave = ? AND timestamp >= ?"
+            " AND parcial = 0 ORDER BY timestamp DESC LIMIT 1",
+            (clave, desde),
+        )
+        .fetchone()
+    )
+    return fila["id"] if fila is not None else None
+
+
+def buscar_reporte_reciente(clave, antiguedad_maxima=None):
+    """
+    Busca el reporte completo más reciente de un escaneo con la clave dada
+
+    Args:
+        clave (str): Clave normalizada del escaneo (objetivos y argumentos)
+        antiguedad_maxima (int): Segundos de validez; por defecto
+                                 TTL_CACHE_RESULTADOS (0 desactiva la caché)
+
+    Returns:
+        str: ID del reporte, o None si no hay ninguno vigente
+    """
+    if antiguedad_maxima is None:
+        antiguedad_maxima = TTL_CACHE_RESULTADOS
+    if not clave or antiguedad_maxima <= 0:
+        return None
+    limite = (datetime.now() - timedelta(seconds=antiguedad_maxima)).isoformat()
+    return _ultimo_reporte_completo(clave, limite)
+
+
+def buscar_reporte_anterior(clave):
+    """
+    ID del último reporte completo de un escaneo con la clave dada, sin
+    límite de antigüedad (base de los reescaneos incrementales), o None
+    """
+    return _ultimo_reporte_completo(clave) if clave else None
+
+
+def reporte_anterior(reporte):
+    """
+    Metadatos del reporte completo anterior del mismo escaneo, o None
+
+    El mismo escaneo es el de la misma clave (objetivos, puertos, tipo y
+    argumentos sin las opciones de tiempo); los reportes guardados sin
+    clave se comparan con los de igual host, puertos, tipo, scripts y
+    argumentos
+
+    Args:
+        reporte (dict): Metadatos del reporte (con "host", "timestamp" e "id")
+    """
+    conn = conexion()
+    fila = conn.execute(
+        "SELECT clave FROM reportes WHERE id = ?", (reporte["id"],)
+    ).fetchone()
+    if fila is not None and fila["clave"]:
+        condicion = "clave = ?"
+        valores = (fila["clave"],)
+    else:
+        condicion = (
+            "host = ? AND puerto = ? AND tipo = ? AND scripts = ? AND argumentos = ?"
+        )
+        valores = tuple(
+            reporte[columna]
+            for columna in ("host", "puerto", "tipo", "scripts", "argumentos")
+        )
+    fila = conn.execute(
+        f"SELECT {', '.join(COLUMNAS_METADATOS)} FROM reportes"
+        f" WHERE {condicion} AND parcial = 0 AND (timestamp, id) < (?, ?)"
+        " ORDER BY timestamp DESC, id DESC LIMIT 1",
+        valores + (reporte["timestamp"], reporte["id"]),
+    ).fetchone()
+    return _a_reporte(fila) if fila is not None else None
+
+
+def guardar_rendimiento(reporte_id, rendimiento):
+    """Guarda los tiempos de las fases (ver rendimiento.py) de un reporte"""
+    conexion().execute(
+        "UPDATE reportes SET rendimiento = ? WHERE id = ?",
+        (json.dumps(rendimiento), reporte_id),
+    )
+
+
+def obtener_rendimiento(reporte_id):
+    """
+    Tiempos de las fases de un reporte
+
+    Returns:
+        dict: El rendimiento guardado, {} si el reporte no lo tiene, o None si
+              el reporte no existe
+    """
+    fila = (
+        conexion()
+        .execute("SELECT rendimiento FROM reportes WHERE id = ?", (reporte_id,))
+        .fetchone()
+    )
+    if fila is None:
+        return None
+    return json.loads(fila["rendimiento"]) if fila["rendimiento"] else {}
+
+
+def version():
+    """Número que cambia cada vez que se guarda o elimina un reporte"""
+    return (
+        conexion()
+        .execute("SELECT version FROM version_almacen WHERE id = 0")
+        .fetchone()[0]
+    )
+
+
+def contar_reportes():
+    """Número de reportes almacenados"""
+    return conexion().execute("SELECT COUNT(*) FROM reportes").fetchone()[0]
+
+
+def tamano_almacen():
+    """Número de reportes y bytes que ocupan sus datos"""
+    fila = (
+        conexion()
+        .execute("SELECT COUNT(*), COALESCE(SUM(tamano), 0) FROM reportes")
+        .fetchone()
+    )
+    return fila[0], fila[1]
+
+
+def eliminar_reporte(reporte_id):
+    """
+    Elimina un reporte
+
+    Returns:
+        str: Nombre del reporte eliminado, o None si no existía
+    """
+    filas = (
+        conexion()
+        .execute(
+            "DELETE FROM reportes WHERE id = ? RETURNING nombre, huella, frio",
+            (reporte_id,),
+        )
+        .fetchall()
+    )
+    _olvidar_escaneos(reporte_id)
+    if not filas:
+        return None
+    if filas[0]["frio"]:
+        _borrar_archivo_frio(reporte_id, filas[0]["huella"])
+    return filas[0]["nombre"]
+
+
+def limpiar_reportes():
+    """Elimina todos los reportes y devuelve cuántos había"""
+    filas = (
+        conexion().execute("DELETE FROM reportes RETURNING id, huella, frio").fetchall()
+    )
+    _olvidar_escaneos()
+    for fila in filas:
+        if fila["frio"]:
+            _borrar_archivo_frio(fila["id"], fila["huella"])
+    return len(filas)
+
+
+def volcar_accesos():
+    """Anota en la base la última consulta de los reportes leídos por este proceso"""
+    global accesos_pendientes
+    with lock_cache:
+        lote, accesos_pendientes = accesos_pendientes, {}
+    if not lote:
+        return
+    conn = conexion()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.executemany(
+            "UPDATE reportes SET accedido = ? WHERE id = ?"
+            " AND (accedido IS NULL OR accedido < ?)",
+            [(fecha, reporte_id, fecha) for reporte_id, fecha in lote.items()],
+        )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def bytes_calientes():
+    """Número de reportes con los datos en la base y bytes que ocupan"""
+    fila = (
+        conexion()
+        .execute(
+            "SELECT COUNT(*), COALESCE(SUM(tamano), 0) FROM reportes WHERE frio = 0"
+        )
+        .fetchone()
+    )
+    return fila[0], fila[1]
+
+
+def reportes_para_enfriar(exceso, accedido_antes=None):
+    """
+    Reportes calientes que hay que enfriar, del menos usado al más usado
+
+    Args:
+        exceso (int): Bytes de datos que hay que sacar de la base
+        accedido_antes (str): Fecha ISO; también se enfrían todos los que no
+                              se consultan desde entonces (None: sin límite)
+
+    Returns:
+        list: IDs de los reportes
+    """
+    reporte_ids = []
+    liberados = 0
+    filas = conexion().execute(
+        "SELECT id, tamano, accedido FROM reportes WHERE frio = 0"
+        " ORDER BY accedido, id"
+    )
+    for fila in filas:
+        viejo = accedido_antes is not None and (fila["accedido"] or "") < accedido_antes
+        if not viejo and liberados >= exceso:
+            break
+        reporte_ids.append(fila["id"])
+        liberados += fila["tamano"]
+    return reporte_ids
+
+
+def enfriar_reporte(reporte_id):
+    """
+    Saca los datos de un reporte de la base a un archivo comprimido
+
+    El archivo se escribe con la base bloqueada para escritura, así que
+    ningún proceso puede reemplazar ni eliminar el reporte a la vez. El
+    espacio que deja en la base se reutiliza para los reportes nuevos
+
+    Returns:
+        int: Bytes de datos sacados (0 si ya estaba frío o no existe)
+    """
+    os.makedirs(CARPETA_REPORTES_FRIOS, exist_ok=True)
+    conn = conexion()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        fila = conn.execute(
+            "SELECT datos, huella, tamano FROM reportes WHERE id = ? AND frio = 0",
+            (reporte_id,),
+        ).fetchone()
+        if fila is None:
+            conn.execute("COMMIT")
+            return 0
+        ruta = _ruta_fria(reporte_id, fila["huella"])
+        with gzip.open(
+            ruta + ".tmp", "wt", encoding="utf-8", compresslevel=NIVEL_COMPRESION_FRIOS
+        ) as archivo:
+            archivo.write(fila["datos"])
+        os.replace(ruta + ".tmp", ruta)
+        conn.execute(
+            "UPDATE reportes SET datos = '', frio = 1 WHERE id = ?", (reporte_id,)
+        )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return fila["tamano"]
+
+
+def resumen_retencion():
+    """Reportes y bytes calientes y fríos, y memoria de la caché de escaneos"""
+    resumen = {"calientes": 0, "bytes_calientes": 0, "frios": 0, "bytes_frios": 0}
+    for fila in conexion().execute(
+        "SELECT frio, COUNT(*), COALESCE(SUM(tamano), 0) FROM reportes GROUP BY frio"
+    ):
+        sufijo = "frios" if fila[0] else "calientes"
+        resumen[sufijo] = fila[1]
+        resumen["bytes_" + sufijo] = fila[2]
+    with lock_cache:
+        resumen["escaneos_en_memoria"] = len(cache_escaneos)
+        resumen["bytes_en_memoria"] = memoria_cache
+    return resumen
+
+
+def _a_perfil(fila):
+    """Convierte una fila de perfiles_red en un diccionario"""
+    perfil = dict(fila)
+    perfil["medidas"] = json.loads(perfil["medidas"])
+    perfil["ajuste"] = json.loads(perfil["ajuste"]) if perfil["ajuste"] else {}
+    return perfil
+
+
+def actualizar_perfil_red(red, inicio, fin, combinar):
+    """
+    Actualiza las medidas de una red dentro de una transacción, para que
+    dos escaneos que terminan a la vez no pierdan ninguna muestra
+
+    Args:
+        red (str): Red en notación CIDR
+        inicio (str): Primera dirección de la red (hexadecimal de ancho fijo)
+        fin (str): Última dirección de la red
+        combinar (callable): Recibe las medidas guardadas (o None) y
+                             devuelve las nuevas
+    """
+    conn = conexion()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        fila = conn.execute(
+            "SELECT medidas FROM perfiles_red WHERE red = ?", (red,)
+        ).fetchone()
+        medidas = combinar(json.loads(fila["medidas"]) if fila else None)
+        conn.execute(
+            "INSERT INTO perfiles_red (red, inicio, fin, medidas, muestras,"
+            " actualizado) VALUES (?, ?, ?, ?, 1, ?) ON CONFLICT (red) DO UPDATE"
+            " SET medidas = excluded.medidas, muestras = muestras + 1,"
+            " actualizado = excluded.actualizado",
+            (red, inicio, fin, json.dumps(medidas), datetime.now().isoformat()),
+        )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def perfiles_en_rango(inicio, fin):
+    """Perfiles de las redes que se solapan con el rango [inicio, fin]"""
+    filas = (
+        conexion()
+        .execute(
+            "SELECT * FROM perfiles_red WHERE inicio <= ? AND fin >= ?"
+            " ORDER BY inicio",
+            (fin, inicio),
+        )
+        .fetchall()
+    )
+    return [_a_perfil(fila) for fila in filas]
+
+
+def listar_perfiles_red():
+    """Todos los perfiles de red, ordenados por dirección"""
+    filas = conexion().execute("SELECT * FROM perfiles_red ORDER BY inicio")
+    return [_a_perfil(fila) for fila in filas.fetchall()]
+
+
+def obtener_perfil_red(red):
+    """Perfil de una red o None"""
+    fila = (
+        conexion()
+        .execute("SELECT * FROM perfiles_red WHERE red = ?", (red,))
+        .fetchone()
+    )
+    return _a_perfil(fila) if fila is not None else None
+
+
+def ajustar_perfil_red(red, inicio, fin, ajuste):
+    """
+    Fija los valores impuestos a mano de una red (aunque aún no se haya
+    escaneado); un ajuste vacío vuelve a los valores aprendidos
+    """
+    conexion().execute(
+        "INSERT INTO perfiles_red (red, inicio, fin, medidas, ajuste, actualizado)"
+        " VALUES (?, ?, ?, '{}', ?, ?) ON CONFLICT (red) DO UPDATE"
+        " SET ajuste = excluded.ajuste",
+        (
+            red,
+            inicio,
+            fin,
+            json.dumps(ajuste) if ajuste else None,
+            datetime.now().isoformat(),
+        ),
+    )
+
+
+def eliminar_perfil_red(red):
+    """Olvida lo aprendido de una red; devuelve False si no existía"""
+    cursor = conexion().execute("DELETE FROM perfiles_red WHERE red = ?", (red,))
+    return cursor.rowcount > 0
+
+
+# Columnas de una programación que se pueden cambiar después de crearla
+COLUMNAS_PROGRAMACION = (
+    "activa",
+    "prevista",
+    "proxima",
+    "ultimo_trabajo",
+    "ultimo_error",
+)
+
+
+def _a_programacion(fila):
+    """Convierte una fila de programaciones en un diccionario"""
+    programacion = dict(fila)
+    programacion["parametros"] = json.loads(programacion["parametros"])
+    programacion["activa"] = bool(programacion["activa"])
+    return programacion
+
+
+def guardar_programacion(programacion):
+    """Guarda una programación nueva"""
+    conexion().execute(
+        "INSERT INTO programaciones (id, nombre, parametros, cron, intervalo,"
+        " jitter, max_simultaneos, activa, prevista, proxima, creada)"
+        " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (
+            programacion["id"],
+            programacion["nombre"],
+            json.dumps(programacion["parametros"]),
+            programacion["cron"],
+            programacion["intervalo"],
+            programacion["jitter"],
+            programacion["max_simultaneos"],
+            int(programacion["activa"]),
+            programacion["prevista"],
+            programacion["proxima"],
+            programacion["creada"],
+        ),
+    )
+
+
+def listar_programaciones():
+    """Todas las programaciones, de la próxima en ejecutarse a la última"""
+    filas = conexion().execute(
+        "SELECT * FROM programaciones ORDER BY activa DESC, proxima, creada"
+    )
+    return [_a_programacion(fila) for fila in filas.fetchall()]
+
+
+def obtener_programacion(programacion_id):
+    """Programación por ID o None"""
+    fila = (
+        conexion()
+        .execute("SELECT * FROM programaciones WHERE id = ?", (programacion_id,))
+        .fetchone()
+    )
+    return _a_programacion(fila) if fila is not None else None
+
+
+def programaciones_pendientes(ahora):
+    """Programaciones activas cuya próxima ejecución ya llegó"""
+    filas = conexion().execute(
+        "SELECT * FROM programaciones WHERE activa = 1 AND proxima <= ?"
+        " ORDER BY proxima",
+        (ahora,),
+    )
+    return [_a_programacion(fila) for fila in filas.fetchall()]
+
+
+def reservar_ejecucion(
+    programacion_id, proxima_actual, prevista, proxima, ejecucion_id, pid, max_total
+):
+    """
+    Pasa una programación a su siguiente ejecución si nadie lo hizo antes
+
+    Con varios workers de gunicorn cada uno tiene su planificador: solo el
+    que consigue cambiar proxima lanza (u omite) la ejecución. Los topes se
+    comprueban en la misma transacción con las ejecuciones_programadas en
+    curso, de modo que dos workers no pueden pasarse a la vez
+
+    Args:
+        proxima_actual (str): proxima de la programación cuando se leyó
+        prevista, proxima (str): Siguiente ejecución (nominal y con jitter)
+        ejecucion_id (str): ID con el que se registra la ejecución si se lanza
+        pid (int): Proceso que la lanza
+        max_total (int): Ejecuciones programadas en curso a la vez entre
+                         todas las programaciones
+
+    Returns:
+        str: "lanzar" si este proceso debe lanzarla (ya está registrada),
+             "omitir" si la programación tiene max_simultaneos en curso,
+             "esperar" si se alcanzó max_total (no se cambia nada), o None
+             si otro worker se adelantó
+    """
+    conn = conexion()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        fila = conn.execute(
+            "SELECT max_simultaneos FROM programaciones"
+            " WHERE id = ? AND proxima = ? AND activa = 1",
+            (programacion_id, proxima_actual),
+        ).fetchone()
+        resultado = None
+        if fila is not None:
+            propias = conn.execute(
+                "SELECT COUNT(*) FROM ejecuciones_programadas"
+                " WHERE programacion_id = ?",
+                (programacion_id,),
+            ).fetchone()[0]
+            total = conn.execute(
+                "SELECT COUNT(*) FROM ejecuciones_programadas"
+            ).fetchone()[0]
+            omitida = propias >= fila["max_simultaneos"]
+            resultado = "omitir" if omitida else "lanzar"
+            if not omitida and total >= max_total:
+                resultado = "esperar"
+        if resultado in ("lanzar", "omitir"):
+            ahora = datetime.now().isoformat(timespec="seconds")
+            conn.execute(
+                "UPDATE programaciones SET prevista = ?, proxima = ?,"
+                " ejecuciones = ejecuciones + ?, omitidas = omitidas + ?,"
+                " ultima_ejecucion = CASE WHEN ? THEN ultima_ejecucion ELSE ? END"
+                " WHERE id = ?",
+                (
+                    prevista,
+                    proxima,
+                    0 if omitida else 1,
+                    1 if omitida else 0,
+                    omitida,
+                    ahora,
+                    programacion_id,
+                ),
+            )
+        if resultado == "lanzar":
+            conn.execute(
+                "INSERT INTO ejecuciones_programadas (id, programacion_id, pid,"
+                " estado, lanzada) VALUES (?, ?, ?, 'lanzando', ?)",
+                (ejecucion_id, programacion_id, pid, ahora),
+            )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return resultado
+
+
+def actualizar_programacion(programacion_id, **campos):
+    """Cambia columnas de COLUMNAS_PROGRAMACION; devuelve False si no existe"""
+    desconocidas = set(campos) - set(COLUMNAS_PROGRAMACION)
+    if desconocidas:
+        raise ValueError(f"Columnas no modificables: {', '.join(desconocidas)}")
+    if "activa" in campos:
+        campos["activa"] = int(campos["activa"])
+    cursor = conexion().execute(
+        f"UPDATE programaciones SET {', '.join(f'{c} = ?' for c in campos)}"
+        " WHERE id = ?",
+        (*campos.values(), programacion_id),
+    )
+    return cursor.rowcount > 0
+
+
+def eliminar_programacion(programacion_id):
+    """Elimina una programación; devuelve False si no existía"""
+    cursor = conexion().execute(
+        "DELETE FROM programaciones WHERE id = ?", (programacion_id,)
+    )
+    return cursor.rowcount > 0
+
+
+def listar_ejecuciones(programacion_id=None):
+    """Ejecuciones programadas en curso (de una programación o de todas)"""
+    if programacion_id is None:
+        filas = conexion().execute(
+            "SELECT * FROM ejecuciones_programadas ORDER BY lanzada"
+        )
+    else:
+        filas = conexion().execute(
+            "SELECT * FROM ejecuciones_programadas WHERE programacion_id = ?"
+            " ORDER BY lanzada",
+            (programacion_id,),
+        )
+    return [dict(fila) for fila in filas.fetchall()]
+
+
+def actualizar_ejecucion(ejecucion_id, trabajo_id, estado):
+    """Anota el trabajo de una ejecución programada y su estado"""
+    conexion().execute(
+        "UPDATE ejecuciones_programadas SET trabajo_id = ?, estado = ? WHERE id = ?",
+        (trabajo_id, estado, ejecucion_id),
+    )
+
+
+def eliminar_ejecuciones(*ejecucion_ids):
+    """Olvida ejecuciones programadas que ya no están en curso"""
+    conexion().executemany(
+        "DELETE FROM ejecuciones_programadas WHERE id = ?",
+        [(ejecucion_id,) for ejecucion_id in ejecucion_ids],
+    )
+
+
+def eliminar_ejecuciones_trabajo(trabajo_id):
+    """Olvida las ejecuciones programadas de un trabajo que terminó"""
+    conexion().execute(
+        "DELETE FROM ejecuciones_programadas WHERE trabajo_id = ?", (trabajo_id,)
+    )
+
+
+def _a_reserva(fila):
+    """Convierte una fila de reservas_presupuesto en un diccionario"""
+    reserva = dict(fila)
+    reserva["claves"] = json.loads(reserva["claves"])
+    reserva["ajustable"] = bool(reserva["ajustable"])
+    reserva["activa"] = bool(reserva["activa"])
+    return reserva
+
+
+def crear_reserva(reserva_id, claves, ajustable, pid):
+    """Registra una reserva de presupuesto que aún espera su parte"""
+    conexion().execute(
+        "INSERT INTO reservas_presupuesto (id, claves, ajustable, pid, creada)"
+        " VALUES (?, ?, ?, ?, ?)",
+        (
+            reserva_id,
+            json.dumps(claves),
+            int(ajustable),
+            pid,
+            datetime.now().isoformat(),
+        ),
+    )
+
+
+def listar_reservas():
+    """Todas las reservas de presupuesto, de la más antigua a la más nueva"""
+    filas = conexion().execute("SELECT * FROM reservas_presupuesto ORDER BY creada")
+    return [_a_reserva(fila) for fila in filas.fetchall()]
+
+
+def recalcular_reserva(reserva_id, calcular):
+    """
+    Recalcula una reserva dentro de una transacción, para que dos procesos
+    no se repartan a la vez la misma parte del presupuesto
+
+    Args:
+        reserva_id (str): ID de la reserva
+        calcular (callable): Recibe todas las reservas y devuelve los nuevos
+                             pps, sondas y activa de esta (dict) o None para
+                             dejarla como está
+
+    Returns:
+        dict: La reserva tras el cambio, o None si ya no existe
+    """
+    conn = conexion()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        reservas = [
+            _a_reserva(fila)
+            for fila in conn.execute("SELECT * FROM reservas_presupuesto").fetchall()
+        ]
+        propia = next((r for r in reservas if r["id"] == reserva_id), None)
+        if propia is not None:
+            cambios = calcular(reservas)
+            if cambios:
+                conn.execute(
+                    "UPDATE reservas_presupuesto SET pps = ?, sondas = ?, activa = ?"
+                    " WHERE id = ?",
+                    (
+                        cambios["pps"],
+                        cambios["sondas"],
+                        int(cambios["activa"]),
+                        reserva_id,
+                    ),
+                )
+                propia.update(cambios)
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return propia
+
+
+def eliminar_reservas(*reserva_ids):
+    """Libera reservas de presupuesto"""
+    conexion().executemany(
+        "DELETE FROM reservas_presupuesto WHERE id = ?",
+        [(reserva_id,) for reserva_id in reserva_ids],
+    )
+
+
+def eliminar_reservas_proceso(pid):
+    """Libera todas las reservas de un proceso"""
+    conexion().execute("DELETE FROM reservas_presupuesto WHERE pid = ?", (pid,))
+
+
+def acumular_metricas(incrementos):
+    """
+    Suma incrementos a las métricas compartidas
+
+    Args:
+        incrementos (list): Tuplas (nombre, etiquetas en JSON, serie, incremento)
+    """
+    conn = conexion()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.executemany(
+            "INSERT INTO metricas (nombre, etiquetas, serie, valor)"
+            " VALUES (?, ?, ?, ?) ON CONFLICT (nombre, etiquetas, serie)"
+            " DO UPDATE SET valor = valor + excluded.valor",
+            incrementos,
+        )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def leer_metricas():
+    """Todas las métricas compartidas como tuplas (nombre, etiquetas, serie, valor)"""
+    filas = conexion().execute(
+        "SELECT nombre, etiquetas, serie, valor FROM metricas"
+        " ORDER BY nombre, etiquetas"
+    )
+    return [tuple(fila) for fila in filas.fetchall()]
+
+
+def publicar_indicadores(pid, valores):
+    """Guarda el valor actual de los indicadores de un worker"""
+    ahora = datetime.now().isoformat()
+    conexion().executemany(
+        "INSERT OR REPLACE INTO indicadores_procesos (pid, nombre, valor, actualizado)"
+        " VALUES (?, ?, ?, ?)",
+        [(pid, nombre, valor, ahora) for nombre, valor in valores.items()],
+    )
+
+
+def leer_indicadores(antiguedad_maxima):
+    """
+    Indicadores de los workers que los publicaron hace menos de
+    antiguedad_maxima segundos; los de workers que ya no publican se borran
+
+    Returns:
+        list: Tuplas (pid, nombre, valor)
+    """
+    desde = (datetime.now() - timedelta(seconds=antiguedad_maxima)).isoformat()
+    conn = conexion()
+    conn.execute("DELETE FROM indicadores_procesos WHERE actualizado < ?", (desde,))
+    filas = conn.execute("SELECT pid, nombre, valor FROM indicadores_procesos")
+    return [tuple(fila) for fila in filas.fetchall()]
@@ -1,5 +1,7 @@
 const API_BASE_URL = 'https://web-vulnery.onrender.com';
 let intervaloBusqueda = null;
+let fuenteEventos = null;
+let siguienteReportes = null;
 let apiOnline = false;
 
 function verificarAPI() {
@@ -8,9 +10,9 @@ function verificarAPI() {
         .then(data => {
             apiOnline = true;
             document.getElementById('apiStatusText').textContent = 'Conectado';
-            if (data.reportes_en_memoria !== undefined) {
+            if (data.reportes_almacenados !== undefined) {
                 document.getElementById('apiStatusText').textContent = 
-                    `Conectado (${data.reportes_en_memoria} reportes en memoria)`;
+                    `Conectado (${data.reportes_almacenados} reportes almacenados)`;
             }
         })
         .catch(() => {
@@ -162,7 +164,11 @@ function iniciarEscaneo() {
         .then(res => res.json())
         .then(data => {
             if (data.success) {
-                iniciarMonitoreo();
+                if (data.id && window.EventSource) {
+                    iniciarEventos(data.id);
+                } else {
+                    iniciarMonitoreo();
+                }
                 mostrarEstado('info', 'Escaneo iniciado correctamente');
                 document.getElementById('btnEscanear').disabled = true;
                 document.getElementById('btnDetener').disabled = false;
@@ -189,6 +195,7 @@ function detenerEscaneo() {
                     clearInterval(intervaloBusqueda);
                     intervaloBusqueda = null;
                 }
+                cerrarEventos();
             } else {
                 mostrarEstado('error', data.message);
             }
@@ -219,6 +226,68 @@ function exportarReportes() {
         });
 }
 
+function iniciarEventos(trabajoId) {
+    cerrarEventos();
+    let hostsEncontrados = 0;
+    fuenteEventos = new EventSource(`${API_BASE_URL}/api/escaneos/${trabajoId}/eventos`);
+
+    fuenteEventos.addEventListener('progreso', e => {
+        const datos = JSON.parse(e.data);
+        let texto = `Escaneando... ${datos.porcentaje.toFixed(1)}%`;
+        if (datos.restante) {
+            texto += ` (quedan ~${datos.restante}s)`;
+        }
+        if (hostsEncontrados) {
+            texto += ` - ${hostsEncontrados} hosts encontrados`;
+        }
+        mostrarEstado('scanning', texto);
+    });
+
+    fuenteEventos.addEventListener('host', () => {
+        hostsEncontrados++;
+    });
+
+    fuenteEventos.addEventListener('mensaje', e => {
+        mostrarEstado('scanning', JSON.parse(e.data).mensaje);
+    });
+
+    fuenteEventos.addEventListener('fin', e => {
+        const datos = JSON.parse(e.data);
+        cerrarEventos();
+        const btn = document.getElementById('btnEscanear');
+        btn.disabled = false;
+        btn.textContent = 'Iniciar Escaneo';
+        document.getElementById('btnDetener').disabled = true;
+
+        if (datos.estado === 'completado' && datos.reporte_id) {
+            mostrarEstado('completed', datos.mensaje);
+            mostrarReporte(datos.reporte_id);
+            actualizarReportes();
+        } else if (datos.mensaje) {
+            mostrarEstado('error', datos.mensaje);
+        }
+    });
+
+    fuenteEventos.onerror = () => {
+        // Si el flujo no está disponible, volver al sondeo de /api/estado
+        if (fuenteEventos && fuenteEventos.readyState === EventSource.CLOSED) {
+            cerrarEventos();
+            iniciarMonitoreo();
+        }
+    };
+
+    const btn = document.getElementById('btnEscanear');
+    btn.disabled = true;
+    btn.textContent = 'Escaneando...';
+}
+
+function cerrarEventos() {
+    if (fuenteEventos) {
+        fuenteEventos.close();
+        fuenteEventos = null;
+    }
+}
+
 function iniciarMonitoreo() {
     if (intervaloBusqueda) {
         clearInterval(intervaloBusqueda);
@@ -300,13 +369,8 @@ function mostrarReporte(reporteId) {
         });
 }
 
-function actualizarReportes() {
-    fetch(`${API_BASE_URL}/api/reportes`)
-        .then(res => res.json())
-        .then(data => {
-            const lista = document.getElementById('listaReportes');
-            if (data.success && data.reportes.length > 0) {
-                lista.innerHTML = data.reportes.map(r => `
+function tarjetaReporte(r) {
+    return `
                     <div style="border: 1px solid #ccc; margin: 10px 0; padding: 10px; border-radius: 5px;">
                         <div style="margin-bottom: 10px;">
                             <strong>${r.nombre}</strong><br>
@@ -323,17 +387,42 @@ function actualizarReportes() {
                             <button onclick="eliminarReporte('${r.id}', '${r.nombre}')" style="background-color: #ff4444; color: white;">Eliminar</button>
                         </div>
                     </div>
-                `).join('');
-                
-                if (data.reportes.length > 1) {
-                    lista.innerHTML += `
-                        <div style="margin-top: 20px; padding: 10px; text-align: center;">
-                            <button onclick="limpiarTodosReportes()" style="background-color: #ff6666; color: white; padding: 10px 20px;">
-                                Eliminar todos los reportes (${data.reportes.length})
-                            </button>
-                        </div>
-                    `;
+                `;
+}
+
+function actualizarReportes(cursor) {
+    const url = cursor
+        ? `${API_BASE_URL}/api/reportes?cursor=${encodeURIComponent(cursor)}`
+        : `${API_BASE_URL}/api/reportes`;
+    fetch(url)
+        .then(res => res.json())
+        .then(data => {
+            const lista = document.getElementById('listaReportes');
+            const pie = document.getElementById('pieReportes');
+            if (pie) pie.remove();
+
+            if (data.success && (cursor || data.reportes.length > 0)) {
+                const tarjetas = data.reportes.map(tarjetaReporte).join('');
+                if (cursor) {
+                    lista.insertAdjacentHTML('beforeend', tarjetas);
+                } else {
+                    lista.innerHTML = tarjetas;
                 }
+                siguienteReportes = data.siguiente;
+
+                const cargarMas = siguienteReportes
+                    ? `<button onclick="actualizarReportes(siguienteReportes)" style="padding: 10px 20px; margin-bottom: 10px;">
+                           Cargar más reportes
+                       </button><br>`
+                    : '';
+                lista.insertAdjacentHTML('beforeend', `
+                    <div id="pieReportes" style="margin-top: 20px; padding: 10px; text-align: center;">
+                        ${cargarMas}
+                        <button onclick="limpiarTodosReportes()" style="background-color: #ff6666; color: white; padding: 10px 20px;">
+                            Eliminar todos los reportes
+                        </button>
+                    </div>
+                `);
             } else {
                 lista.innerHTML = '<div style="padding: 20px; text-align: center; color: #666;">No hay reportes disponibles</div>';
             }
@@ -1,29 +1,43 @@
 import os
-import nmap
+import json
+import hashlib
+import ipaddress
+import multiprocessing
+import queue
 from datetime import datetime
-from flask import Flask, jsonify, request, Response
+from flask import Flask, g, jsonify, request, Response
 from flask_cors import CORS
 import threading
 import uuid
 import signal
 import sys
+import time
+
+import almacen
+import descubrimiento
+import exportacion
+import fragmentos
+import incremental
+import lotes
+import metricas
+import modelo
+import motor_asyncio
+import notificaciones
+import perfiles
+import planificador
+import presupuesto
+import rendimiento
+import respuestas
+import retencion
+import sondeo_http
+import trabajos
 
 app = Flask(__name__)
 CORS(app)  # Permitir CORS para el frontend
 
-# Estado global del escaneo
-estado_escaneo = {
-    "en_progreso": False,
-    "ultimo_reporte": None,
-    "mensaje": "",
-    "proceso_actual": None,
-}
-
-# Almacenamiento en memoria de los reportes
-reportes_memoria = {}
-
-# Variable para controlar el hilo de escaneo
-hilo_escaneo_actual = None
+# Motores de escaneo: nmap o el escaneo TCP connect propio con asyncio
+MOTORES = ("nmap", "asyncio")
+MOTOR_POR_DEFECTO = os.environ.get("MOTOR_POR_DEFECTO", "nmap")
 
 
 def generar_argumentos_nmap(tipo_escaneo, puerto, scripts, argumentos_extra=None):
@@ -102,151 +116,455 @@ def generar_argumentos_nmap(tipo_escaneo, puerto, scripts, argumentos_extra=None
     return args
 
 
+def clave_escaneo(host, args_nmap, motor="nmap"):
+    """
+    Clave normalizada de un escaneo: los mismos objetivos y argumentos dan
+    la misma clave aunque cambie el orden de los objetivos o de los puertos
+    """
+    objetivos = sorted(set(host.split()))
+    argumentos = []
+    for anterior, arg in zip([None] + list(args_nmap), args_nmap):
+        if anterior == "-p":
+            arg = ",".join(sorted(set(arg.split(","))))
+        argumentos.append(arg)
+    partes = [objetivos, argumentos]
+    # Los otros motores no ejecutan scripts NSE: sus reportes no son intercambiables
+    if motor != "nmap":
+        partes.append(motor)
+    return hashlib.sha1(json.dumps(partes).encode("utf-8")).hexdigest()
+
+
 def ejecutar_escaneo(
     host,
     puerto="5000",
     scripts="http-headers,http-title",
     tipo_escaneo="basico",
     argumentos_extra=None,
+    trabajo_id=None,
+    fragmentar=False,
+    tamano_fragmento=None,
+    porciones_puertos=None,
+    separar_protocolos=True,
+    reescaneo_incremental=False,
+    descubrimiento_previo=None,
+    perfil=None,
+    motor="nmap",
+    medicion=None,
 ):
-    """Ejecuta el escaneo en un hilo separado"""
-    global estado_escaneo, reportes_memoria
+    """
+    Ejecuta el escaneo dentro de un hilo trabajador y devuelve el ID del
+    reporte; si recibe una medición (ver rendimiento.py), marca cada fase
+    """
+
+    trabajos.actualizar_trabajo(
+        trabajo_id,
+        mensaje=f"Iniciando escaneo {tipo_escaneo} a {host}:{puerto}...",
+    )
 
-    try:
-        estado_escaneo["en_progreso"] = True
-        estado_escaneo["mensaje"] = (
-            f"Iniciando escaneo {tipo_escaneo} a {host}:{puerto}..."
+    print(f"[+] Iniciando escaneo {tipo_escaneo} al host {host}...")
+
+    # Generar argumentos específicos según el tipo de escaneo
+    args_nmap = generar_argumentos_nmap(tipo_escaneo, puerto, scripts, argumentos_extra)
+    # La clave no incluye las opciones de tiempo, que cambian según lo aprendido
+    clave = clave_escaneo(host, args_nmap, motor)
+
+    # http-title, http-headers y ssl-cert se sondean sin NSE tras el escaneo
+    scripts_nativos = []
+    if sondeo_http.SONDEO_HTTP_NATIVO:
+        args_nmap, scripts_nativos = sondeo_http.separar_scripts(args_nmap)
+
+    # Opciones de tiempo según lo aprendido de escaneos anteriores de estas redes
+    args_tiempo, ajustes_tiempo = perfiles.argumentos_perfil(
+        host, tipo_escaneo, args_nmap, perfil
+    )
+    if ajustes_tiempo:
+        args_nmap = args_nmap + args_tiempo
+        trabajos.actualizar_trabajo(trabajo_id, perfil_aplicado=ajustes_tiempo)
+        print(f"[+] Perfil de tiempo aplicado: {' '.join(args_tiempo)}")
+    argumentos_str = " ".join(args_nmap)
+
+    # El reescaneo incremental parte del último reporte completo del mismo escaneo
+    base = None
+    if reescaneo_incremental:
+        base_id = almacen.buscar_reporte_anterior(clave)
+        base = almacen.obtener_reporte(base_id) if base_id else None
+        if base is None:
+            print("[!] No hay reporte anterior: el escaneo incremental será completo")
+
+    # Descubrimiento previo de hosts: por defecto en los tipos más lentos
+    if descubrimiento_previo is None:
+        descubrimiento_previo = tipo_escaneo in descubrimiento.TIPOS_CON_DESCUBRIMIENTO
+    descubrimiento_previo = (
+        descubrimiento_previo
+        and base is None
+        and motor == "nmap"
+        and descubrimiento.aplicable(args_nmap)
+    )
+
+    cancelacion = trabajos.evento_cancelacion(trabajo_id)
+
+    if motor == "asyncio":
+        # El motor asyncio reparte él mismo las conexiones: un único subescaneo,
+        # ajusta su ritmo a la parte del presupuesto que le toque en cada momento
+        def ejecutar_motor(objetivos, argumentos, al_evento):
+            reserva_id, _ = presupuesto.reservar(objetivos, ajustable=True)
+            try:
+                return motor_asyncio.ejecutar_escaneo_conexion(
+                    objetivos,
+                    argumentos,
+                    al_evento,
+                    cancelacion,
+                    cuota=lambda: presupuesto.cuota(reserva_id),
+                )
+            finally:
+                presupuesto.liberar(reserva_id)
+
+        subescaneos = [
+            {"objetivos": host, "argumentos": argumentos_str, "protocolo": None}
+        ]
+    else:
+        # Cada proceso nmap arranca con su parte del presupuesto de tráfico
+        ejecutar_motor = presupuesto.ejecutar_nmap
+
+        # Repartir objetivos, puertos y protocolos en subescaneos independientes
+        subescaneos = fragmentos.planificar_subescaneos(
+            host,
+            args_nmap,
+            fragmentar=fragmentar,
+            tamano_fragmento=tamano_fragmento,
+            porciones_puertos=porciones_puertos,
+            separar=separar_protocolos,
         )
 
-        print(f"[+] Iniciando escaneo {tipo_escaneo} al host {host}...")
+    # Progreso agregado de todos los subescaneos para los clientes en vivo
+    progreso_subescaneos = {}
+    lock_progreso = threading.Lock()
+
+    def registrar_progreso(subescaneo, datos):
+        with lock_progreso:
+            progreso_subescaneos[id(subescaneo)] = datos
+            porcentaje = sum(
+                p["porcentaje"] for p in progreso_subescaneos.values()
+            ) / len(subescaneos)
+            restante = max(p["restante"] for p in progreso_subescaneos.values())
+        progreso = {
+            "porcentaje": round(porcentaje, 2),
+            "restante": restante,
+            "tarea": datos.get("tarea", ""),
+            "subescaneos": len(subescaneos),
+        }
+        trabajos.actualizar_trabajo(trabajo_id, progreso=progreso)
+        trabajos.publicar_evento(trabajo_id, "progreso", progreso)
+
+    def al_evento_nmap(subescaneo, tipo, datos):
+        if tipo == "progreso":
+            registrar_progreso(subescaneo, datos)
+        elif tipo == "proceso":
+            trabajos.registrar_proceso(trabajo_id, datos["pid"])
+        elif tipo == "fin_proceso":
+            trabajos.liberar_proceso(trabajo_id, datos["pid"])
+        elif tipo == "etapa":
+            trabajos.actualizar_trabajo(trabajo_id, etapas=datos)
+            trabajos.publicar_evento(trabajo_id, tipo, datos)
+        else:
+            trabajos.publicar_evento(trabajo_id, tipo, datos)
+
+    rendimiento.marcar(medicion, "preparacion")
+
+    # Hosts que pasan al modelo según nmap los termina (solo sin subescaneos
+    # que combinar): el resultado de nmap se queda en las estadísticas
+    hosts_modelo = None
+    medidas_red = {}
+    pendientes_sondeo = []
+
+    def al_host(direccion, datos):
+        host_modelo = modelo.Host.desde_nmap(direccion, datos)
+        hosts_modelo.append(host_modelo)
+        perfiles.acumular_medidas(medidas_red, direccion, datos)
+        if scripts_nativos:
+            pendientes_sondeo.extend(
+                sondeo_http.pendientes_modelo(
+                    host_modelo, sondeo_http.nombre_host(direccion, datos)
+                )
+            )
 
-        # Inicializar el escáner Nmap
-        escaner = nmap.PortScanner()
+    if base is not None:
+        # Fase 1: comprobar los puertos conocidos y una muestra del resto
+        args_comprobacion, comprobados = incremental.planificar_comprobacion(
+            base["escaneo"], args_nmap
+        )
+        if motor == "asyncio" and "-sn" in args_comprobacion:
+            # Sin puertos que comprobar quedaría un -sn, que el motor asyncio
+            # no hace: los hosts activos del reporte anterior se dan por iguales
+            print(
+                f"[+] Escaneo incremental sobre el reporte {base['id']}: "
+                "sin puertos que comprobar"
+            )
+            comprobacion = incremental.comprobacion_omitida(base["escaneo"])
+            cambiados = []
+            sin_cambios = sorted(incremental.puertos_conocidos(base["escaneo"]))
+        else:
+            fase = {
+                "objetivos": host,
+                "argumentos": " ".join(args_comprobacion),
+                "protocolo": None,
+                "grupo": 0,
+            }
+            subescaneos = [fase]
+            trabajos.actualizar_trabajo(
+                trabajo_id,
+                mensaje=f"Escaneo incremental: comprobando "
+                f"{sum(len(p) for p in comprobados.values())} puertos...",
+            )
+            print(
+                f"[+] Escaneo incremental sobre el reporte {base['id']}: "
+                f"nmap {fase['argumentos']} {host}"
+            )
+            comprobacion = ejecutar_motor(
+                host,
+                fase["argumentos"],
+                lambda tipo, datos: al_evento_nmap(fase, tipo, datos),
+            )
+            cambiados, sin_cambios = incremental.hosts_cambiados(
+                base["escaneo"], comprobacion
+            )
+        print(
+            f"[+] Escaneo incremental: {len(cambiados)} host(s) con cambios, "
+            f"{len(sin_cambios)} sin cambios"
+        )
 
-        # Generar argumentos específicos según el tipo de escaneo
-        args_nmap = generar_argumentos_nmap(
-            tipo_escaneo, puerto, scripts, argumentos_extra
+        # Fase 2: escaneo completo solo de los hosts que cambiaron
+        completo = None
+        if (
+            cambiados
+            and not cancelacion.is_set()
+            and not comprobacion["nmap"].get("parcial")
+        ):
+            fase = {
+                "objetivos": " ".join(cambiados),
+                "argumentos": argumentos_str,
+                "protocolo": None,
+                "grupo": 0,
+            }
+            subescaneos = [fase]
+            trabajos.actualizar_trabajo(
+                trabajo_id,
+                mensaje=f"Escaneo incremental: reescaneando {len(cambiados)} "
+                "host(s) con cambios...",
+            )
+            print(f"[+] Ejecutando: nmap {argumentos_str} {fase['objetivos']}")
+            completo = ejecutar_motor(
+                fase["objetivos"],
+                argumentos_str,
+                lambda tipo, datos: al_evento_nmap(fase, tipo, datos),
+            )
+        resultado = completo or comprobacion
+    elif descubrimiento_previo:
+        # Los hosts activos pasan al escaneo de puertos según se descubren
+        subescaneos = []
+        trabajos.actualizar_trabajo(
+            trabajo_id,
+            mensaje=f"Escaneo {tipo_escaneo}: descubriendo hosts activos...",
+        )
+        print(
+            f"[+] Descubriendo hosts: nmap {descubrimiento.ARGUMENTOS_DESCUBRIMIENTO} "
+            f"{host}, después nmap {argumentos_str} -Pn <host> por cada host activo"
+        )
+
+        def al_completar_host(subescaneo, resultado, completados):
+            registrar_progreso(subescaneo, {"porcentaje": 100.0, "restante": 0})
+            trabajos.actualizar_trabajo(
+                trabajo_id,
+                mensaje=f"Escaneo {tipo_escaneo}: {len(completados)}/"
+                f"{len(subescaneos) - 1} subescaneos de hosts activos completados",
+            )
+
+        reserva_id, cuota = presupuesto.reservar(host)
+        try:
+            resultado, etapas = descubrimiento.escanear_con_descubrimiento(
+                host,
+                args_nmap,
+                subescaneos,
+                al_evento_nmap,
+                al_completar_host,
+                cancelacion,
+                porciones_puertos=porciones_puertos,
+                separar=separar_protocolos,
+                cuota=cuota,
+            )
+        finally:
+            presupuesto.liberar(reserva_id)
+        print(
+            f"[+] Descubrimiento: {etapas['hosts_descubiertos']}/"
+            f"{etapas['direcciones']} hosts activos en {etapas['descubrimiento']}s; "
+            f"escaneo de puertos {etapas['escaneo_puertos']}s; "
+            f"total {etapas['total']}s"
+        )
+    elif len(subescaneos) > 1:
+        trabajos.actualizar_trabajo(
+            trabajo_id,
+            mensaje=f"Ejecutando escaneo {tipo_escaneo} en "
+            f"{len(subescaneos)} subescaneos...",
+        )
+        print(
+            f"[+] Ejecutando: nmap {argumentos_str} {host} "
+            f"({len(subescaneos)} subescaneos en paralelo)"
         )
-        argumentos_str = " ".join(args_nmap)
 
-        estado_escaneo["mensaje"] = f"Ejecutando escaneo {tipo_escaneo}..."
-        print(f"[+] Ejecutando: nmap {argumentos_str} {host}")
+        total_tcp = sum(1 for sub in subescaneos if sub["protocolo"] == "tcp")
+        inicio = time.time()
+
+        def al_completar_subescaneo(subescaneo, resultado, completados):
+            registrar_progreso(subescaneo, {"porcentaje": 100.0, "restante": 0})
+            trabajos.actualizar_trabajo(
+                trabajo_id,
+                mensaje=f"Escaneo {tipo_escaneo}: {len(completados)}/"
+                f"{len(subescaneos)} subescaneos completados",
+            )
+            # Publicar los resultados TCP sin esperar a los UDP
+            tcp = [(sub, res) for sub, res in completados if sub["protocolo"] == "tcp"]
+            if (
+                subescaneo["protocolo"] == "tcp"
+                and len(tcp) == total_tcp
+                and len(completados) < len(subescaneos)
+            ):
+                parcial = fragmentos.combinar_resultados(
+                    [res for _, res in tcp],
+                    elapsed=time.time() - inicio,
+                    grupos=[sub["grupo"] for sub, _ in tcp],
+                )
+                trabajos.actualizar_trabajo(
+                    trabajo_id,
+                    mensaje=f"Escaneo {tipo_escaneo}: resultados TCP disponibles, "
+                    "esperando UDP...",
+                    reporte_parcial=modelo.Escaneo.desde_nmap(
+                        parcial,
+                        host,
+                        puerto,
+                        scripts,
+                        tipo_escaneo,
+                        argumentos_str,
+                        datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                    ).texto(),
+                )
+
+        reserva_id, cuota = presupuesto.reservar(host)
+        try:
+            completados = fragmentos.ejecutar_subescaneos(
+                subescaneos,
+                al_completar_subescaneo,
+                al_evento_nmap,
+                cancelacion,
+                ejecutor=presupuesto.ejecutor_fragmentos(
+                    cuota, min(len(subescaneos), fragmentos.PARALELISMO_FRAGMENTOS)
+                ),
+            )
+        finally:
+            presupuesto.liberar(reserva_id)
+        resultado = fragmentos.combinar_resultados(
+            [res for _, res in completados],
+            elapsed=time.time() - inicio,
+            grupos=[sub["grupo"] for sub, _ in completados],
+        )
+    else:
+        trabajos.actualizar_trabajo(
+            trabajo_id, mensaje=f"Ejecutando escaneo {tipo_escaneo}..."
+        )
+        print(f"[+] Ejecutando ({motor}): nmap {argumentos_str} {host}")
 
         # Ejecutar el escaneo
-        escaner.scan(hosts=host, arguments=argumentos_str)
-
-        # Generar ID único para el reporte
-        reporte_id = str(uuid.uuid4())
-        timestamp = datetime.now()
-        nombre_reporte = f"escaneo_{tipo_escaneo}_{timestamp.strftime('%Y%m%d_%H%M%S')}"
-
-        estado_escaneo["mensaje"] = "Generando reporte..."
-
-        # Generar contenido del reporte
-        contenido_reporte = []
-        contenido_reporte.append("=== REPORTE DE ESCANEO ===")
-        contenido_reporte.append(f"Fecha: {timestamp.strftime('%Y-%m-%d %H:%M:%S')}")
-        contenido_reporte.append(f"Host objetivo: {host}")
-        contenido_reporte.append(f"Puerto(s): {puerto}")
-        contenido_reporte.append(f"Tipo de escaneo: {tipo_escaneo.upper()}")
-        contenido_reporte.append(f"Scripts: {scripts}")
-        contenido_reporte.append(f"Argumentos Nmap: {argumentos_str}")
-        contenido_reporte.append("=" * 50)
-        contenido_reporte.append("")
-
-        # Verificar si hay hosts encontrados
-        if not escaner.all_hosts():
-            contenido_reporte.append(
-                "⚠️  No se encontraron hosts o no se pudo acceder al objetivo."
+        if motor == "nmap":
+            hosts_modelo = []
+            resultado = ejecutar_motor(
+                host,
+                argumentos_str,
+                lambda tipo, datos: al_evento_nmap(subescaneos[0], tipo, datos),
+                al_host,
+            )
+        else:
+            resultado = ejecutar_motor(
+                host,
+                argumentos_str,
+                lambda tipo, datos: al_evento_nmap(subescaneos[0], tipo, datos),
+            )
+
+    rendimiento.marcar(medicion, rendimiento.FASE_MOTOR)
+
+    # Sondeo nativo de los puertos abiertos (en incremental, solo lo reescaneado)
+    sondeado = completo if base is not None else resultado
+    if scripts_nativos and sondeado is not None and not cancelacion.is_set():
+        trabajos.actualizar_trabajo(
+            trabajo_id,
+            mensaje=f"Escaneo {tipo_escaneo}: sondeando servicios HTTP/TLS...",
+        )
+        if hosts_modelo is not None:
+            sondeo = sondeo_http.sondear_modelo(
+                pendientes_sondeo, scripts_nativos, cancelacion
             )
-            contenido_reporte.append("Posibles causas:")
-            contenido_reporte.append("- El host no está accesible")
-            contenido_reporte.append("- Firewall bloqueando el escaneo")
-            contenido_reporte.append("- Dirección IP incorrecta")
-            contenido_reporte.append("")
         else:
-            for host_escaneado in escaner.all_hosts():
-                estado_host = escaner[host_escaneado].state()
-                contenido_reporte.append(f"Host: {host_escaneado} ({estado_host})")
-                contenido_reporte.append("-" * 40)
-
-                # Información del host
-                if "hostnames" in escaner[host_escaneado]:
-                    hostnames = escaner[host_escaneado]["hostnames"]
-                    if hostnames:
-                        contenido_reporte.append(
-                            f"Hostnames: {', '.join([h['name'] for h in hostnames])}"
-                        )
-
-                # Información de protocolos
-                for protocolo in escaner[host_escaneado].all_protocols():
-                    contenido_reporte.append(f"Protocolo: {protocolo.upper()}")
-                    puertos = escaner[host_escaneado][protocolo].keys()
-                    puertos_ordenados = sorted(puertos)
-
-                    if not puertos_ordenados:
-                        contenido_reporte.append("  No se encontraron puertos abiertos")
-                        continue
-
-                    for puerto_encontrado in puertos_ordenados:
-                        info = escaner[host_escaneado][protocolo][puerto_encontrado]
-                        estado_puerto = info["state"]
-
-                        # Formatear información del puerto
-                        linea_puerto = (
-                            f"  Puerto {puerto_encontrado}/{protocolo}: {estado_puerto}"
-                        )
-
-                        if info.get("name"):
-                            linea_puerto += f" - Servicio: {info['name']}"
-                        if info.get("product"):
-                            linea_puerto += f" - Producto: {info['product']}"
-                        if info.get("version"):
-                            linea_puerto += f" - Versión: {info['version']}"
-                        if info.get("extrainfo"):
-                            linea_puerto += f" - Extra: {info['extrainfo']}"
-
-                        contenido_reporte.append(linea_puerto)
-
-                        # Mostrar resultados de scripts NSE
-                        if "script" in info:
-                            contenido_reporte.append("    Scripts NSE:")
-                            for nombre_script, salida_script in info["script"].items():
-                                contenido_reporte.append(f"      [{nombre_script}]:")
-                                # Formatear la salida del script
-                                lineas_script = salida_script.strip().split("\n")
-                                for linea in lineas_script:
-                                    contenido_reporte.append(f"        {linea}")
-                            contenido_reporte.append("")
-
-                # Información adicional para escaneos intensivos
-                if tipo_escaneo == "intensivo":
-                    if "osmatch" in escaner[host_escaneado]:
-                        os_matches = escaner[host_escaneado]["osmatch"]
-                        if os_matches:
-                            contenido_reporte.append("Detección de Sistema Operativo:")
-                            for os_match in os_matches[:3]:  # Top 3 matches
-                                contenido_reporte.append(
-                                    f"  - {os_match['name']} (Precisión: {os_match['accuracy']}%)"
-                                )
-                            contenido_reporte.append("")
-
-                contenido_reporte.append("")
-
-        # Estadísticas del escaneo
-        contenido_reporte.append("=== ESTADÍSTICAS DEL ESCANEO ===")
-        contenido_reporte.append(f"Comando ejecutado: nmap {argumentos_str} {host}")
-        contenido_reporte.append(f"Duración: {escaner.scanstats()['timestr']}")
-        contenido_reporte.append(f"Hosts totales: {escaner.scanstats()['totalhosts']}")
-        contenido_reporte.append(f"Hosts activos: {escaner.scanstats()['uphosts']}")
-        contenido_reporte.append(f"Hosts inactivos: {escaner.scanstats()['downhosts']}")
-
-        # Almacenar reporte en memoria
-        contenido_completo = "\n".join(contenido_reporte)
-        reportes_memoria[reporte_id] = {
+            sondeo = sondeo_http.sondear(sondeado, scripts_nativos, cancelacion)
+        print(
+            f"[+] Sondeo nativo ({','.join(scripts_nativos)}): "
+            f"{sondeo['puertos']} puertos abiertos en {sondeo['segundos']}s"
+        )
+        rendimiento.marcar(medicion, "sondeo_http")
+
+    # Hosts y puertos recorridos, para las tasas de /metrics
+    for recorrido in (comprobacion, completo) if base is not None else (resultado,):
+        if recorrido is not None and not recorrido["nmap"].get("omitida"):
+            metricas.contar_resultado(recorrido, tipo_escaneo)
+
+    # Si se canceló, el reporte solo recoge lo que llegó a completarse
+    cancelado = cancelacion.is_set()
+    if cancelado:
+        resultado["nmap"]["parcial"] = True
+    parcial = bool(resultado["nmap"].get("parcial"))
+
+    # Generar ID único para el reporte
+    reporte_id = str(uuid.uuid4())
+    timestamp = datetime.now()
+    nombre_reporte = f"escaneo_{tipo_escaneo}_{timestamp.strftime('%Y%m%d_%H%M%S')}"
+    if parcial:
+        nombre_reporte += "_parcial"
+
+    if not cancelado:
+        trabajos.actualizar_trabajo(trabajo_id, mensaje="Generando reporte...")
+
+    # Pasar el resultado al modelo compacto (el texto se genera al pedirlo)
+    if base is not None:
+        escaneo = incremental.componer_escaneo(
+            base["escaneo"],
+            base["id"],
+            comprobacion,
+            completo,
+            sin_cambios,
+            host,
+            puerto,
+            scripts,
+            tipo_escaneo,
+            argumentos_str,
+            timestamp.strftime("%Y-%m-%d %H:%M:%S"),
+        )
+    else:
+        escaneo = modelo.Escaneo.desde_nmap(
+            resultado,
+            host,
+            puerto,
+            scripts,
+            tipo_escaneo,
+            argumentos_str,
+            timestamp.strftime("%Y-%m-%d %H:%M:%S"),
+            hosts=hosts_modelo,
+        )
+
+    rendimiento.marcar(medicion, "modelo")
+
+    # Guardar el reporte en el almacén persistente
+    almacen.guardar_reporte(
+        {
             "id": reporte_id,
             "nombre": nombre_reporte,
-            "contenido": contenido_completo,
+            "escaneo": escaneo,
             "fecha": timestamp.strftime("%Y-%m-%d %H:%M:%S"),
             "timestamp": timestamp.isoformat(),
             "host": host,
@@ -254,29 +572,158 @@ def ejecutar_escaneo(
             "scripts": scripts,
             "tipo": tipo_escaneo,
             "argumentos": argumentos_str,
-            "tamaño": len(contenido_completo.encode("utf-8")),
+            "parcial": parcial,
+            # Solo se reutilizan los completos (la búsqueda filtra por parcial);
+            # la clave de los parciales sirve para compararlos con el anterior
+            "clave": clave,
         }
+    )
+
+    rendimiento.marcar(medicion, "almacenamiento")
+
+    # Aprender las medidas de red (la comprobación incremental no es representativa)
+    if not parcial and base is None:
+        try:
+            perfiles.registrar(
+                resultado,
+                tipo_escaneo,
+                medidas_red if hosts_modelo is not None else None,
+            )
+        except Exception as e:
+            print(f"[!] No se pudo actualizar el perfil de red: {e}")
+        rendimiento.marcar(medicion, "perfiles")
 
-        estado_escaneo["ultimo_reporte"] = reporte_id
-        estado_escaneo["mensaje"] = (
-            f"Escaneo {tipo_escaneo} completado. Reporte: {nombre_reporte}"
+    if cancelado:
+        mensaje_final = (
+            f"Escaneo detenido por el usuario. Reporte parcial: {nombre_reporte}"
         )
-        print(
-            f"[✓] Escaneo completado. Reporte almacenado en memoria con ID: {reporte_id}"
+    else:
+        mensaje_final = f"Escaneo {tipo_escaneo} completado. Reporte: {nombre_reporte}"
+    trabajos.actualizar_trabajo(trabajo_id, mensaje=mensaje_final, reporte_parcial=None)
+    if cancelado:
+        print(f"[!] Escaneo detenido. Reporte parcial almacenado con ID: {reporte_id}")
+    else:
+        print(f"[✓] Escaneo completado. Reporte almacenado con ID: {reporte_id}")
+
+    return reporte_id
+
+
+def ejecutar_trabajo(trabajo_id, parametros):
+    """Adaptador entre la cola de trabajos y ejecutar_escaneo"""
+    inicio = time.time()
+    estado = "error"
+    reporte_id = None
+    medicion = rendimiento.iniciar(parametros.get("perfilar"))
+    try:
+        reporte_id = ejecutar_escaneo(
+            parametros["host"],
+            parametros["puerto"],
+            parametros["scripts"],
+            parametros["tipo"],
+            parametros["argumentos"],
+            trabajo_id=trabajo_id,
+            fragmentar=parametros.get("fragmentar", False),
+            tamano_fragmento=parametros.get("tamano_fragmento"),
+            porciones_puertos=parametros.get("porciones_puertos"),
+            separar_protocolos=parametros.get("separar_protocolos", True),
+            reescaneo_incremental=parametros.get("incremental", False),
+            descubrimiento_previo=parametros.get("descubrimiento"),
+            perfil=parametros.get("perfil"),
+            motor=parametros.get("motor", "nmap"),
+            medicion=medicion,
         )
+        cancelado = trabajos.evento_cancelacion(trabajo_id).is_set()
+        estado = "cancelado" if cancelado else "completado"
+        return reporte_id
+    finally:
+        metricas.observar(
+            "escaneo_duracion_segundos",
+            time.time() - inicio,
+            tipo=parametros["tipo"],
+            motor=parametros.get("motor", "nmap"),
+            estado=estado,
+        )
+        registrar_rendimiento(trabajo_id, reporte_id, parametros, medicion)
 
-    except Exception as e:
-        estado_escaneo["mensaje"] = f"Error durante el escaneo: {str(e)}"
-        print(f"[!] Error: {e}")
 
-    finally:
-        estado_escaneo["en_progreso"] = False
-        estado_escaneo["proceso_actual"] = None
+def registrar_rendimiento(trabajo_id, reporte_id, parametros, medicion):
+    """Guarda los tiempos de las fases de un escaneo en su trabajo y su reporte"""
+    resumen = rendimiento.terminar(medicion)
+    for fase, segundos in resumen["fases"].items():
+        metricas.observar(
+            "escaneo_fase_segundos", segundos, fase=fase, tipo=parametros["tipo"]
+        )
+    trabajos.actualizar_trabajo(trabajo_id, rendimiento=resumen)
+    if reporte_id is not None:
+        try:
+            almacen.guardar_rendimiento(reporte_id, resumen)
+        except Exception as e:
+            print(f"[!] No se pudo guardar el rendimiento del escaneo: {e}")
+    print(
+        f"[+] Rendimiento: {resumen['total']}s en total, "
+        f"{resumen['fuera_del_motor']}s fuera del motor "
+        + " ".join(f"{fase}={segundos}s" for fase, segundos in resumen["fases"].items())
+    )
+
+
+def indicadores_worker():
+    """Indicadores de este worker para /metrics"""
+    cuenta = trabajos.contar_trabajos()
+    return {
+        "cola_trabajos": cuenta["en_cola"],
+        "trabajos_en_progreso": cuenta["en_progreso"],
+        "procesos_nmap_activos": trabajos.contar_procesos(),
+    }
+
+
+trabajos.configurar_ejecutor(ejecutar_trabajo)
+
+
+def avisar_fin_trabajo(vista):
+    """
+    Anota el fin de un trabajo en sus lotes y en sus programaciones y avisa a
+    sus webhooks
+    """
+    lotes.registrar_fin(vista)
+    planificador.trabajo_terminado(vista)
+    notificaciones.avisar_fin(vista)
+
+
+trabajos.configurar_al_terminar(avisar_fin_trabajo)
+lotes.configurar_lanzador(lambda parametros, forzar: lanzar_escaneo(parametros, forzar))
+planificador.configurar_lanzador(lambda parametros: lanzar_escaneo(parametros)[0])
+# Los procesos del pool de fragmentos importan este módulo: no deben planificar
+metricas.configurar_indicadores(indicadores_worker)
+if multiprocessing.parent_process() is None:
+    presupuesto.limpiar_reservas()
+    planificador.iniciar_planificador()
+    metricas.iniciar_volcado()
+    retencion.iniciar_retencion()
 
 
 # === RUTAS DE LA API ===
 
 
+@app.before_request
+def medir_inicio_peticion():
+    g.inicio_peticion = time.perf_counter()
+
+
+@app.after_request
+def medir_peticion(respuesta):
+    """Registra la latencia de cada petición por ruta (la plantilla, no la URL)"""
+    inicio = g.pop("inicio_peticion", None)
+    if inicio is not None:
+        metricas.observar(
+            "http_peticion_duracion_segundos",
+            time.perf_counter() - inicio,
+            ruta=request.url_rule.rule if request.url_rule else "desconocida",
+            metodo=request.method,
+            codigo=respuesta.status_code,
+        )
+    return respuesta
+
+
 @app.route("/api/health", methods=["GET"])
 def health_check():
     """Endpoint para verificar que la API está funcionando"""
@@ -285,37 +732,90 @@ def health_check():
             "status": "ok",
             "message": "API funcionando correctamente",
             "timestamp": datetime.now().isoformat(),
-            "reportes_en_memoria": len(reportes_memoria),
-            "escaneo_en_progreso": estado_escaneo["en_progreso"],
+            "reportes_almacenados": almacen.contar_reportes(),
+            "escaneo_en_progreso": trabajos.estado_compatible()["en_progreso"],
+            "trabajos": trabajos.contar_trabajos(),
         }
     )
 
 
-@app.route("/api/escanear", methods=["POST"])
-def iniciar_escaneo():
-    """Inicia un nuevo escaneo"""
-    if estado_escaneo["en_progreso"]:
-        return (
-            jsonify({"success": False, "message": "Ya hay un escaneo en progreso"}),
-            400,
-        )
+@app.route("/metrics", methods=["GET"])
+def exponer_metricas():
+    """Métricas en formato Prometheus, sumadas entre todos los workers"""
+    return Response(
+        metricas.exponer(), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
 
-    datos = request.get_json()
-    if not datos:
-        return (
-            jsonify({"success": False, "message": "No se recibieron datos JSON"}),
-            400,
-        )
 
+def leer_booleano(datos, clave, defecto):
+    """
+    Lee una opción booleana de la petición sin convertir otros tipos (el
+    texto "false" no debe activarla)
+
+    Raises:
+        ValueError: Si el valor no es true, false o null
+    """
+    valor = datos.get(clave)
+    if valor is None:
+        return defecto
+    if not isinstance(valor, bool):
+        raise ValueError(f"{clave} debe ser true o false")
+    return valor
+
+
+def validar_parametros_escaneo(datos):
+    """
+    Valida la petición de un escaneo y la convierte en los parámetros del
+    trabajo (los de ejecutar_trabajo)
+
+    Returns:
+        dict: Parámetros del trabajo
+
+    Raises:
+        ValueError: Con el mensaje para el cliente si algo no es válido
+    """
     host = datos.get("host", "127.0.0.1")
     puerto = datos.get("puerto", "5000")
     scripts = datos.get("scripts", "http-headers,http-title")
     tipo_escaneo = datos.get("tipo", "basico")
     argumentos_extra = datos.get("argumentos", None)
+    fragmentar = leer_booleano(datos, "fragmentar", False)
+    tamano_fragmento = datos.get("tamano_fragmento", None)
+    porciones_puertos = datos.get("porciones_puertos", None)
+    separar_protocolos = leer_booleano(datos, "separar_protocolos", True)
+    reescaneo_incremental = leer_booleano(datos, "incremental", False)
+    descubrimiento_previo = leer_booleano(datos, "descubrimiento", None)
+    perfil = datos.get("perfil", None)
+    motor = datos.get("motor", MOTOR_POR_DEFECTO)
+    perfilar = leer_booleano(datos, "perfilar", None)
+    webhook = datos.get("webhook", None)
 
     # Validar entrada
     if not host:
-        return jsonify({"success": False, "message": "Debe especificar un host"}), 400
+        raise ValueError("Debe especificar un host")
+
+    # Validar parámetros de paralelismo
+    for nombre, valor in (
+        ("tamano_fragmento", tamano_fragmento),
+        ("porciones_puertos", porciones_puertos),
+    ):
+        if valor is None:
+            continue
+        try:
+            if int(valor) < 1:
+                raise ValueError
+        except (TypeError, ValueError):
+            raise ValueError(f"{nombre} debe ser un entero positivo")
+
+    # Validar el perfil de tiempo: true/null (aprendido), false o valores impuestos
+    if perfil is True:
+        perfil = None
+    elif perfil is not None and perfil is not False:
+        perfil = perfiles.validar_ajuste(perfil)
+
+    # URL a la que avisar cuando termine
+    if webhook is not None:
+        webhook = notificaciones.validar_url(webhook)
 
     # Validar tipo de escaneo
     tipos_validos = [
@@ -329,53 +829,166 @@ def iniciar_escaneo():
         "personalizado",
     ]
     if tipo_escaneo not in tipos_validos:
+        raise ValueError(
+            f"Tipo de escaneo inválido. Tipos válidos: {', '.join(tipos_validos)}"
+        )
+
+    # El motor asyncio solo sabe hacer escaneos TCP connect
+    if motor not in MOTORES:
+        raise ValueError(f"Motor inválido. Motores válidos: {', '.join(MOTORES)}")
+    if motor == "asyncio":
+        motor_asyncio.interpretar_argumentos(
+            " ".join(
+                generar_argumentos_nmap(tipo_escaneo, puerto, scripts, argumentos_extra)
+            )
+        )
+
+    return {
+        "host": host,
+        "puerto": puerto,
+        "scripts": scripts,
+        "tipo": tipo_escaneo,
+        "argumentos": argumentos_extra,
+        "fragmentar": fragmentar,
+        "tamano_fragmento": tamano_fragmento and int(tamano_fragmento),
+        "porciones_puertos": porciones_puertos and int(porciones_puertos),
+        "separar_protocolos": separar_protocolos,
+        "incremental": reescaneo_incremental,
+        "descubrimiento": descubrimiento_previo,
+        "perfil": perfil,
+        "motor": motor,
+        "perfilar": perfilar,
+        "webhook": webhook,
+    }
+
+
+def lanzar_escaneo(parametros, forzar=False):
+    """
+    Reutiliza el reporte de un escaneo idéntico reciente, se une a uno
+    idéntico en curso o encola uno nuevo
+
+    Returns:
+        tuple: (vista del trabajo, True si se reutilizó un reporte,
+                True si se creó un trabajo nuevo)
+
+    Raises:
+        queue.Full: Si la cola de escaneos está llena
+    """
+    args_nmap = generar_argumentos_nmap(
+        parametros["tipo"],
+        parametros["puerto"],
+        parametros["scripts"],
+        parametros["argumentos"],
+    )
+    clave = clave_escaneo(parametros["host"], args_nmap, parametros["motor"])
+
+    # Reutilizar el reporte de un escaneo idéntico reciente (salvo con force)
+    reporte_id = None if forzar else almacen.buscar_reporte_reciente(clave)
+    if reporte_id:
+        trabajo = trabajos.registrar_trabajo_terminado(
+            parametros,
+            reporte_id,
+            f"Escaneo {parametros['tipo']} reutilizado de un escaneo idéntico reciente",
+        )
+        return trabajo, True, False
+
+    # Encolar el escaneo para el pool de trabajadores, o unirlo a uno
+    # idéntico que ya esté en cola o en progreso
+    trabajo, nuevo = trabajos.encolar_trabajo(parametros, clave=clave, unir=not forzar)
+    # Quien se une a un trabajo en curso también recibe su aviso
+    if not nuevo and parametros.get("webhook"):
+        notificaciones.suscribir(trabajo["id"], parametros["webhook"])
+    return trabajo, False, nuevo
+
+
+@app.route("/api/escanear", methods=["POST"])
+def iniciar_escaneo():
+    """Encola un nuevo escaneo y devuelve el ID del trabajo"""
+    datos = request.get_json()
+    if not datos:
+        return (
+            jsonify({"success": False, "message": "No se recibieron datos JSON"}),
+            400,
+        )
+
+    try:
+        parametros = validar_parametros_escaneo(datos)
+        forzar = leer_booleano(datos, "force", False)
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+
+    try:
+        trabajo, cacheado, nuevo = lanzar_escaneo(parametros, forzar=forzar)
+    except queue.Full:
         return (
             jsonify(
                 {
                     "success": False,
-                    "message": f"Tipo de escaneo inválido. Tipos válidos: {', '.join(tipos_validos)}",
+                    "message": "La cola de escaneos está llena, inténtelo más tarde",
                 }
             ),
-            400,
+            503,
         )
 
-    # Iniciar escaneo en hilo separado
-    global hilo_escaneo_actual
-    hilo_escaneo_actual = threading.Thread(
-        target=ejecutar_escaneo,
-        args=(host, puerto, scripts, tipo_escaneo, argumentos_extra),
-    )
-    hilo_escaneo_actual.daemon = True
-    hilo_escaneo_actual.start()
-
-    return jsonify(
-        {
-            "success": True,
-            "message": f"Escaneo {tipo_escaneo} iniciado",
-            "host": host,
-            "puerto": puerto,
-            "scripts": scripts,
-            "tipo": tipo_escaneo,
-        }
-    )
+    tipo_escaneo = parametros["tipo"]
+    respuesta = {
+        "success": True,
+        "message": trabajo["mensaje"],
+        "id": trabajo["id"],
+        "estado": trabajo["estado"],
+        "cacheado": cacheado,
+        "coalescido": not cacheado and not nuevo,
+        "host": parametros["host"],
+        "puerto": parametros["puerto"],
+        "scripts": parametros["scripts"],
+        "tipo": tipo_escaneo,
+    }
+    if cacheado:
+        respuesta["reporte_id"] = trabajo["reporte_id"]
+    else:
+        respuesta["message"] = (
+            f"Escaneo {tipo_escaneo} iniciado"
+            if nuevo
+            else f"Unido a un escaneo {tipo_escaneo} idéntico en curso"
+        )
+    return jsonify(respuesta)
 
 
 @app.route("/api/detener", methods=["POST"])
 def detener_escaneo():
-    """Detiene el escaneo actual"""
-    global hilo_escaneo_actual
-
-    if not estado_escaneo["en_progreso"]:
+    """Detiene un escaneo concreto (campo "id") o todos los activos"""
+    datos = request.get_json(silent=True) or {}
+    trabajo_id = datos.get("id")
+
+    if trabajo_id:
+        ids = [trabajo_id]
+    else:
+        ids = [
+            t["id"]
+            for t in trabajos.listar_trabajos()
+            if t["estado"] in trabajos.ESTADOS_ACTIVOS
+        ]
+
+    if not ids:
         return jsonify({"success": False, "message": "No hay escaneo en progreso"}), 400
 
     try:
-        # Marcar como detenido
-        estado_escaneo["en_progreso"] = False
-        estado_escaneo["mensaje"] = "Escaneo detenido por el usuario"
+        # Los trabajos en cola no llegan a ejecutarse; en los que están en
+        # progreso se detienen sus procesos nmap y se guarda un reporte parcial
+        detenidos = [i for i in ids if trabajos.cancelar_trabajo(i)]
+        if not detenidos:
+            return (
+                jsonify({"success": False, "message": "No hay escaneo en progreso"}),
+                400,
+            )
 
-        # Nota: Nmap no se puede detener fácilmente una vez iniciado
-        # Este endpoint sirve para marcar el estado como detenido
-        return jsonify({"success": True, "message": "Escaneo marcado como detenido"})
+        return jsonify(
+            {
+                "success": True,
+                "message": "Escaneo detenido",
+                "detenidos": detenidos,
+            }
+        )
 
     except Exception as e:
         return (
@@ -388,21 +1001,308 @@ def detener_escaneo():
 
 @app.route("/api/estado", methods=["GET"])
 def obtener_estado():
-    """Obtiene el estado actual del escaneo"""
-    return jsonify(estado_escaneo)
+    """Obtiene el estado agregado de los escaneos (vista compatible)"""
+    return respuestas.respuesta_json_condicional(jsonify(trabajos.estado_compatible()))
+
+
+@app.route("/api/escaneos", methods=["GET"])
+def listar_escaneos():
+    """Lista los trabajos de escaneo conocidos"""
+    lista = trabajos.listar_trabajos()
+    return jsonify(
+        {
+            "success": True,
+            "escaneos": lista,
+            "total": len(lista),
+            **trabajos.contar_trabajos(),
+        }
+    )
+
+
+@app.route("/api/escaneos/<trabajo_id>", methods=["GET"])
+def obtener_escaneo(trabajo_id):
+    """Obtiene el estado de un trabajo de escaneo concreto"""
+    trabajo = trabajos.obtener_trabajo(trabajo_id)
+    if trabajo is None:
+        return jsonify({"success": False, "message": "Escaneo no encontrado"}), 404
+    return jsonify({"success": True, "escaneo": trabajo})
+
+
+@app.route("/api/escaneos/<trabajo_id>/eventos", methods=["GET"])
+def eventos_escaneo(trabajo_id):
+    """Emite el progreso de un escaneo en vivo como Server-Sent Events"""
+    if trabajos.obtener_trabajo(trabajo_id) is None:
+        return jsonify({"success": False, "message": "Escaneo no encontrado"}), 404
+
+    try:
+        desde = int(request.headers.get("Last-Event-ID", -1)) + 1
+    except ValueError:
+        desde = 0
+
+    def generar():
+        siguiente = desde
+        yield "retry: 3000\n\n"
+        while True:
+            novedades = trabajos.esperar_eventos(trabajo_id, siguiente)
+            if novedades is None:
+                break
+            eventos, terminado = novedades
+
+            if not eventos and not terminado:
+                # Comentario para mantener viva la conexión
+                yield ": ping\n\n"
+            for evento in eventos:
+                siguiente = evento["id"] + 1
+                yield (
+                    f"id: {evento['id']}\n"
+                    f"event: {evento['tipo']}\n"
+                    f"data: {json.dumps(evento['datos'])}\n\n"
+                )
+
+            if terminado and not eventos:
+                trabajo = trabajos.obtener_trabajo(trabajo_id) or {}
+                datos_fin = {
+                    "estado": trabajo.get("estado"),
+                    "mensaje": trabajo.get("mensaje"),
+                    "reporte_id": trabajo.get("reporte_id"),
+                }
+                yield f"event: fin\ndata: {json.dumps(datos_fin)}\n\n"
+                break
+
+    return Response(
+        generar(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.route("/api/lotes", methods=["POST"])
+def crear_lote():
+    """
+    Encola un lote de escaneos: en "escaneos" una lista con los mismos campos
+    que /api/escanear; se validan todos antes de lanzar ninguno. "force"
+    aplica a todos los que no lo indiquen
+    """
+    datos = request.get_json(silent=True)
+    if not datos:
+        return (
+            jsonify({"success": False, "message": "No se recibieron datos JSON"}),
+            400,
+        )
+    especificaciones = datos.get("escaneos")
+    if not isinstance(especificaciones, list) or not especificaciones:
+        return (
+            jsonify(
+                {
+                    "success": False,
+                    "message": 'Debe indicar la lista de escaneos en "escaneos"',
+                }
+            ),
+            400,
+        )
+    if len(especificaciones) > lotes.MAX_ESCANEOS_POR_LOTE:
+        return (
+            jsonify(
+                {
+                    "success": False,
+                    "message": "Un lote admite como máximo "
+                    f"{lotes.MAX_ESCANEOS_POR_LOTE} escaneos",
+                }
+            ),
+            400,
+        )
+
+    try:
+        forzar_todos = leer_booleano(datos, "force", False)
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+
+    escaneos = []
+    errores = []
+    for indice, especificacion in enumerate(especificaciones):
+        if not isinstance(especificacion, dict):
+            errores.append({"indice": indice, "message": "Debe ser un objeto JSON"})
+            continue
+        try:
+            parametros = validar_parametros_escaneo(especificacion)
+            forzar = leer_booleano(especificacion, "force", forzar_todos)
+        except ValueError as e:
+            errores.append({"indice": indice, "message": str(e)})
+            continue
+        escaneos.append((parametros, forzar))
+    if errores:
+        return (
+            jsonify(
+                {
+                    "success": False,
+                    "message": f"{len(errores)} escaneos del lote no son válidos",
+                    "errores": errores,
+                }
+            ),
+            400,
+        )
+
+    lote = lotes.crear_lote(escaneos, nombre=datos.get("nombre"))
+    print(f"[+] Lote {lote['nombre']} aceptado con {lote['total']} escaneos")
+    return jsonify(
+        {
+            "success": True,
+            "message": f"Lote de {lote['total']} escaneos aceptado",
+            "id": lote["id"],
+            "lote": lote,
+        }
+    )
+
+
+@app.route("/api/lotes", methods=["GET"])
+def listar_lotes():
+    """Lista los lotes con su estado agregado"""
+    lista = lotes.listar_lotes()
+    return jsonify({"success": True, "lotes": lista, "total": len(lista)})
+
+
+@app.route("/api/lotes/<lote_id>", methods=["GET"])
+def obtener_lote(lote_id):
+    """Estado agregado de un lote y el de cada uno de sus escaneos"""
+    lote = lotes.obtener_lote(lote_id)
+    if lote is None:
+        return jsonify({"success": False, "message": "Lote no encontrado"}), 404
+    return jsonify({"success": True, "lote": lote})
+
+
+@app.route("/api/lotes/<lote_id>/resultado", methods=["GET"])
+def resultado_lote(lote_id):
+    """
+    Descarga en un zip los reportes que el lote lleva generados (todos si
+    ya terminó); formato elige entradas texto, json o ndjson (un único
+    archivo con todos los reportes)
+    """
+    formato = request.args.get("formato", "texto")
+    if formato not in exportacion.FORMATOS:
+        return (
+            jsonify(
+                {
+                    "success": False,
+                    "message": "Formato inválido. Formatos válidos: "
+                    f"{', '.join(exportacion.FORMATOS)}",
+                }
+            ),
+            400,
+        )
+    lote = lotes.obtener_lote(lote_id)
+    reporte_ids = lotes.reportes_lote(lote_id)
+    if lote is None or reporte_ids is None:
+        return jsonify({"success": False, "message": "Lote no encontrado"}), 404
+
+    nombre = f"{lote['nombre']}.zip"
+    return Response(
+        exportacion.generar_zip(almacen.leer_reportes(reporte_ids), formato),
+        mimetype="application/zip",
+        headers={
+            "Content-Disposition": f'attachment; filename="{nombre}"',
+            "X-Lote-Terminado": "true" if lote["terminado"] else "false",
+            "X-Lote-Reportes": str(len(reporte_ids)),
+        },
+    )
+
+
+@app.route("/api/lotes/<lote_id>/detener", methods=["POST"])
+def detener_lote(lote_id):
+    """Detiene un lote: no lanza sus escaneos pendientes y cancela los activos"""
+    detenidos = lotes.cancelar_lote(lote_id)
+    if detenidos is None:
+        return jsonify({"success": False, "message": "Lote no encontrado"}), 404
+    return jsonify(
+        {"success": True, "message": "Lote detenido", "detenidos": detenidos}
+    )
+
+
+def _fecha_filtro(valor, fin_del_dia=False):
+    """
+    Convierte una fecha ISO del query string en un timestamp comparable con
+    los del almacén; una fecha sin hora abarca el día completo
+    """
+    fecha = datetime.fromisoformat(valor)
+    if fin_del_dia and len(valor) == 10:
+        fecha = fecha.replace(hour=23, minute=59, second=59, microsecond=999999)
+    return fecha.isoformat()
+
+
+def _filtros_reportes():
+    """
+    Lee los filtros host, tipo, desde y hasta del query string
+
+    Raises:
+        ValueError: Si desde o hasta no son fechas ISO
+    """
+    try:
+        desde = request.args.get("desde")
+        hasta = request.args.get("hasta")
+        desde = _fecha_filtro(desde) if desde else None
+        hasta = _fecha_filtro(hasta, fin_del_dia=True) if hasta else None
+    except ValueError:
+        raise ValueError("desde y hasta deben ser fechas ISO (AAAA-MM-DD)")
+    return {
+        "host": request.args.get("host") or None,
+        "tipo": request.args.get("tipo") or None,
+        "desde": desde,
+        "hasta": hasta,
+    }
 
 
 @app.route("/api/reportes", methods=["GET"])
 def listar_reportes():
-    """Lista todos los reportes disponibles en memoria"""
+    """
+    Lista los reportes almacenados, del más reciente al más antiguo
+
+    Acepta limit, cursor (el "siguiente" de la página anterior) y los
+    filtros host, tipo, desde y hasta (fechas ISO)
+    """
+    try:
+        limite = int(request.args.get("limit", almacen.LIMITE_REPORTES))
+        if not 1 <= limite <= almacen.MAX_LIMITE_REPORTES:
+            raise ValueError
+    except ValueError:
+        return (
+            jsonify(
+                {
+                    "success": False,
+                    "message": "limit debe ser un entero entre 1 y "
+                    f"{almacen.MAX_LIMITE_REPORTES}",
+                }
+            ),
+            400,
+        )
+
+    try:
+        filtros = _filtros_reportes()
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+
+    # La lista solo cambia cuando cambia el almacén: 304 sin consultar nada
+    etiqueta = (
+        f"reportes-{almacen.version()}-"
+        f"{hashlib.sha1(request.query_string).hexdigest()[:16]}"
+    )
+    respuesta = respuestas.no_modificado(etiqueta)
+    if respuesta is not None:
+        return respuesta
+
+    try:
+        pagina, siguiente = almacen.listar_reportes(
+            limite=limite,
+            cursor=request.args.get("cursor"),
+            **filtros,
+        )
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+
     try:
         reportes = []
-        for reporte_id, datos in sorted(
-            reportes_memoria.items(), key=lambda x: x[1]["timestamp"], reverse=True
-        ):
+        for datos in pagina:
             reportes.append(
                 {
-                    "id": reporte_id,
+                    "id": datos["id"],
                     "nombre": datos["nombre"],
                     "fecha": datos["fecha"],
                     "tamaño": datos["tamaño"],
@@ -411,10 +1311,21 @@ def listar_reportes():
                     "scripts": datos["scripts"],
                     "tipo": datos.get("tipo", "no especificado"),
                     "argumentos": datos.get("argumentos", ""),
+                    "parcial": datos.get("parcial", False),
                 }
             )
 
-        return jsonify({"success": True, "reportes": reportes, "total": len(reportes)})
+        respuesta = jsonify(
+            {
+                "success": True,
+                "reportes": reportes,
+                "total": len(reportes),
+                "siguiente": siguiente,
+            }
+        )
+        respuesta.set_etag(etiqueta)
+        respuesta.headers["Cache-Control"] = "no-cache"
+        return respuesta
     except Exception as e:
         return (
             jsonify(
@@ -428,24 +1339,73 @@ def listar_reportes():
 def obtener_contenido_reporte(reporte_id):
     """Obtiene el contenido de un reporte específico"""
     try:
-        if reporte_id not in reportes_memoria:
+        metadatos = almacen.obtener_metadatos(reporte_id)
+        if metadatos is None:
             return jsonify({"success": False, "message": "Reporte no encontrado"}), 404
 
-        datos_reporte = reportes_memoria[reporte_id]
+        def cuerpo():
+            datos_reporte = almacen.obtener_reporte(reporte_id, metadatos)
+            return jsonify(
+                {
+                    "success": True,
+                    "contenido": datos_reporte["escaneo"].texto(),
+                    "nombre": datos_reporte["nombre"],
+                    "fecha": datos_reporte["fecha"],
+                    "id": reporte_id,
+                    "host": datos_reporte["host"],
+                    "puerto": datos_reporte["puerto"],
+                    "scripts": datos_reporte["scripts"],
+                    "tipo": datos_reporte.get("tipo", "no especificado"),
+                    "argumentos": datos_reporte.get("argumentos", ""),
+                    "parcial": datos_reporte.get("parcial", False),
+                }
+            ).get_data()
 
-        return jsonify(
-            {
-                "success": True,
-                "contenido": datos_reporte["contenido"],
-                "nombre": datos_reporte["nombre"],
-                "fecha": datos_reporte["fecha"],
-                "id": reporte_id,
-                "host": datos_reporte["host"],
-                "puerto": datos_reporte["puerto"],
-                "scripts": datos_reporte["scripts"],
-                "tipo": datos_reporte.get("tipo", "no especificado"),
-                "argumentos": datos_reporte.get("argumentos", ""),
-            }
+        return respuestas.respuesta_reporte(
+            metadatos, "contenido", cuerpo, "application/json"
+        )
+    except Exception as e:
+        return (
+            jsonify(
+                {"success": False, "message": f"Error al obtener reporte: {str(e)}"}
+            ),
+            500,
+        )
+
+
+@app.route("/api/reportes/<reporte_id>/rendimiento", methods=["GET"])
+def obtener_rendimiento_reporte(reporte_id):
+    """
+    Tiempos de cada fase del escaneo que generó un reporte, pico de memoria
+    y, si se perfiló, las funciones más costosas
+    """
+    datos = almacen.obtener_rendimiento(reporte_id)
+    if datos is None:
+        return jsonify({"success": False, "message": "Reporte no encontrado"}), 404
+    return jsonify({"success": True, "id": reporte_id, "rendimiento": datos})
+
+
+@app.route("/api/reportes/<reporte_id>/datos", methods=["GET"])
+def obtener_datos_reporte(reporte_id):
+    """Obtiene el resultado estructurado de un reporte en JSON"""
+    try:
+        metadatos = almacen.obtener_metadatos(reporte_id)
+        if metadatos is None:
+            return jsonify({"success": False, "message": "Reporte no encontrado"}), 404
+
+        def cuerpo():
+            datos_reporte = almacen.obtener_reporte(reporte_id, metadatos)
+            return jsonify(
+                {
+                    "success": True,
+                    "id": reporte_id,
+                    "nombre": datos_reporte["nombre"],
+                    "datos": datos_reporte["escaneo"].a_dict(),
+                }
+            ).get_data()
+
+        return respuestas.respuesta_reporte(
+            metadatos, "datos", cuerpo, "application/json"
         )
     except Exception as e:
         return (
@@ -460,22 +1420,37 @@ def obtener_contenido_reporte(reporte_id):
 def descargar_reporte(reporte_id):
     """Genera y descarga un reporte como archivo de texto"""
     try:
-        if reporte_id not in reportes_memoria:
+        metadatos = almacen.obtener_metadatos(reporte_id)
+        if metadatos is None:
             return jsonify({"success": False, "message": "Reporte no encontrado"}), 404
 
-        datos_reporte = reportes_memoria[reporte_id]
+        cabeceras = {
+            "Content-Disposition": f'attachment; filename="{metadatos["nombre"]}.txt"'
+        }
+
+        # Los reportes muy grandes se envían a medida que se generan
+        if metadatos["tamaño"] >= respuestas.TAMANO_DESCARGA_EN_TROZOS:
+            return respuestas.respuesta_reporte_en_trozos(
+                metadatos,
+                "descarga",
+                lambda: exportacion.trozos_texto(
+                    almacen.obtener_reporte(reporte_id, metadatos)["escaneo"].lineas()
+                ),
+                "text/plain",
+                headers=cabeceras,
+            )
 
         # Crear respuesta con el contenido como archivo
-        response = Response(
-            datos_reporte["contenido"],
-            mimetype="text/plain",
-            headers={
-                "Content-Disposition": f'attachment; filename="{datos_reporte["nombre"]}.txt"'
-            },
+        return respuestas.respuesta_reporte(
+            metadatos,
+            "descarga",
+            lambda: almacen.obtener_reporte(reporte_id, metadatos)["escaneo"]
+            .texto()
+            .encode("utf-8"),
+            "text/plain",
+            headers=cabeceras,
         )
 
-        return response
-
     except Exception as e:
         return (
             jsonify(
@@ -485,15 +1460,113 @@ def descargar_reporte(reporte_id):
         )
 
 
+@app.route("/api/reportes/<reporte_id>/diferencias", methods=["GET"])
+def diferencias_reporte(reporte_id):
+    """
+    Compara un reporte con otro anterior (parámetro con) o, por defecto, con
+    el reporte completo anterior del mismo escaneo (host, puertos, tipo y
+    argumentos), para no dar por cerrados puertos que este no sondeó
+    """
+    try:
+        metadatos = almacen.obtener_metadatos(reporte_id)
+        if metadatos is None:
+            return jsonify({"success": False, "message": "Reporte no encontrado"}), 404
+
+        otro_id = request.args.get("con")
+        anterior = (
+            almacen.obtener_metadatos(otro_id)
+            if otro_id
+            else almacen.reporte_anterior(metadatos)
+        )
+        if anterior is None:
+            mensaje = (
+                "Reporte de comparación no encontrado"
+                if otro_id
+                else "No hay un reporte anterior del mismo escaneo"
+            )
+            return jsonify({"success": False, "message": mensaje}), 404
+
+        def cuerpo():
+            escaneo_anterior = almacen.obtener_reporte(anterior["id"], anterior)
+            escaneo_actual = almacen.obtener_reporte(reporte_id, metadatos)
+            return jsonify(
+                {
+                    "success": True,
+                    "id": reporte_id,
+                    "anterior": {
+                        "id": anterior["id"],
+                        "nombre": anterior["nombre"],
+                        "fecha": anterior["fecha"],
+                    },
+                    "actual": {
+                        "id": reporte_id,
+                        "nombre": metadatos["nombre"],
+                        "fecha": metadatos["fecha"],
+                    },
+                    "diferencias": modelo.diferencias(
+                        escaneo_anterior["escaneo"], escaneo_actual["escaneo"]
+                    ),
+                }
+            ).get_data()
+
+        # Ambos reportes son inmutables: la representación depende del otro
+        return respuestas.respuesta_reporte(
+            metadatos,
+            f"diferencias-{anterior['huella']}",
+            cuerpo,
+            "application/json",
+        )
+    except Exception as e:
+        return (
+            jsonify(
+                {
+                    "success": False,
+                    "message": f"Error al comparar reportes: {str(e)}",
+                }
+            ),
+            500,
+        )
+
+
+@app.route("/api/reportes/exportar", methods=["GET"])
+def exportar_reportes():
+    """
+    Descarga un zip con los reportes que cumplen los filtros host, tipo,
+    desde y hasta; formato elige entradas texto, json o ndjson
+    """
+    formato = request.args.get("formato", "texto")
+    if formato not in exportacion.FORMATOS:
+        return (
+            jsonify(
+                {
+                    "success": False,
+                    "message": "Formato inválido. Formatos válidos: "
+                    f"{', '.join(exportacion.FORMATOS)}",
+                }
+            ),
+            400,
+        )
+    try:
+        filtros = _filtros_reportes()
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+
+    nombre = f"reportes_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip"
+    return Response(
+        exportacion.generar_zip(almacen.iterar_reportes(**filtros), formato),
+        mimetype="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{nombre}"'},
+    )
+
+
 @app.route("/api/reportes/<reporte_id>", methods=["DELETE"])
 def eliminar_reporte(reporte_id):
-    """Elimina un reporte específico de la memoria"""
+    """Elimina un reporte específico del almacén"""
     try:
-        if reporte_id not in reportes_memoria:
+        nombre_reporte = almacen.eliminar_reporte(reporte_id)
+        if nombre_reporte is None:
             return jsonify({"success": False, "message": "Reporte no encontrado"}), 404
-
-        nombre_reporte = reportes_memoria[reporte_id]["nombre"]
-        del reportes_memoria[reporte_id]
+        respuestas.olvidar_reporte(reporte_id)
 
         return jsonify(
             {
@@ -512,15 +1585,15 @@ def eliminar_reporte(reporte_id):
 
 @app.route("/api/reportes/limpiar", methods=["DELETE"])
 def limpiar_reportes():
-    """Elimina todos los reportes de la memoria"""
+    """Elimina todos los reportes del almacén"""
     try:
-        cantidad = len(reportes_memoria)
-        reportes_memoria.clear()
+        cantidad = almacen.limpiar_reportes()
+        respuestas.olvidar_reporte()
 
         return jsonify(
             {
                 "success": True,
-                "message": f"Se eliminaron {cantidad} reportes de la memoria",
+                "message": f"Se eliminaron {cantidad} reportes del almacén",
             }
         )
     except Exception as e:
@@ -532,6 +1605,241 @@ def limpiar_reportes():
         )
 
 
+@app.route("/api/retencion", methods=["GET"])
+def estado_retencion():
+    """Límites de retención y reportes en memoria, en la base y comprimidos"""
+    return jsonify(dict(retencion.estado(), success=True))
+
+
+@app.route("/api/webhooks", methods=["GET"])
+def estado_webhooks():
+    """URLs globales y entregas pendientes, hechas y fallidas de los avisos"""
+    return jsonify(dict(notificaciones.estado(), success=True))
+
+
+def _red_perfil(red):
+    """Normaliza la red de un perfil o lanza ValueError"""
+    try:
+        return ipaddress.ip_network(red, strict=False)
+    except ValueError:
+        raise ValueError(f"Red inválida: {red}")
+
+
+@app.route("/api/perfiles", methods=["GET"])
+def listar_perfiles():
+    """
+    Lista los perfiles de tiempo aprendidos por red; con objetivo (y tipo)
+    devuelve el perfil que se aplicaría a un escaneo de esos objetivos
+    """
+    objetivo = request.args.get("objetivo")
+    tipo = request.args.get("tipo", "basico")
+    if objetivo:
+        return jsonify(
+            {
+                "success": True,
+                "objetivo": objetivo,
+                "tipo": tipo,
+                "perfil": perfiles.perfil_objetivo(objetivo, tipo),
+            }
+        )
+
+    lista = almacen.listar_perfiles_red()
+    for perfil in lista:
+        perfil["aprendido"] = perfiles.ajustes(perfil["medidas"], tipo)
+    return jsonify({"success": True, "perfiles": lista, "total": len(lista)})
+
+
+@app.route("/api/perfiles/<path:red>", methods=["GET"])
+def obtener_perfil(red):
+    """Devuelve las medidas y ajustes de una red (los deducidos, para tipo)"""
+    try:
+        red = str(_red_perfil(red))
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    perfil = almacen.obtener_perfil_red(red)
+    if perfil is None:
+        return jsonify({"success": False, "message": "Perfil no encontrado"}), 404
+    perfil["aprendido"] = perfiles.ajustes(
+        perfil["medidas"], request.args.get("tipo", "basico")
+    )
+    return jsonify({"success": True, "perfil": perfil})
+
+
+@app.route("/api/perfiles/<path:red>", methods=["PUT"])
+def ajustar_perfil(red):
+    """
+    Impone a mano opciones de tiempo a una red (min_rate, max_retries,
+    host_timeout en segundos, min_parallelism, max_parallelism); un objeto
+    vacío vuelve a los valores aprendidos
+    """
+    try:
+        red_ip = _red_perfil(red)
+        ajuste = perfiles.validar_ajuste(request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+
+    perfiles.ajustar_red(red_ip, ajuste)
+    return jsonify(
+        {
+            "success": True,
+            "message": f"Perfil de {red_ip} actualizado",
+            "perfil": almacen.obtener_perfil_red(str(red_ip)),
+        }
+    )
+
+
+@app.route("/api/perfiles/<path:red>", methods=["DELETE"])
+def eliminar_perfil(red):
+    """Olvida lo aprendido (y lo ajustado) de una red"""
+    try:
+        red = str(_red_perfil(red))
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    if not almacen.eliminar_perfil_red(red):
+        return jsonify({"success": False, "message": "Perfil no encontrado"}), 404
+    return jsonify({"success": True, "message": f"Perfil de {red} eliminado"})
+
+
+@app.route("/api/presupuestos", methods=["GET"])
+def listar_presupuestos():
+    """Presupuestos de tráfico configurados y la parte reservada por cada escaneo"""
+    return jsonify(dict(presupuesto.estado(), success=True))
+
+
+def _vista_programacion(programacion):
+    """Programación con los escaneos que tiene en curso"""
+    programacion["en_curso"] = planificador.trabajos_activos(programacion["id"])
+    return programacion
+
+
+@app.route("/api/programaciones", methods=["POST"])
+def crear_programacion():
+    """
+    Programa un escaneo recurrente: "cron" (admite H y @daily, @weekly...) o
+    "intervalo" (segundos o 30m, 6h, 1d), "jitter" en segundos,
+    "max_simultaneos" y en "escaneo" los mismos campos que /api/escanear
+    """
+    datos = request.get_json(silent=True)
+    if not datos:
+        return (
+            jsonify({"success": False, "message": "No se recibieron datos JSON"}),
+            400,
+        )
+    escaneo = datos.get("escaneo")
+    if not isinstance(escaneo, dict):
+        return (
+            jsonify(
+                {
+                    "success": False,
+                    "message": 'Debe indicar el escaneo a programar en "escaneo"',
+                }
+            ),
+            400,
+        )
+
+    try:
+        programacion = planificador.crear_programacion(
+            validar_parametros_escaneo(escaneo),
+            cron=datos.get("cron"),
+            intervalo=datos.get("intervalo"),
+            jitter=datos.get("jitter"),
+            max_simultaneos=datos.get("max_simultaneos", 1),
+            nombre=datos.get("nombre"),
+        )
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    if datos.get("activa") is False:
+        planificador.pausar_programacion(programacion["id"])
+        programacion["activa"] = False
+
+    print(
+        f"[+] Programación {programacion['nombre']} creada; primera ejecución: "
+        f"{programacion['proxima']}"
+    )
+    return jsonify(
+        {
+            "success": True,
+            "message": "Escaneo programado",
+            "programacion": almacen.obtener_programacion(programacion["id"]),
+        }
+    )
+
+
+@app.route("/api/programaciones", methods=["GET"])
+def listar_programaciones():
+    """Lista las programaciones, de la próxima en ejecutarse a la última"""
+    lista = [_vista_programacion(p) for p in almacen.listar_programaciones()]
+    return jsonify(
+        {
+            "success": True,
+            "programaciones": lista,
+            "total": len(lista),
+            "escaneos_en_curso": len(planificador.trabajos_activos()),
+            "max_escaneos_programados": planificador.MAX_ESCANEOS_PROGRAMADOS,
+        }
+    )
+
+
+@app.route("/api/programaciones/<programacion_id>", methods=["GET"])
+def obtener_programacion(programacion_id):
+    """Devuelve una programación"""
+    programacion = almacen.obtener_programacion(programacion_id)
+    if programacion is None:
+        return (
+            jsonify({"success": False, "message": "Programación no encontrada"}),
+            404,
+        )
+    return jsonify({"success": True, "programacion": _vista_programacion(programacion)})
+
+
+@app.route("/api/programaciones/<programacion_id>/pausar", methods=["POST"])
+def pausar_programacion(programacion_id):
+    """Pausa una programación (los escaneos ya lanzados siguen su curso)"""
+    if not planificador.pausar_programacion(programacion_id):
+        return (
+            jsonify({"success": False, "message": "Programación no encontrada"}),
+            404,
+        )
+    return jsonify(
+        {
+            "success": True,
+            "message": "Programación pausada",
+            "programacion": _vista_programacion(
+                almacen.obtener_programacion(programacion_id)
+            ),
+        }
+    )
+
+
+@app.route("/api/programaciones/<programacion_id>/reanudar", methods=["POST"])
+def reanudar_programacion(programacion_id):
+    """Reactiva una programación a partir de ahora"""
+    programacion = planificador.reanudar_programacion(programacion_id)
+    if programacion is None:
+        return (
+            jsonify({"success": False, "message": "Programación no encontrada"}),
+            404,
+        )
+    return jsonify(
+        {
+            "success": True,
+            "message": "Programación reanudada",
+            "programacion": _vista_programacion(programacion),
+        }
+    )
+
+
+@app.route("/api/programaciones/<programacion_id>", methods=["DELETE"])
+def eliminar_programacion(programacion_id):
+    """Elimina una programación (los escaneos ya lanzados siguen su curso)"""
+    if not almacen.eliminar_programacion(programacion_id):
+        return (
+            jsonify({"success": False, "message": "Programación no encontrada"}),
+            404,
+        )
+    return jsonify({"success": True, "message": "Programación eliminada"})
+
+
 # === MANEJO DE ERRORES ===
 
 
@@ -550,8 +1858,8 @@ def index():
     return jsonify(
         {
             "message": "Bienvenido a la API de escaneo con Nmap",
-            "reportes_en_memoria": len(reportes_memoria),
-            "escaneo_en_progreso": estado_escaneo["en_progreso"],
+            "reportes_almacenados": almacen.contar_reportes(),
+            "escaneo_en_progreso": trabajos.estado_compatible()["en_progreso"],
             "tipos_escaneo_disponibles": [
                 "basico",
                 "stealth",
@@ -564,14 +1872,35 @@ def index():
             ],
             "endpoints_disponibles": [
                 "/api/health",
+                "/metrics",
                 "/api/escanear",
                 "/api/detener",
                 "/api/estado",
+                "/api/escaneos",
+                "/api/escaneos/<id>",
+                "/api/escaneos/<id>/eventos",
+                "/api/lotes (GET, POST)",
+                "/api/lotes/<id>",
+                "/api/lotes/<id>/resultado",
+                "/api/lotes/<id>/detener",
                 "/api/reportes",
                 "/api/reportes/<id>/contenido",
+                "/api/reportes/<id>/datos",
+                "/api/reportes/<id>/rendimiento",
                 "/api/reportes/<id>/descargar",
+                "/api/reportes/<id>/diferencias",
+                "/api/reportes/exportar",
                 "/api/reportes/<id> (DELETE)",
                 "/api/reportes/limpiar (DELETE)",
+                "/api/retencion",
+                "/api/webhooks",
+                "/api/perfiles",
+                "/api/perfiles/<red> (GET, PUT, DELETE)",
+                "/api/presupuestos",
+                "/api/programaciones (GET, POST)",
+                "/api/programaciones/<id> (GET, DELETE)",
+                "/api/programaciones/<id>/pausar",
+                "/api/programaciones/<id>/reanudar",
             ],
         }
     )
@@ -580,10 +1909,7 @@ def index():
 def signal_handler(sig, frame):
     """Maneja la señal de interrupción"""
     print(f"\n[!] Señal {sig} recibida, cerrando servidor...")
-    if len(reportes_memoria) > 0:
-        print(
-            f"[!] Se perderán {len(reportes_memoria)} reportes almacenados en memoria"
-        )
+    print(f"[+] Los reportes quedan guardados en {almacen.RUTA_BASE_DATOS}")
     sys.exit(0)
 
 
@@ -596,7 +1922,91 @@ def main():
     print("=== BACKEND - ESCÁNER DE PUERTOS ===")
     print("[+] Iniciando servidor API...")
     print("[+] API disponible en: http://localhost:5000")
-    print("[+] Los reportes se almacenan en memoria (no se generan archivos)")
+    print(
+        f"[+] Los reportes se guardan en {almacen.RUTA_BASE_DATOS} "
+        f"({almacen.contar_reportes()} almacenados)"
+    )
+    print(
+        f"[+] Trabajadores de escaneo: {trabajos.MAX_TRABAJADORES} "
+        f"(cola de hasta {trabajos.TAMANO_COLA} escaneos)"
+    )
+    print(
+        f"[+] Escaneo fragmentado: hasta {fragmentos.PARALELISMO_FRAGMENTOS} "
+        f"procesos nmap en paralelo ({fragmentos.TAMANO_FRAGMENTO} direcciones por fragmento)"
+    )
+    print(
+        f"[+] Caché de resultados: los escaneos idénticos reutilizan el reporte "
+        f'durante {almacen.TTL_CACHE_RESULTADOS}s ("force": true para repetirlos)'
+    )
+    print(
+        "[+] Descubrimiento previo de hosts en los escaneos "
+        f"{', '.join(descubrimiento.TIPOS_CON_DESCUBRIMIENTO) or 'ninguno'} "
+        '("descubrimiento": true/false para cambiarlo)'
+    )
+    print(
+        "[+] Perfiles de tiempo por red: "
+        + ("automáticos" if perfiles.PERFILES_AUTOMATICOS else "desactivados")
+        + ' ("perfil": false o {"min_rate": ...} para cambiarlo)'
+    )
+    print(
+        '[+] Reescaneo incremental ("incremental": true): se comprueban los puertos '
+        f"conocidos y un {incremental.PORCENTAJE_MUESTRA_INCREMENTAL}% del resto"
+    )
+    print(
+        f"[+] Motor por defecto: {MOTOR_POR_DEFECTO} "
+        f'("motor": "asyncio" para escaneos TCP connect sin nmap)'
+    )
+    print(
+        f"[+] Scripts {', '.join(sondeo_http.SCRIPTS_NATIVOS)}: "
+        + (
+            f"sondeo nativo ({sondeo_http.SONDAS_HTTP_SIMULTANEAS} sondas simultáneas)"
+            if sondeo_http.SONDEO_HTTP_NATIVO
+            else "con NSE"
+        )
+    )
+    print(
+        "[+] Escaneos programados: "
+        + (
+            f"hasta {planificador.MAX_ESCANEOS_PROGRAMADOS} a la vez, "
+            f"jitter de hasta {planificador.JITTER_PROGRAMACIONES}s"
+            if planificador.PLANIFICADOR_ACTIVO
+            else "desactivados"
+        )
+    )
+    print(
+        "[+] Presupuestos de tráfico: "
+        + (
+            ", ".join(
+                f"{clave} ({p['pps'] or '∞'} pps, {p['sondas'] or '∞'} sondas)"
+                for clave, p in presupuesto.PRESUPUESTOS.items()
+            )
+            or "sin límite"
+        )
+    )
+    print(
+        f"[+] Retención: hasta {almacen.MEMORIA_ESCANEOS_CACHE} bytes de escaneos "
+        "en memoria; los datos se comprimen a disco "
+        + (
+            f"por encima de {retencion.PRESUPUESTO_REPORTES_BYTES} bytes"
+            if retencion.PRESUPUESTO_REPORTES_BYTES
+            else "sin límite de bytes"
+        )
+        + (
+            f" o tras {retencion.EDAD_MAXIMA_CALIENTE}s sin consultarse"
+            if retencion.EDAD_MAXIMA_CALIENTE
+            else ""
+        )
+    )
+    print(
+        "[+] Avisos de fin de escaneo: "
+        + (", ".join(notificaciones.WEBHOOKS_ESCANEOS) or "sin webhooks globales")
+        + ' ("webhook": URL para un escaneo concreto)'
+    )
+    print(
+        "[+] Perfilado de escaneos (cProfile y tracemalloc): "
+        + ("activado" if rendimiento.PERFILADO_ESCANEOS else "desactivado")
+        + ' ("perfilar": true para un escaneo concreto)'
+    )
     print("[+] Tipos de escaneo disponibles:")
     print("    - basico: TCP Connect scan")
     print("    - stealth: SYN Stealth scan")
@@ -608,14 +2018,38 @@ def main():
     print("    - personalizado: Argumentos personalizados")
     print("[+] Documentación de endpoints:")
     print("    GET  /api/health - Estado de la API")
+    print("    GET  /metrics - Métricas en formato Prometheus")
     print("    POST /api/escanear - Iniciar escaneo")
     print("    POST /api/detener - Detener escaneo")
     print("    GET  /api/estado - Estado del escaneo")
-    print("    GET  /api/reportes - Listar reportes")
+    print("    GET  /api/escaneos - Listar trabajos de escaneo")
+    print("    GET  /api/escaneos/<id> - Estado de un trabajo")
+    print("    GET  /api/escaneos/<id>/eventos - Progreso en vivo (SSE)")
+    print("    POST /api/lotes - Encolar un lote de escaneos")
+    print("    GET  /api/lotes - Listar lotes con su estado agregado")
+    print("    GET  /api/lotes/<id> - Estado de un lote y de sus escaneos")
+    print("    GET  /api/lotes/<id>/resultado - Reportes del lote en un zip")
+    print("    POST /api/lotes/<id>/detener - Detener un lote")
+    print("    GET  /api/reportes - Listar reportes (paginado y filtrable)")
     print("    GET  /api/reportes/<id>/contenido - Contenido del reporte")
+    print("    GET  /api/reportes/<id>/datos - Resultado estructurado (JSON)")
+    print("    GET  /api/reportes/<id>/rendimiento - Tiempos de cada fase del escaneo")
     print("    GET  /api/reportes/<id>/descargar - Descargar reporte")
+    print("    GET  /api/reportes/<id>/diferencias - Cambios respecto a otro reporte")
+    print("    GET  /api/reportes/exportar - Exportar reportes en un zip")
     print("    DELETE /api/reportes/<id> - Eliminar reporte")
     print("    DELETE /api/reportes/limpiar - Eliminar todos los reportes")
+    print("    GET  /api/retencion - Reportes en memoria, en la base y comprimidos")
+    print("    GET  /api/webhooks - Estado de los avisos de fin de escaneo")
+    print("    GET  /api/perfiles - Perfiles de tiempo aprendidos por red")
+    print("    PUT  /api/perfiles/<red> - Imponer opciones de tiempo a una red")
+    print("    DELETE /api/perfiles/<red> - Olvidar el perfil de una red")
+    print("    GET  /api/presupuestos - Presupuestos de tráfico y reservas")
+    print("    POST /api/programaciones - Programar un escaneo recurrente")
+    print("    GET  /api/programaciones - Listar escaneos programados")
+    print("    POST /api/programaciones/<id>/pausar - Pausar una programación")
+    print("    POST /api/programaciones/<id>/reanudar - Reanudar una programación")
+    print("    DELETE /api/programaciones/<id> - Eliminar una programación")
     print("[+] Presiona Ctrl+C para detener el servidor")
 
     try:
@@ -623,10 +2057,7 @@ def main():
         app.run(host="0.0.0.0", port=port, debug=False, threaded=True)
     except KeyboardInterrupt:
         print("\n[!] Servidor detenido")
-        if len(reportes_memoria) > 0:
-            print(
-                f"[!] Se perdieron {len(reportes_memoria)} reportes almacenados en memoria"
-            )
+        print(f"[+] Los reportes quedan guardados en {almacen.RUTA_BASE_DATOS}")
     except Exception as e:
         print(f"[!] Error al iniciar servidor: {e}")
 
@@ -0,0 +1,548 @@
+#!/usr/bin/env python3
+"""
+Pruebas de rendimiento sin red
+Lanza la aplicación contra nmap_sintetico.py y mide, para cada tamaño
+(hosts x puertos x scripts), el análisis del XML, la generación de
+reportes (ejecutar_escaneo, modelo y los reportes de cli_scanner), la
+inserción y el listado del almacén y el rendimiento de los endpoints HTTP.
+Los resultados se guardan en JSON para comparar ejecuciones
+
+Con --motores compara además el motor asyncio con nmap (el real, si está
+instalado) en un escaneo -sT de 127.0.0.1 con puertos locales escuchando
+
+Uso:
+    python benchmarks/medir.py --tamanos 10x100x2,100x200x3
+    python benchmarks/medir.py --comparar benchmarks/resultados/anterior.json
+    python benchmarks/medir.py --motores 1-2000 --abiertos 20
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import math
+import os
+import platform
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime
+
+CARPETA = os.path.dirname(os.path.abspath(__file__))
+RAIZ = os.path.dirname(CARPETA)
+NMAP_SINTETICO = os.path.join(CARPETA, "nmap_sintetico.py")
+CARPETA_RESULTADOS = os.path.join(CARPETA, "resultados")
+
+# Versión del formato del JSON de resultados
+FORMATO = 1
+
+OBJETIVO = "10.0.0.1"
+OBJETIVO_LOCAL = "127.0.0.1"
+
+
+def preparar_entorno(carpeta):
+    """
+    Apunta la aplicación al nmap sintético y a una base de datos temporal
+
+    Debe llamarse antes de importar app: la configuración se lee al importar
+    """
+    # python-nmap (cli_scanner) busca "nmap" en el PATH
+    os.symlink(NMAP_SINTETICO, os.path.join(carpeta, "nmap"))
+    os.environ["PATH"] = carpeta + os.pathsep + os.environ.get("PATH", "")
+    os.environ.update(
+        RUTA_NMAP=NMAP_SINTETICO,
+        RUTA_BASE_DATOS=os.path.join(carpeta, "benchmark.db"),
+        # Sin reutilizar resultados, sin sondeos reales ni tareas de fondo
+        TTL_CACHE_RESULTADOS="0",
+        SONDEO_HTTP_NATIVO="0",
+        PERFILES_AUTOMATICOS="0",
+        PLANIFICADOR_ACTIVO="0",
+        INTERVALO_METRICAS="3600",
+    )
+    sys.path.insert(0, RAIZ)
+
+
+def cronometrar(funcion, repeticiones, preparar=None):
+    """
+    Ejecuta una función varias veces y devuelve lo que tardó cada vez
+
+    Args:
+        funcion (callable): Función a medir
+        repeticiones (int): Veces que se ejecuta
+        preparar (callable): Devuelve los argumentos de cada ejecución; su
+                             tiempo no se cuenta
+
+    Returns:
+        list: Segundos de cada ejecución
+    """
+    tiempos = []
+    # La aplicación informa por consola de cada paso: no se mide esa salida
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(repeticiones):
+            argumentos = preparar() if preparar else ()
+            inicio = time.perf_counter()
+            funcion(*argumentos)
+            tiempos.append(time.perf_counter() - inicio)
+    return tiempos
+
+
+def resumir(tiempos, unidades=None, nombre_unidades="hosts"):
+    """Estadísticas de una serie de tiempos (y ritmo si se dan las unidades)"""
+    ordenados = sorted(tiempos)
+    mediana = statistics.median(ordenados)
+    resumen = {
+        "repeticiones": len(ordenados),
+        "min_s": round(ordenados[0], 6),
+        "mediana_s": round(mediana, 6),
+        "media_s": round(statistics.fmean(ordenados), 6),
+        "p95_s": round(ordenados[math.ceil(0.95 * len(ordenados)) - 1], 6),
+        "max_s": round(ordenados[-1], 6),
+    }
+    if unidades:
+        resumen[f"{nombre_unidades}_por_segundo"] = round(
+            unidades / mediana if mediana else 0, 1
+        )
+    return resumen
+
+
+def analizar_motor_nmap(motor_nmap, xml):
+    """Analiza un XML como lo hace motor_nmap.ejecutar_nmap, sin lanzar nmap"""
+    hosts = {}
+    for tipo, datos in motor_nmap.analizar_xml_incremental(io.StringIO(xml)):
+        if tipo == "host":
+            direccion, datos_host = motor_nmap.convertir_host(datos)
+            hosts[direccion] = datos_host
+    return hosts
+
+
+def medir_tamano(app, hosts, puertos, scripts, repeticiones, peticiones, carpeta):
+    """
+    Mide todas las pruebas con un tamaño de escaneo
+
+    Returns:
+        dict: {prueba: estadísticas}
+    """
+    import almacen
+    import cli_scanner
+    import modelo
+    import motor_nmap
+    import nmap
+    import nmap_sintetico
+    import rendimiento
+
+    # El XML se genera una sola vez: nmap_sintetico se limita a volcarlo
+    archivo = os.path.join(carpeta, f"{hosts}x{puertos}x{scripts}.xml")
+    with open(archivo, "w", encoding="utf-8") as salida:
+        salida.writelines(nmap_sintetico.generar([OBJETIVO], hosts, puertos, scripts))
+    os.environ["NMAP_SINTETICO_ARCHIVO"] = archivo
+    with open(archivo, encoding="utf-8") as entrada:
+        xml = entrada.read()
+
+    resultados = {"xml_bytes": len(xml.encode("utf-8"))}
+    argumentos = f"-sT -p 1-{puertos}"
+    fecha = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    # Análisis del XML
+    resultados["analisis_motor_nmap"] = resumir(
+        cronometrar(lambda: analizar_motor_nmap(motor_nmap, xml), repeticiones),
+        hosts,
+    )
+    escaner = nmap.PortScanner()
+    resultados["analisis_python_nmap"] = resumir(
+        cronometrar(lambda: escaner.analyse_nmap_xml_scan(xml), repeticiones),
+        hosts,
+    )
+    resultados["motor_nmap_completo"] = resumir(
+        cronometrar(
+            lambda: motor_nmap.ejecutar_nmap(OBJETIVO, argumentos), repeticiones
+        ),
+        hosts,
+    )
+
+    def motor_al_modelo():
+        # Cada host pasa al modelo según llega, como en ejecutar_escaneo
+        convertidos = []
+        parcial = motor_nmap.ejecutar_nmap(
+            OBJETIVO,
+            argumentos,
+            al_host=lambda direccion, datos: convertidos.append(
+                modelo.Host.desde_nmap(direccion, datos)
+            ),
+        )
+        return modelo.Escaneo.desde_nmap(
+            parcial,
+            OBJETIVO,
+            puertos,
+            "default",
+            "basico",
+            argumentos,
+            fecha,
+            hosts=convertidos,
+        )
+
+    resultados["motor_nmap_al_modelo"] = resumir(
+        cronometrar(motor_al_modelo, repeticiones), hosts
+    )
+
+    # Reportes
+    resultado = motor_nmap.ejecutar_nmap(OBJETIVO, argumentos)
+
+    def escaneo_nuevo():
+        return (
+            modelo.Escaneo.desde_nmap(
+                resultado, OBJETIVO, puertos, "default", "basico", argumentos, fecha
+            ),
+        )
+
+    resultados["modelo_desde_nmap"] = resumir(
+        cronometrar(lambda: escaneo_nuevo(), repeticiones), hosts
+    )
+    # El texto queda memorizado en cada Escaneo: se mide siempre uno nuevo
+    resultados["texto_reporte"] = resumir(
+        cronometrar(lambda escaneo: escaneo.texto(), repeticiones, escaneo_nuevo),
+        hosts,
+    )
+    for nombre, generar_reporte in (
+        ("reporte_detallado_cli", cli_scanner.generar_reporte_detallado),
+        ("reporte_simple_cli", cli_scanner.generar_reporte_simple),
+    ):
+        resultados[nombre] = resumir(
+            cronometrar(
+                lambda archivo, generar_reporte=generar_reporte: generar_reporte(
+                    archivo, escaner, OBJETIVO, puertos, "default"
+                ),
+                repeticiones,
+                lambda: (io.StringIO(),),
+            ),
+            hosts,
+        )
+
+    # Escaneo completo: motor, modelo y almacén, con el tiempo de cada fase
+    fases = []
+    reporte_ids = []
+
+    def escanear():
+        medicion = rendimiento.iniciar(False)
+        reporte_ids.append(
+            app.ejecutar_escaneo(
+                OBJETIVO,
+                puerto=f"1-{puertos}",
+                scripts="default",
+                tipo_escaneo="basico",
+                descubrimiento_previo=False,
+                perfil=False,
+                medicion=medicion,
+            )
+        )
+        fases.append(rendimiento.terminar(medicion)["fases"])
+
+    resultados["ejecutar_escaneo"] = resumir(cronometrar(escanear, repeticiones), hosts)
+    resultados["ejecutar_escaneo"]["fases_mediana_s"] = {
+        fase: round(statistics.median(f.get(fase, 0) for f in fases), 6)
+        for fase in fases[0]
+    }
+
+    # Almacén
+    escaneo = escaneo_nuevo()[0]
+
+    def reporte_nuevo():
+        return (
+            {
+                "id": str(uuid.uuid4()),
+                "nombre": "benchmark",
+                "escaneo": escaneo,
+                "fecha": fecha,
+                "timestamp": datetime.now().isoformat(),
+                "host": OBJETIVO,
+                "puerto": puertos,
+                "scripts": "default",
+                "tipo": "basico",
+                "argumentos": argumentos,
+            },
+        )
+
+    resultados["almacen_insertar"] = resumir(
+        cronometrar(almacen.guardar_reporte, repeticiones, reporte_nuevo)
+    )
+    resultados["almacen_listar"] = resumir(
+        cronometrar(lambda: almacen.listar_reportes(), repeticiones)
+    )
+    resultados["almacen_listar"]["reportes_guardados"] = almacen.contar_reportes()
+
+    # Endpoints HTTP (en proceso, con el cliente de pruebas de Flask)
+    reporte_id = reporte_ids[-1]
+    cliente = app.app.test_client()
+    rutas = (
+        "/api/health",
+        "/api/reportes",
+        f"/api/reportes/{reporte_id}/contenido",
+        f"/api/reportes/{reporte_id}/datos",
+        "/metrics",
+    )
+    for ruta in rutas:
+        respuesta = cliente.get(ruta)
+        if respuesta.status_code != 200:
+            raise RuntimeError(f"{ruta} respondió {respuesta.status_code}")
+        tiempos = cronometrar(lambda: cliente.get(ruta).close(), peticiones)
+        estadisticas = resumir(tiempos)
+        estadisticas["peticiones_por_segundo"] = round(len(tiempos) / sum(tiempos), 1)
+        nombre = ruta.replace(reporte_id, "<id>")
+        resultados[f"http {nombre}"] = estadisticas
+
+    return resultados
+
+
+def medir_motores(puertos, abiertos, repeticiones, nmap_real):
+    """
+    Compara el motor asyncio con nmap en un escaneo TCP connect de
+    127.0.0.1, con abiertos puertos locales escuchando además de la lista
+
+    Args:
+        puertos (str): Lista de puertos de nmap que se escanea
+        abiertos (int): Sockets que se abren y se añaden a la lista
+        nmap_real (str): Ruta de nmap, o None para medir solo el motor asyncio
+
+    Returns:
+        dict: {prueba: estadísticas} y si ambos motores ven los mismos
+              puertos abiertos
+    """
+    import motor_asyncio
+    import motor_nmap
+
+    servidores = []
+    try:
+        for _ in range(abiertos):
+            servidor = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            servidor.bind((OBJETIVO_LOCAL, 0))
+            servidor.listen(64)
+            servidores.append(servidor)
+        locales = [str(servidor.getsockname()[1]) for servidor in servidores]
+        argumentos = "-sT -T4 -p " + ",".join([puertos] + locales)
+        sondas = len(motor_asyncio._puertos(",".join([puertos] + locales)))
+
+        def abiertos_de(resultado):
+            tcp = resultado["scan"].get(OBJETIVO_LOCAL, {}).get("tcp", {})
+            return sorted(p for p, info in tcp.items() if info["state"] == "open")
+
+        resultados = {"puertos_sondeados": sondas}
+        resultado = motor_asyncio.ejecutar_escaneo_conexion(OBJETIVO_LOCAL, argumentos)
+        resultados["motor_asyncio"] = resumir(
+            cronometrar(
+                lambda: motor_asyncio.ejecutar_escaneo_conexion(
+                    OBJETIVO_LOCAL, argumentos
+                ),
+                repeticiones,
+            ),
+            sondas,
+            "puertos",
+        )
+        if nmap_real is None:
+            return resultados
+
+        ruta_sintetica = motor_nmap.RUTA_NMAP
+        motor_nmap.RUTA_NMAP = nmap_real
+        try:
+            resultado_nmap = motor_nmap.ejecutar_nmap(OBJETIVO_LOCAL, argumentos)
+            resultados["motor_nmap"] = resumir(
+                cronometrar(
+                    lambda: motor_nmap.ejecutar_nmap(OBJETIVO_LOCAL, argumentos),
+                    repeticiones,
+                ),
+                sondas,
+                "puertos",
+            )
+        finally:
+            motor_nmap.RUTA_NMAP = ruta_sintetica
+        resultados["mismos_puertos_abiertos"] = abiertos_de(resultado) == abiertos_de(
+            resultado_nmap
+        )
+        return resultados
+    finally:
+        for servidor in servidores:
+            servidor.close()
+
+
+def _commit():
+    """Commit actual del repositorio, o None si no se puede saber"""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=RAIZ,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def interpretar_tamanos(texto):
+    """Lista de tamaños "HxPxS,..." como tuplas (hosts, puertos, scripts)"""
+    tamanos = []
+    for tamano in texto.split(","):
+        partes = tamano.strip().lower().split("x")
+        if len(partes) != 3 or not all(p.isdigit() and int(p) > 0 for p in partes):
+            raise argparse.ArgumentTypeError(
+                f"Tamaño inválido: {tamano} (se espera hostsxpuertosxscripts)"
+            )
+        tamanos.append(tuple(int(p) for p in partes))
+    return tamanos
+
+
+def comparar(anterior, actual, umbral):
+    """
+    Compara las medianas de dos ejecuciones
+
+    Returns:
+        int: Número de pruebas más lentas que la anterior en más del umbral (%)
+    """
+    regresiones = 0
+    for tamano, pruebas in actual["resultados"].items():
+        pruebas_anteriores = anterior["resultados"].get(tamano, {})
+        for prueba, estadisticas in pruebas.items():
+            previas = pruebas_anteriores.get(prueba)
+            if not isinstance(estadisticas, dict) or not isinstance(previas, dict):
+                continue
+            antes, ahora = previas["mediana_s"], estadisticas["mediana_s"]
+            if not antes:
+                continue
+            cambio = (ahora - antes) / antes * 100
+            marca = "[!]" if cambio > umbral else "[+]"
+            regresiones += cambio > umbral
+            print(
+                f"{marca} {tamano} {prueba}: {antes:.6f}s -> {ahora:.6f}s "
+                f"({cambio:+.1f}%)"
+            )
+    return regresiones
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Pruebas de rendimiento con un nmap sintético"
+    )
+    parser.add_argument(
+        "--tamanos",
+        type=interpretar_tamanos,
+        default=interpretar_tamanos("10x100x2,100x100x2,50x1000x3"),
+        help="Tamaños hostsxpuertosxscripts separados por comas",
+    )
+    parser.add_argument("--repeticiones", type=int, default=5)
+    parser.add_argument(
+        "--peticiones", type=int, default=200, help="Peticiones por endpoint HTTP"
+    )
+    parser.add_argument(
+        "--salida", help="Archivo JSON de resultados (por defecto en resultados/)"
+    )
+    parser.add_argument(
+        "--comparar", help="JSON de una ejecución anterior con el que comparar"
+    )
+    parser.add_argument(
+        "--motores",
+        metavar="PUERTOS",
+        help="Compara el motor asyncio con nmap escaneando estos puertos de "
+        "127.0.0.1",
+    )
+    parser.add_argument(
+        "--abiertos",
+        type=int,
+        default=10,
+        help="Puertos locales que se abren para la comparación de motores",
+    )
+    parser.add_argument(
+        "--nmap-real",
+        default=shutil.which("nmap"),
+        help="nmap con el que comparar el motor asyncio (por defecto el del PATH)",
+    )
+    parser.add_argument(
+        "--umbral",
+        type=float,
+        default=10,
+        help="Porcentaje de empeoramiento que se considera regresión",
+    )
+    args = parser.parse_args()
+
+    anterior = None
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as entrada:
+            anterior = json.load(entrada)
+
+    carpeta = tempfile.mkdtemp(prefix="benchmark-escaner-")
+    try:
+        preparar_entorno(carpeta)
+        with contextlib.redirect_stdout(io.StringIO()):
+            import app
+
+        informe = {
+            "formato": FORMATO,
+            "fecha": datetime.now().isoformat(timespec="seconds"),
+            "commit": _commit(),
+            "entorno": {
+                "python": platform.python_version(),
+                "plataforma": platform.platform(),
+                "cpus": os.cpu_count(),
+            },
+            "parametros": {
+                "tamanos": [f"{h}x{p}x{s}" for h, p, s in args.tamanos],
+                "repeticiones": args.repeticiones,
+                "peticiones": args.peticiones,
+            },
+            "resultados": {},
+        }
+        for hosts, puertos, scripts in args.tamanos:
+            tamano = f"{hosts}x{puertos}x{scripts}"
+            print(f"[+] Midiendo {tamano} (hosts x puertos x scripts)...")
+            informe["resultados"][tamano] = medir_tamano(
+                app,
+                hosts,
+                puertos,
+                scripts,
+                args.repeticiones,
+                args.peticiones,
+                carpeta,
+            )
+        if args.motores:
+            if args.nmap_real is None:
+                print("[!] nmap no está instalado: solo se mide el motor asyncio")
+            print(f"[+] Comparando motores en {OBJETIVO_LOCAL} ({args.motores})...")
+            informe["parametros"]["motores"] = {
+                "puertos": args.motores,
+                "abiertos": args.abiertos,
+                "nmap": args.nmap_real,
+            }
+            informe["resultados"][f"motores {OBJETIVO_LOCAL}"] = medir_motores(
+                args.motores, args.abiertos, args.repeticiones, args.nmap_real
+            )
+    finally:
+        shutil.rmtree(carpeta, ignore_errors=True)
+
+    salida = args.salida
+    if not salida:
+        os.makedirs(CARPETA_RESULTADOS, exist_ok=True)
+        salida = os.path.join(
+            CARPETA_RESULTADOS,
+            f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{informe['commit'] or 'sin-commit'}.json",
+        )
+    with open(salida, "w", encoding="utf-8") as archivo:
+        json.dump(informe, archivo, indent=2, ensure_ascii=False)
+    print(f"[✓] Resultados guardados en {salida}")
+
+    for tamano, pruebas in informe["resultados"].items():
+        for prueba, estadisticas in pruebas.items():
+            if isinstance(estadisticas, dict):
+                print(
+                    f"    {tamano} {prueba}: mediana {estadisticas['mediana_s']:.6f}s"
+                )
+
+    if anterior is not None:
+        print(f"[+] Comparando con {args.comparar}...")
+        if comparar(anterior, informe, args.umbral):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
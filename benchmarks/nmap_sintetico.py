@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Sustituto sintético de nmap para las pruebas de rendimiento
+Emite un XML -oX válido con N hosts x M puertos x K salidas de script sin
+tocar la red; los tamaños se leen del entorno (NMAP_SINTETICO_HOSTS,
+NMAP_SINTETICO_PUERTOS, NMAP_SINTETICO_SCRIPTS). Los objetivos y opciones
+recibidos se ignoran salvo la primera dirección, desde la que se numeran
+los hosts. Con NMAP_SINTETICO_ARCHIVO vuelca un XML ya generado, para que
+el coste medido sea el del análisis y no el de la generación
+"""
+
+import ipaddress
+import os
+import random
+import sys
+import time
+
+# Configuración
+HOSTS = int(os.environ.get("NMAP_SINTETICO_HOSTS", 10))
+PUERTOS = int(os.environ.get("NMAP_SINTETICO_PUERTOS", 100))
+SCRIPTS = int(os.environ.get("NMAP_SINTETICO_SCRIPTS", 2))
+LINEAS_SCRIPT = int(os.environ.get("NMAP_SINTETICO_LINEAS_SCRIPT", 4))
+SEMILLA = int(os.environ.get("NMAP_SINTETICO_SEMILLA", 1))
+
+VERSION = "7.94"
+
+# Servicios con los que se rellenan los puertos abiertos
+SERVICIOS = (
+    ("http", "nginx", "1.24.0"),
+    ("https", "Apache httpd", "2.4.58"),
+    ("ssh", "OpenSSH", "9.6p1"),
+    ("smtp", "Postfix smtpd", ""),
+    ("mysql", "MySQL", "8.0.36"),
+    ("domain", "ISC BIND", "9.18.24"),
+)
+NOMBRES_SCRIPTS = (
+    "http-title",
+    "http-headers",
+    "ssl-cert",
+    "banner",
+    "http-server-header",
+    "ssh-hostkey",
+)
+
+
+def _escapar(texto):
+    """Escapa un texto para usarlo en un atributo XML (saltos de línea incluidos)"""
+    return (
+        texto.replace("&", "&amp;")
+        .replace('"', "&quot;")
+        .replace("<", "&lt;")
+        .replace(">", "&gt;")
+        .replace("\n", "&#xa;")
+    )
+
+
+def primera_direccion(argumentos):
+    """Primera dirección IPv4 de los objetivos, o 10.0.0.1 si no hay ninguna"""
+    for argumento in reversed(argumentos):
+        try:
+            return ipaddress.IPv4Address(argumento.split("/")[0].split("-")[0])
+        except ValueError:
+            continue
+    return ipaddress.IPv4Address("10.0.0.1")
+
+
+def generar(argumentos, hosts=HOSTS, puertos=PUERTOS, scripts=SCRIPTS, semilla=SEMILLA):
+    """
+    Genera la salida XML de un escaneo sintético
+
+    Args:
+        argumentos (list): Línea de comandos recibida (sin el ejecutable)
+        hosts (int): Hosts activos a emitir
+        puertos (int): Puertos por host (uno de cada cuatro cerrado)
+        scripts (int): Salidas de script por puerto abierto
+
+    Yields:
+        str: Trozos del XML en el orden en que nmap los escribiría
+    """
+    azar = random.Random(semilla)
+    inicio = int(time.time())
+    comando = _escapar(" ".join(["nmap"] + argumentos))
+    yield '<?xml version="1.0" encoding="UTF-8"?>\n'
+    yield (
+        f'<nmaprun scanner="nmap" args="{comando}" start="{inicio}" '
+        f'version="{VERSION}" xmloutputversion="1.05">\n'
+    )
+    yield (
+        f'<scaninfo type="connect" protocol="tcp" numservices="{puertos}" '
+        f'services="1-{puertos}"/>\n'
+    )
+    yield '<verbose level="0"/>\n<debugging level="0"/>\n'
+
+    direccion = primera_direccion(argumentos)
+    for indice in range(hosts):
+        ip = direccion + indice
+        partes = [
+            f'<host starttime="{inicio}" endtime="{inicio + 1}">'
+            '<status state="up" reason="syn-ack" reason_ttl="0"/>\n'
+            f'<address addr="{ip}" addrtype="ipv4"/>\n'
+            f'<hostnames><hostname name="host-{indice}.sintetico" type="PTR"/>'
+            "</hostnames>\n<ports>"
+        ]
+        for puerto in range(1, puertos + 1):
+            if puerto % 4 == 0:
+                partes.append(
+                    f'<port protocol="tcp" portid="{puerto}">'
+                    '<state state="closed" reason="conn-refused" reason_ttl="0"/>'
+                    "</port>\n"
+                )
+                continue
+            nombre, producto, version = SERVICIOS[puerto % len(SERVICIOS)]
+            partes.append(
+                f'<port protocol="tcp" portid="{puerto}">'
+                '<state state="open" reason="syn-ack" reason_ttl="0"/>'
+                f'<service name="{nombre}" product="{producto}" version="{version}" '
+                'method="probed" conf="10">'
+                f"<cpe>cpe:/a:{nombre}:{nombre}:{version}</cpe></service>"
+            )
+            for numero in range(scripts):
+                salida = "\n".join(
+                    f"  linea {linea} de {ip}:{puerto} {azar.getrandbits(64):016x}"
+                    for linea in range(LINEAS_SCRIPT)
+                )
+                identificador = NOMBRES_SCRIPTS[numero % len(NOMBRES_SCRIPTS)]
+                if numero >= len(NOMBRES_SCRIPTS):
+                    identificador += f"-{numero}"
+                partes.append(
+                    f'<script id="{identificador}" output="{_escapar(salida)}"/>'
+                )
+            partes.append("</port>\n")
+        partes.append(
+            "</ports>\n"
+            f'<times srtt="{azar.randint(200, 50000)}" rttvar="{azar.randint(50, 5000)}"'
+            ' to="100000"/>\n</host>\n'
+        )
+        yield "".join(partes)
+
+    fin = int(time.time())
+    yield (
+        f'<runstats><finished time="{fin}" timestr="{time.ctime(fin)}" '
+        f'elapsed="{max(fin - inicio, 1)}" summary="" exit="success"/>'
+        f'<hosts up="{hosts}" down="0" total="{hosts}"/></runstats>\n'
+        "</nmaprun>\n"
+    )
+
+
+def main():
+    argumentos = sys.argv[1:]
+    # python-nmap comprueba la versión al crear el PortScanner
+    if "-V" in argumentos or "--version" in argumentos:
+        print(f"Nmap version {VERSION} ( https://nmap.org )")
+        return
+
+    archivo = os.environ.get("NMAP_SINTETICO_ARCHIVO")
+    if archivo:
+        with open(archivo, encoding="utf-8") as xml:
+            for linea in xml:
+                sys.stdout.write(linea)
+        return
+    for trozo in generar(argumentos):
+        sys.stdout.write(trozo)
+
+
+if __name__ == "__main__":
+    main()
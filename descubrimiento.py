@@ -0,0 +1,159 @@
+"""
+Descubrimiento de hosts previo al escaneo de puertos
+Un barrido rápido (-sn) busca los hosts activos y cada uno pasa al pool de
+escaneo de puertos en cuanto nmap lo da por activo, sin esperar a que el
+barrido termine; las direcciones sin respuesta no llegan a escanearse
+"""
+
+import os
+import queue
+import threading
+import time
+
+import fragmentos
+import motor_nmap
+import presupuesto
+
+# Configuración
+ARGUMENTOS_DESCUBRIMIENTO = os.environ.get("ARGUMENTOS_DESCUBRIMIENTO", "-sn -T4")
+TIPOS_CON_DESCUBRIMIENTO = tuple(
+    tipo.strip()
+    for tipo in os.environ.get("TIPOS_CON_DESCUBRIMIENTO", "intensivo,vuln").split(",")
+    if tipo.strip()
+)
+
+
+def aplicable(args_nmap):
+    """Indica si el escaneo admite un descubrimiento previo"""
+    # Con -Pn no se descubre nada y con -sn el escaneo ya es un descubrimiento
+    return "-Pn" not in args_nmap and "-sn" not in args_nmap
+
+
+def escanear_con_descubrimiento(
+    objetivos,
+    args_nmap,
+    planificados,
+    al_evento=None,
+    al_completar=None,
+    cancelacion=None,
+    porciones_puertos=None,
+    separar=True,
+    cuota=None,
+):
+    """
+    Escanea en dos etapas solapadas: descubrimiento y escaneo de puertos
+
+    Args:
+        objetivos (str): Especificación de objetivos de nmap
+        args_nmap (list): Argumentos del escaneo de puertos
+        planificados (list): Recibe la etapa de descubrimiento y, después,
+                             cada subescaneo de puertos según se planifica
+        al_evento (callable): Llamada con (subescaneo, tipo, datos) por cada
+                              evento de nmap de cualquiera de las etapas
+        al_completar (callable): Como en fragmentos.ejecutar_subescaneos
+        cancelacion (threading.Event): Detiene el envío de nuevos hosts
+        porciones_puertos (int): Porciones de puertos por host
+        separar (bool): Lanzar TCP y UDP como procesos nmap distintos
+        cuota (dict): Parte del presupuesto de tráfico reservada para el
+                      escaneo, que se reparte entre el barrido y el pool
+
+    Returns:
+        tuple: (resultado combinado de python-nmap, tiempos de cada etapa)
+    """
+    notificar = al_evento or (lambda subescaneo, tipo, datos: None)
+    # Los hosts ya se saben activos: el escaneo de puertos no repite el ping
+    args_puertos = list(args_nmap) + ["-Pn"]
+    etapa = {
+        "objetivos": objetivos,
+        "argumentos": ARGUMENTOS_DESCUBRIMIENTO,
+        "protocolo": None,
+        "grupo": "descubrimiento",
+    }
+    planificados.append(etapa)
+
+    # El barrido corre a la vez que el pool: cuenta como un proceso más
+    cuota_barrido = presupuesto.repartir_cuota(
+        cuota or {}, fragmentos.PARALELISMO_FRAGMENTOS + 1
+    )
+    nuevos = queue.Queue()
+    descubrimiento = {}
+    tiempos = {"descubrimiento": None, "escaneo_puertos": None, "total": None}
+    inicio = time.time()
+    primer_envio = []
+
+    def al_evento_descubrimiento(tipo, datos):
+        if tipo == "host" and datos["estado"] == "up":
+            if not primer_envio:
+                primer_envio.append(time.time())
+            for subescaneo in fragmentos.planificar_subescaneos(
+                datos["host"],
+                args_puertos,
+                porciones_puertos=porciones_puertos,
+                separar=separar,
+            ):
+                subescaneo["grupo"] = datos["host"]
+                planificados.append(subescaneo)
+                nuevos.put(subescaneo)
+            # Los eventos "host" completos llegan después, del escaneo de puertos
+            tipo = "host_descubierto"
+        notificar(etapa, tipo, datos)
+
+    def descubrir():
+        try:
+            descubrimiento["resultado"] = motor_nmap.ejecutar_nmap(
+                objetivos,
+                presupuesto.aplicar_cuota(ARGUMENTOS_DESCUBRIMIENTO, cuota_barrido),
+                al_evento_descubrimiento,
+            )
+        except Exception as e:
+            descubrimiento["error"] = e
+        finally:
+            tiempos["descubrimiento"] = round(time.time() - inicio, 2)
+            notificar(etapa, "etapa", {"etapa": "descubrimiento", **tiempos})
+            nuevos.put(None)
+
+    hilo = threading.Thread(target=descubrir, name="descubrimiento")
+    hilo.daemon = True
+    hilo.start()
+
+    completados = fragmentos.ejecutar_subescaneos(
+        [],
+        al_completar,
+        al_evento,
+        cancelacion,
+        nuevos=nuevos,
+        ejecutor=presupuesto.ejecutor_fragmentos(
+            cuota, fragmentos.PARALELISMO_FRAGMENTOS + 1
+        ),
+    )
+    hilo.join()
+    if "error" in descubrimiento:
+        raise descubrimiento["error"]
+
+    fin = time.time()
+    resultado = fragmentos.combinar_resultados(
+        [res for _, res in completados],
+        elapsed=fin - inicio,
+        grupos=[sub["grupo"] for sub, _ in completados],
+    )
+
+    # Los totales salen del barrido, que es el que recorrió todas las direcciones
+    barrido = descubrimiento["resultado"]
+    estadisticas = resultado["nmap"]["scanstats"]
+    total = int(barrido["nmap"]["scanstats"].get("totalhosts") or 0)
+    activos = int(estadisticas["uphosts"])
+    estadisticas["totalhosts"] = str(total)
+    estadisticas["downhosts"] = str(max(total - activos, 0))
+    if not estadisticas["timestr"]:
+        estadisticas["timestr"] = barrido["nmap"]["scanstats"].get("timestr", "")
+    if barrido["nmap"].get("parcial"):
+        resultado["nmap"]["parcial"] = True
+
+    tiempos["escaneo_puertos"] = round(fin - primer_envio[0], 2) if primer_envio else 0
+    tiempos["total"] = round(fin - inicio, 2)
+    tiempos["hosts_descubiertos"] = int(
+        barrido["nmap"]["scanstats"].get("uphosts") or 0
+    )
+    tiempos["direcciones"] = total
+    notificar(etapa, "etapa", {"etapa": "escaneo_puertos", **tiempos})
+    return resultado, tiempos
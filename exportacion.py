@@ -0,0 +1,117 @@
+"""
+Exportación de reportes en un zip generado al vuelo
+El archivo se escribe en un flujo que no admite seek y se va entregando por
+trozos a medida que se añade cada reporte, sin llegar a tenerlo entero en
+memoria
+"""
+
+import io
+import json
+import zipfile
+
+FORMATOS = ("texto", "json", "ndjson")
+
+# Tamaño aproximado de cada trozo entregado al cliente
+TAMANO_TROZO = 64 * 1024
+
+
+class _Salida(io.RawIOBase):
+    """Destino de escritura del zip que acumula los bytes hasta que se recogen"""
+
+    def __init__(self):
+        self.pendiente = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, datos):
+        self.pendiente += datos
+        return len(datos)
+
+    def recoger(self):
+        """Devuelve y descarta los bytes escritos desde la última recogida"""
+        datos = bytes(self.pendiente)
+        self.pendiente.clear()
+        return datos
+
+
+def trozos_texto(lineas, tamano=TAMANO_TROZO):
+    """Agrupa líneas de texto en trozos de bytes de unos `tamano` bytes"""
+    trozo = []
+    acumulado = 0
+    for linea in lineas:
+        trozo.append(linea)
+        acumulado += len(linea) + 1
+        if acumulado >= tamano:
+            yield "\n".join(trozo).encode("utf-8") + b"\n"
+            trozo = []
+            acumulado = 0
+    if trozo:
+        yield "\n".join(trozo).encode("utf-8")
+
+
+def vista_json(metadatos, escaneo):
+    """Reporte completo (metadatos y resultado estructurado) como dict JSON"""
+    return {
+        "id": metadatos["id"],
+        "nombre": metadatos["nombre"],
+        "fecha": metadatos["fecha"],
+        "timestamp": metadatos["timestamp"],
+        "parcial": metadatos["parcial"],
+        "datos": escaneo.a_dict(),
+    }
+
+
+def generar_zip(reportes, formato="texto"):
+    """
+    Genera un zip con los reportes, entregándolo por trozos
+
+    Args:
+        reportes (iterable): Pares (metadatos, modelo.Escaneo)
+        formato (str): "texto" (un .txt por reporte), "json" (un .json por
+                       reporte) o "ndjson" (un único reportes.ndjson con un
+                       reporte por línea)
+
+    Yields:
+        bytes: Trozos consecutivos (no vacíos) del archivo zip
+    """
+    return (trozo for trozo in _escribir_zip(reportes, formato) if trozo)
+
+
+def _escribir_zip(reportes, formato):
+    """Escribe el zip y entrega lo escrito tras cada trozo de cada reporte"""
+    salida = _Salida()
+    with zipfile.ZipFile(salida, "w", compression=zipfile.ZIP_DEFLATED) as archivo:
+        if formato == "ndjson":
+            with archivo.open("reportes.ndjson", "w", force_zip64=True) as entrada:
+                for metadatos, escaneo in reportes:
+                    linea = json.dumps(
+                        vista_json(metadatos, escaneo), ensure_ascii=False
+                    )
+                    entrada.write(linea.encode("utf-8") + b"\n")
+                    yield salida.recoger()
+        else:
+            for metadatos, escaneo in reportes:
+                # El ID evita choques entre reportes con el mismo nombre
+                base = f"{metadatos['nombre']}_{metadatos['id'][:8]}"
+                if formato == "json":
+                    nombre = f"{base}.json"
+                    trozos = [
+                        json.dumps(
+                            vista_json(metadatos, escaneo),
+                            ensure_ascii=False,
+                            indent=2,
+                        ).encode("utf-8")
+                    ]
+                else:
+                    nombre = f"{base}.txt"
+                    trozos = trozos_texto(escaneo.lineas())
+
+                with archivo.open(nombre, "w", force_zip64=True) as entrada:
+                    for trozo in trozos:
+                        entrada.write(trozo)
+                        yield salida.recoger()
+                yield salida.recoger()
+
+    # Directorio central del zip
+    yield salida.recoger()
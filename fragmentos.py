@@ -0,0 +1,584 @@
+"""
+Escaneo fragmentado
+Reparte un conjunto grande de objetivos en fragmentos (y, dentro de cada
+fragmento, los puertos y los protocolos TCP/UDP en subescaneos), los
+escanea con procesos nmap en paralelo y combina los resultados en uno solo
+"""
+
+import ipaddress
+import math
+import multiprocessing
+import os
+import queue
+import threading
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import motor_nmap
+
+# Configuración
+TAMANO_FRAGMENTO = int(os.environ.get("TAMANO_FRAGMENTO", 256))
+PARALELISMO_FRAGMENTOS = int(
+    os.environ.get("PARALELISMO_FRAGMENTOS", os.cpu_count() or 2)
+)
+PORCIONES_PUERTOS = int(os.environ.get("PORCIONES_PUERTOS", 1))
+
+PROTOCOLOS_NMAP = ("ip", "sctp", "tcp", "udp")
+
+# Tipos de escaneo TCP de nmap (todo lo que no es -sU)
+FLAGS_TCP = ("-sS", "-sT", "-sA", "-sW", "-sM", "-sN", "-sF", "-sX")
+
+# Pool de procesos compartido por todos los escaneos fragmentados y el
+# proceso gestor que comparte con él los nmap detenidos
+pool_fragmentos = None
+gestor_pool = None
+lock_pool = threading.Lock()
+
+# Eventos de progreso que los procesos del pool envían al servidor,
+# y quién escucha los de cada subescaneo
+cola_eventos = None
+oyentes_eventos = {}
+
+
+def _valores_octeto(octeto):
+    """Expande un octeto con sintaxis de nmap (5, 1-20, 1,3,5, *) a una lista"""
+    if octeto in ("*", "-"):
+        return list(range(256))
+    valores = []
+    for parte in octeto.split(","):
+        if "-" in parte:
+            inicio, fin = parte.split("-", 1)
+            inicio = int(inicio) if inicio else 0
+            fin = int(fin) if fin else 255
+            if not 0 <= inicio <= fin <= 255:
+                raise ValueError(f"Rango de octeto inválido: {parte}")
+            valores.extend(range(inicio, fin + 1))
+        else:
+            valor = int(parte)
+            if not 0 <= valor <= 255:
+                raise ValueError(f"Octeto inválido: {parte}")
+            valores.append(valor)
+    return valores
+
+
+def _formatear_octeto(valores):
+    """Compacta una lista ordenada de valores de octeto (1,2,3,7 -> 1-3,7)"""
+    partes = []
+    inicio = anterior = valores[0]
+    for valor in valores[1:] + [None]:
+        if valor is not None and valor == anterior + 1:
+            anterior = valor
+            continue
+        partes.append(str(inicio) if inicio == anterior else f"{inicio}-{anterior}")
+        if valor is not None:
+            inicio = anterior = valor
+    return ",".join(partes)
+
+
+def _dividir_octetos(octetos, tamano_fragmento):
+    """Divide una expresión de octetos en unidades de como mucho tamano_fragmento direcciones"""
+    cantidad = math.prod(len(valores) for valores in octetos)
+    if cantidad <= tamano_fragmento:
+        objetivo = ".".join(_formatear_octeto(valores) for valores in octetos)
+        return [(objetivo, cantidad)]
+
+    # Partir por el primer octeto con varios valores
+    for indice, valores in enumerate(octetos):
+        if len(valores) > 1:
+            break
+    por_valor = cantidad // len(valores)
+    valores_por_grupo = max(tamano_fragmento // por_valor, 1)
+
+    unidades = []
+    for inicio in range(0, len(valores), valores_por_grupo):
+        sub_octetos = list(octetos)
+        sub_octetos[indice] = valores[inicio : inicio + valores_por_grupo]
+        unidades.extend(_dividir_octetos(sub_octetos, tamano_fragmento))
+    return unidades
+
+
+def _unidades_objetivo(objetivo, tamano_fragmento):
+    """
+    Convierte un objetivo de nmap en unidades (texto, número de direcciones)
+    de como mucho tamano_fragmento direcciones cada una
+    """
+    # Notación CIDR
+    if "/" in objetivo:
+        try:
+            red = ipaddress.ip_network(objetivo, strict=False)
+        except ValueError:
+            # Nombre de host con máscara (ej: ejemplo.com/24): se deja entero
+            return [(objetivo, 1)]
+        if red.version == 6 or red.num_addresses <= tamano_fragmento:
+            return [(objetivo, red.num_addresses)]
+        nuevo_prefijo = red.max_prefixlen - int(math.log2(tamano_fragmento))
+        nuevo_prefijo = max(nuevo_prefijo, red.prefixlen + 1)
+        return [
+            (str(subred), subred.num_addresses)
+            for subred in red.subnets(new_prefix=nuevo_prefijo)
+        ]
+
+    # Rangos por octeto (192.168.1.1-50, 10.0.0-3.*)
+    partes = objetivo.split(".")
+    if len(partes) == 4 and all(
+        parte and set(parte) <= set("0123456789-,*") for parte in partes
+    ):
+        try:
+            octetos = [_valores_octeto(parte) for parte in partes]
+        except ValueError:
+            return [(objetivo, 1)]
+        return _dividir_octetos(octetos, tamano_fragmento)
+
+    # Nombre de host o IPv6
+    return [(objetivo, 1)]
+
+
+def dividir_objetivos(objetivos, tamano_fragmento=None):
+    """
+    Divide una especificación de objetivos de nmap en fragmentos
+
+    Args:
+        objetivos (str): Hosts, rangos o CIDRs separados por espacios
+        tamano_fragmento (int): Direcciones máximas por fragmento
+
+    Returns:
+        list: Especificaciones de objetivos, una por fragmento
+    """
+    tamano_fragmento = max(int(tamano_fragmento or TAMANO_FRAGMENTO), 1)
+
+    # Las comas separan hosts completos ("10.0.0.1, ejemplo.com") salvo
+    # cuando forman parte de un octeto ("10.0.0.1,2,3")
+    tokens = []
+    for token in objetivos.split():
+        piezas = [pieza for pieza in token.split(",") if pieza]
+        if len(piezas) > 1 and all(
+            "." in pieza or ":" in pieza or "/" in pieza for pieza in piezas
+        ):
+            tokens.extend(piezas)
+        elif piezas:
+            tokens.append(token.strip(","))
+
+    fragmentos = []
+    actual = []
+    direcciones_actuales = 0
+    for token in tokens:
+        for unidad, direcciones in _unidades_objetivo(token, tamano_fragmento):
+            if actual and direcciones_actuales + direcciones > tamano_fragmento:
+                fragmentos.append(" ".join(actual))
+                actual = []
+                direcciones_actuales = 0
+            actual.append(unidad)
+            direcciones_actuales += direcciones
+    if actual:
+        fragmentos.append(" ".join(actual))
+
+    return fragmentos
+
+
+def rangos_objetivo(objetivos):
+    """
+    Rangos (primera, última dirección) que cubren unos objetivos de nmap;
+    los nombres de host se ignoran
+    """
+    rangos = []
+    for objetivo in objetivos.split():
+        try:
+            if "/" in objetivo:
+                red = ipaddress.ip_network(objetivo, strict=False)
+                rangos.append((red[0], red[-1]))
+                continue
+            partes = objetivo.split(".")
+            if len(partes) == 4 and not all(p.isdigit() for p in partes):
+                # Rangos por octeto (192.168.1.1-50, 10.0.0-3.*)
+                octetos = [_valores_octeto(parte) for parte in partes]
+                rangos.append(
+                    (
+                        ipaddress.ip_address(".".join(str(min(o)) for o in octetos)),
+                        ipaddress.ip_address(".".join(str(max(o)) for o in octetos)),
+                    )
+                )
+                continue
+            ip = ipaddress.ip_address(objetivo)
+            rangos.append((ip, ip))
+        except ValueError:
+            continue
+    return rangos
+
+
+def _rangos_puertos(especificacion):
+    """
+    Convierte una lista de puertos de nmap (80,443,1000-2000) en rangos
+    (inicio, fin); devuelve None si usa sintaxis que no se puede trocear
+    """
+    rangos = []
+    for parte in especificacion.split(","):
+        parte = parte.strip()
+        if not parte:
+            continue
+        if parte == "-":
+            rangos.append((1, 65535))
+            continue
+        inicio, separador, fin = parte.partition("-")
+        if not (inicio.isdigit() or inicio == "") or not (fin.isdigit() or fin == ""):
+            # Nombres de servicio, comodines o prefijos T:/U:
+            return None
+        inicio = int(inicio) if inicio else 1
+        fin = int(fin) if separador and fin else (65535 if separador else inicio)
+        if not 0 <= inicio <= fin <= 65535:
+            return None
+        rangos.append((inicio, fin))
+    return rangos or None
+
+
+def dividir_puertos(especificacion, porciones):
+    """
+    Divide una especificación de puertos en porciones con un número
+    parecido de puertos cada una
+
+    Args:
+        especificacion (str): Puertos en formato nmap (ej: 1-65535, 22,80,8000-9000)
+        porciones (int): Número de porciones deseado
+
+    Returns:
+        list: Especificaciones de puertos; [especificacion] si no se puede trocear
+    """
+    rangos = _rangos_puertos(especificacion)
+    if porciones <= 1 or rangos is None:
+        return [especificacion]
+
+    total = sum(fin - inicio + 1 for inicio, fin in rangos)
+    porciones = min(porciones, total)
+    por_porcion = math.ceil(total / porciones)
+
+    resultado = []
+    actual = []
+    en_actual = 0
+    for inicio, fin in rangos:
+        while inicio <= fin:
+            tomar = min(fin - inicio + 1, por_porcion - en_actual)
+            ultimo = inicio + tomar - 1
+            actual.append(str(inicio) if inicio == ultimo else f"{inicio}-{ultimo}")
+            en_actual += tomar
+            inicio = ultimo + 1
+            if en_actual == por_porcion:
+                resultado.append(",".join(actual))
+                actual = []
+                en_actual = 0
+    if actual:
+        resultado.append(",".join(actual))
+    return resultado
+
+
+def separar_protocolos(args_nmap):
+    """
+    Separa unos argumentos con escaneo TCP y UDP (-sS -sU) en dos juegos
+    independientes; devuelve [(None, args_nmap)] si no hay nada que separar
+    """
+    tiene_tcp = any(arg in FLAGS_TCP for arg in args_nmap)
+    if "-sU" not in args_nmap or not tiene_tcp:
+        return [(None, list(args_nmap))]
+    return [
+        ("tcp", [arg for arg in args_nmap if arg != "-sU"]),
+        ("udp", [arg for arg in args_nmap if arg not in FLAGS_TCP]),
+    ]
+
+
+def planificar_subescaneos(
+    objetivos,
+    args_nmap,
+    fragmentar=False,
+    tamano_fragmento=None,
+    porciones_puertos=None,
+    separar=True,
+):
+    """
+    Construye la lista de subescaneos independientes de un escaneo
+
+    Args:
+        objetivos (str): Especificación de objetivos de nmap
+        args_nmap (list): Argumentos generados por generar_argumentos_nmap
+        fragmentar (bool): Repartir los objetivos en fragmentos
+        tamano_fragmento (int): Direcciones máximas por fragmento
+        porciones_puertos (int): Porciones en que dividir el rango de puertos
+        separar (bool): Lanzar TCP y UDP como procesos nmap distintos
+
+    Returns:
+        list: Diccionarios con "objetivos", "argumentos" (str), "protocolo"
+              ("tcp", "udp" o None) y "grupo" (índice del fragmento)
+    """
+    lista_objetivos = (
+        dividir_objetivos(objetivos, tamano_fragmento) if fragmentar else [objetivos]
+    )
+    porciones_puertos = int(porciones_puertos or PORCIONES_PUERTOS)
+
+    # Solo se trocea un único "-p" explícito (no --top-ports ni varios -p)
+    indice_puertos = None
+    if args_nmap.count("-p") == 1 and "--top-ports" not in args_nmap:
+        indice_puertos = args_nmap.index("-p") + 1
+        if indice_puertos >= len(args_nmap):
+            indice_puertos = None
+
+    juegos = separar_protocolos(args_nmap) if separar else [(None, list(args_nmap))]
+
+    subescaneos = []
+    for grupo, objetivos_fragmento in enumerate(lista_objetivos):
+        for protocolo, args_protocolo in juegos:
+            porciones = [None]
+            if indice_puertos is not None:
+                porciones = dividir_puertos(
+                    args_nmap[indice_puertos], porciones_puertos
+                )
+            for porcion in porciones:
+                args_subescaneo = list(args_protocolo)
+                if porcion is not None:
+                    args_subescaneo[args_subescaneo.index("-p") + 1] = porcion
+                subescaneos.append(
+                    {
+                        "objetivos": objetivos_fragmento,
+                        "argumentos": " ".join(args_subescaneo),
+                        "protocolo": protocolo,
+                        "grupo": grupo,
+                    }
+                )
+    return subescaneos
+
+
+def _inicializar_proceso(cola, detenidos):
+    """
+    Inicializa cada proceso del pool con la cola de eventos y los nmap
+    detenidos compartidos
+    """
+    global cola_eventos
+    cola_eventos = cola
+    motor_nmap.detenidos = detenidos
+
+
+def escanear_fragmento(subescaneo_id, objetivos, argumentos):
+    """Escanea un fragmento en un proceso del pool y devuelve el resultado de python-nmap"""
+
+    def al_evento(tipo, datos):
+        cola_eventos.put((subescaneo_id, tipo, datos))
+
+    return motor_nmap.ejecutar_nmap(objetivos, argumentos, al_evento)
+
+
+def _despachar_eventos():
+    """Reparte los eventos que llegan de los procesos del pool a sus oyentes"""
+    while True:
+        subescaneo_id, tipo, datos = cola_eventos.get()
+        oyente = oyentes_eventos.get(subescaneo_id)
+        if oyente is None:
+            continue
+        try:
+            oyente(tipo, datos)
+        except Exception as e:
+            print(f"[!] Error al procesar evento de nmap: {e}")
+
+
+def _combinar_host(destino, origen):
+    """Combina los datos de un host presente en varios resultados"""
+    if origen.get("status", {}).get("state") == "up":
+        destino["status"] = origen["status"]
+
+    nombres = {h.get("name") for h in destino.get("hostnames", [])}
+    for hostname in origen.get("hostnames", []):
+        if hostname.get("name") and hostname.get("name") not in nombres:
+            destino.setdefault("hostnames", []).append(hostname)
+            nombres.add(hostname.get("name"))
+
+    for clave, valor in origen.items():
+        if clave in PROTOCOLOS_NMAP:
+            destino.setdefault(clave, {}).update(valor)
+        elif clave not in destino or not destino[clave]:
+            destino[clave] = valor
+
+
+def combinar_resultados(resultados, elapsed=None, grupos=None):
+    """
+    Combina varios resultados de python-nmap en uno con el mismo formato
+
+    Args:
+        resultados (list): Resultados devueltos por PortScanner.scan()
+        elapsed (float): Duración real del conjunto (por defecto la mayor)
+        grupos (list): Fragmento de objetivos de cada resultado; los
+                       subescaneos de un mismo fragmento cuentan sus hosts una vez
+
+    Returns:
+        dict: Resultado combinado {"nmap": {...}, "scan": {...}}
+    """
+    combinado = {
+        "nmap": {
+            "command_line": "",
+            "scaninfo": {},
+            "scanstats": {
+                "timestr": "",
+                "elapsed": "0",
+                "uphosts": "0",
+                "downhosts": "0",
+                "totalhosts": "0",
+            },
+        },
+        "scan": {},
+    }
+    estadisticas = combinado["nmap"]["scanstats"]
+    mayor_elapsed = 0.0
+    totales_por_grupo = {}
+
+    if grupos is None:
+        grupos = range(len(resultados))
+
+    for grupo, resultado in zip(grupos, resultados):
+        info = resultado.get("nmap", {})
+        if not combinado["nmap"]["command_line"]:
+            combinado["nmap"]["command_line"] = info.get("command_line", "")
+        for protocolo, datos in info.get("scaninfo", {}).items():
+            combinado["nmap"]["scaninfo"].setdefault(protocolo, datos)
+
+        stats = info.get("scanstats", {})
+        totales_por_grupo[grupo] = max(
+            totales_por_grupo.get(grupo, 0), int(stats.get("totalhosts", 0) or 0)
+        )
+        if stats.get("timestr"):
+            estadisticas["timestr"] = stats["timestr"]
+        if info.get("parcial"):
+            combinado["nmap"]["parcial"] = True
+        mayor_elapsed = max(mayor_elapsed, float(stats.get("elapsed", 0) or 0))
+
+        for direccion, datos in resultado.get("scan", {}).items():
+            if direccion in combinado["scan"]:
+                _combinar_host(combinado["scan"][direccion], datos)
+            else:
+                combinado["scan"][direccion] = datos
+
+    # Los hosts activos se cuentan sobre el resultado ya combinado
+    total = sum(totales_por_grupo.values())
+    activos = sum(
+        1
+        for datos in combinado["scan"].values()
+        if datos.get("status", {}).get("state") == "up"
+    )
+    estadisticas["totalhosts"] = str(total)
+    estadisticas["uphosts"] = str(activos)
+    estadisticas["downhosts"] = str(max(total - activos, 0))
+    estadisticas["elapsed"] = f"{elapsed if elapsed is not None else mayor_elapsed:.2f}"
+    return combinado
+
+
+def obtener_pool():
+    """Devuelve el pool de procesos compartido, creándolo la primera vez"""
+    global pool_fragmentos, cola_eventos, gestor_pool
+    with lock_pool:
+        if pool_fragmentos is None:
+            # spawn evita heredar el estado de los hilos del servidor
+            contexto = multiprocessing.get_context("spawn")
+            cola_eventos = contexto.Queue()
+            # Los nmap del pool se detienen desde este proceso: la marca de
+            # detenido tiene que verse en el proceso que lee su salida
+            gestor_pool = contexto.Manager()
+            detenidos = gestor_pool.dict(motor_nmap.detenidos)
+            motor_nmap.detenidos = detenidos
+            pool_fragmentos = ProcessPoolExecutor(
+                max_workers=PARALELISMO_FRAGMENTOS,
+                mp_context=contexto,
+                initializer=_inicializar_proceso,
+                initargs=(cola_eventos, detenidos),
+            )
+            hilo = threading.Thread(target=_despachar_eventos, name="eventos-nmap")
+            hilo.daemon = True
+            hilo.start()
+        return pool_fragmentos
+
+
+def ejecutar_subescaneos(
+    subescaneos,
+    al_completar=None,
+    al_evento=None,
+    cancelacion=None,
+    nuevos=None,
+    ejecutor=None,
+):
+    """
+    Ejecuta los subescaneos en el pool de procesos
+
+    Args:
+        subescaneos (list): Subescaneos devueltos por planificar_subescaneos
+        al_completar (callable): Llamada con (subescaneo, resultado, completados)
+                                 en cuanto termina cada subescaneo
+        al_evento (callable): Llamada con (subescaneo, tipo, datos) por cada
+                              evento de progreso de nmap
+        cancelacion (threading.Event): Si se activa, los subescaneos que aún
+                                       no empezaron se descartan
+        nuevos (queue.Queue): Subescaneos que se van añadiendo mientras los
+                              demás ya están en marcha; None marca el final
+        ejecutor (callable): Función de nivel de módulo que ejecuta cada
+                             subescaneo en el pool, con los argumentos de
+                             escanear_fragmento (por defecto, esa)
+
+    Returns:
+        list: Pares (subescaneo, resultado) en orden de finalización
+    """
+    pool = obtener_pool()
+    futuros = {}
+
+    def enviar(subescaneo):
+        subescaneo_id = str(uuid.uuid4())
+        if al_evento:
+            oyentes_eventos[subescaneo_id] = (
+                lambda tipo, datos, sub=subescaneo: al_evento(sub, tipo, datos)
+            )
+        futuro = pool.submit(
+            ejecutor or escanear_fragmento,
+            subescaneo_id,
+            subescaneo["objetivos"],
+            subescaneo["argumentos"],
+        )
+        futuros[futuro] = (subescaneo_id, subescaneo)
+        return futuro
+
+    for subescaneo in subescaneos:
+        enviar(subescaneo)
+
+    completados = []
+    pendientes = set(futuros)
+    esperando_nuevos = nuevos is not None
+    try:
+        while pendientes or esperando_nuevos:
+            # Enviar al pool los subescaneos que hayan llegado entretanto
+            while esperando_nuevos:
+                try:
+                    subescaneo = nuevos.get(block=not pendientes, timeout=0.5)
+                except queue.Empty:
+                    break
+                if subescaneo is None:
+                    esperando_nuevos = False
+                elif cancelacion is None or not cancelacion.is_set():
+                    pendientes.add(enviar(subescaneo))
+            if not pendientes:
+                continue
+
+            terminados, pendientes = wait(
+                pendientes,
+                timeout=0.1 if esperando_nuevos else 0.5,
+                return_when=FIRST_COMPLETED,
+            )
+            for futuro in terminados:
+                if futuro.cancelled():
+                    continue
+                subescaneo = futuros[futuro][1]
+                completados.append((subescaneo, futuro.result()))
+                if al_completar:
+                    al_completar(subescaneo, completados[-1][1], completados)
+
+            if cancelacion is not None and cancelacion.is_set():
+                # Los que ya están en marcha terminan al detener su nmap
+                for futuro in pendientes:
+                    futuro.cancel()
+    except Exception:
+        for futuro in futuros:
+            futuro.cancel()
+        raise
+    finally:
+        for subescaneo_id, _ in futuros.values():
+            oyentes_eventos.pop(subescaneo_id, None)
+
+    return completados
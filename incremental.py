@@ -0,0 +1,258 @@
+"""
+Reescaneo incremental a partir del reporte anterior de un objetivo
+Primero se comprueban deprisa los puertos que estaban abiertos y una muestra
+del resto de puertos pedidos; solo los hosts en los que algo cambió se
+vuelven a escanear con los argumentos completos y el resto se copia del
+reporte anterior
+"""
+
+import os
+import random
+import time
+
+import fragmentos
+import modelo
+
+# Configuración
+PORCENTAJE_MUESTRA_INCREMENTAL = int(
+    os.environ.get("PORCENTAJE_MUESTRA_INCREMENTAL", 10)
+)
+MAX_MUESTRA_INCREMENTAL = int(os.environ.get("MAX_MUESTRA_INCREMENTAL", 2000))
+
+# Argumentos lentos que no hacen falta para saber si un puerto cambió
+ARGUMENTOS_LENTOS = ("-A", "-O", "-sV", "-sC", "--traceroute")
+ARGUMENTOS_LENTOS_CON_VALOR = (
+    "--script",
+    "--script-args",
+    "--version-intensity",
+    "-p",
+    "--top-ports",
+)
+
+
+def puertos_conocidos(escaneo):
+    """Puertos abiertos de cada host activo: {direccion: {(protocolo, numero)}}"""
+    return {
+        host.direccion: {
+            (puerto.protocolo, puerto.numero)
+            for puerto in host.puertos
+            if puerto.estado == "open"
+        }
+        for host in escaneo.hosts
+        if host.estado == "up"
+    }
+
+
+def _protocolos(args_nmap):
+    """Protocolos que escanean unos argumentos de nmap"""
+    protocolos = []
+    if "-sU" not in args_nmap or any(a in fragmentos.FLAGS_TCP for a in args_nmap):
+        protocolos.append("tcp")
+    if "-sU" in args_nmap:
+        protocolos.append("udp")
+    return protocolos
+
+
+def _valor_puertos(args_nmap):
+    """Valor de -p en unos argumentos de nmap, o None"""
+    for anterior, arg in zip(args_nmap, args_nmap[1:]):
+        if anterior == "-p":
+            return arg
+    return None
+
+
+def _compactar(numeros):
+    """Convierte números de puerto en una lista de nmap (22,80,8000-8010)"""
+    partes = []
+    numeros = sorted(numeros)
+    inicio = anterior = None
+    for numero in numeros + [None]:
+        if inicio is not None and numero == anterior + 1:
+            anterior = numero
+            continue
+        if inicio is not None:
+            partes.append(str(inicio) if inicio == anterior else f"{inicio}-{anterior}")
+        inicio = anterior = numero
+    return ",".join(partes)
+
+
+def muestra_puertos(args_nmap, excluidos):
+    """
+    Elige al azar un PORCENTAJE_MUESTRA_INCREMENTAL de los puertos pedidos
+    con -p que no están en excluidos (a lo sumo MAX_MUESTRA_INCREMENTAL)
+
+    Con --top-ports o listas que no se pueden expandir no hay muestra
+    """
+    rangos = fragmentos._rangos_puertos(_valor_puertos(args_nmap) or "")
+    if rangos is None:
+        return set()
+    restantes = sorted(
+        {n for inicio, fin in rangos for n in range(inicio, fin + 1)} - excluidos
+    )
+    tamano = min(
+        len(restantes) * PORCENTAJE_MUESTRA_INCREMENTAL // 100,
+        MAX_MUESTRA_INCREMENTAL,
+    )
+    return set(random.sample(restantes, tamano))
+
+
+def planificar_comprobacion(anterior, args_nmap):
+    """
+    Argumentos del escaneo rápido de comprobación
+
+    Args:
+        anterior (modelo.Escaneo): Resultado del escaneo anterior
+        args_nmap (list): Argumentos completos del escaneo
+
+    Returns:
+        tuple: (argumentos de comprobación, {protocolo: puertos comprobados})
+    """
+    conocidos = set()
+    for puertos in puertos_conocidos(anterior).values():
+        conocidos |= puertos
+    protocolos = _protocolos(args_nmap)
+    muestra = muestra_puertos(args_nmap, {numero for protocolo, numero in conocidos})
+    comprobados = {
+        protocolo: {n for p, n in conocidos if p == protocolo} | muestra
+        for protocolo in protocolos
+    }
+
+    argumentos = []
+    saltar = False
+    for arg in args_nmap:
+        if saltar:
+            saltar = False
+        elif arg in ARGUMENTOS_LENTOS_CON_VALOR:
+            saltar = True
+        elif arg not in ARGUMENTOS_LENTOS:
+            argumentos.append(arg)
+
+    if len(protocolos) > 1:
+        especificacion = ",".join(
+            f"{protocolo[0].upper()}:{_compactar(comprobados[protocolo])}"
+            for protocolo in protocolos
+            if comprobados[protocolo]
+        )
+    else:
+        especificacion = _compactar(comprobados[protocolos[0]])
+    # Sin puertos que comprobar basta con saber qué hosts siguen activos
+    argumentos.extend(["-p", especificacion] if especificacion else ["-sn"])
+    if not especificacion:
+        argumentos = [a for a in argumentos if a not in fragmentos.FLAGS_TCP + ("-sU",)]
+    return argumentos, comprobados
+
+
+def comprobacion_omitida(anterior):
+    """
+    Resultado de python-nmap en lugar de una comprobación que no se hace
+    (sin puertos que comprobar y con un motor que no admite -sn): repite las
+    estadísticas del escaneo anterior y no recorre ningún host
+    """
+    return {
+        "nmap": {
+            "command_line": None,
+            "scaninfo": {},
+            "scanstats": {
+                "timestr": time.ctime(),
+                "elapsed": "0",
+                "uphosts": str(anterior.hosts_activos),
+                "downhosts": str(anterior.hosts_inactivos),
+                "totalhosts": str(anterior.total_hosts),
+            },
+            "omitida": True,
+        },
+        "scan": {},
+    }
+
+
+def hosts_cambiados(anterior, comprobacion):
+    """
+    Hosts que hay que volver a escanear completos según la comprobación
+
+    Un host cambió si es nuevo, si un puerto que estaba abierto ya no lo
+    está o si aparece abierto un puerto que antes no lo estaba
+
+    Args:
+        anterior (modelo.Escaneo): Resultado del escaneo anterior
+        comprobacion (dict): Resultado de python-nmap de la comprobación
+
+    Returns:
+        tuple: (direcciones cambiadas, direcciones sin cambios)
+    """
+    conocidos = puertos_conocidos(anterior)
+    cambiados = []
+    sin_cambios = []
+    for direccion, datos in comprobacion.get("scan", {}).items():
+        if datos.get("status", {}).get("state") != "up":
+            continue
+        host = modelo.Host.desde_nmap(direccion, datos)
+        abiertos = {
+            (puerto.protocolo, puerto.numero)
+            for puerto in host.puertos
+            if puerto.estado == "open"
+        }
+        # Todos los puertos conocidos se comprobaron: los que nmap no lista
+        # están en el estado por defecto, es decir, ya no están abiertos
+        anteriores = conocidos.get(direccion)
+        if anteriores is None or abiertos != anteriores:
+            cambiados.append(direccion)
+        else:
+            sin_cambios.append(direccion)
+    return sorted(cambiados), sorted(sin_cambios)
+
+
+def componer_escaneo(
+    anterior,
+    anterior_id,
+    comprobacion,
+    completo,
+    sin_cambios,
+    objetivo,
+    puerto,
+    scripts,
+    tipo,
+    argumentos,
+    fecha,
+):
+    """
+    Crea el resultado final: los hosts sin cambios se copian del escaneo
+    anterior y los demás salen del reescaneo completo
+
+    Args:
+        anterior (modelo.Escaneo): Resultado del escaneo anterior
+        anterior_id (str): ID del reporte anterior
+        comprobacion (dict): Resultado de python-nmap de la comprobación
+        completo (dict): Resultado de python-nmap del reescaneo (o None)
+        sin_cambios (list): Direcciones que se copian del escaneo anterior
+
+    Returns:
+        modelo.Escaneo: Resultado con las estadísticas de la comprobación
+    """
+    hosts = {h.direccion: h for h in anterior.hosts if h.direccion in sin_cambios}
+    reescaneados = []
+    parcial = bool(comprobacion["nmap"].get("parcial"))
+    estadisticas = comprobacion["nmap"].get("scanstats", {})
+    if completo is not None:
+        for direccion, datos in completo.get("scan", {}).items():
+            hosts[direccion] = modelo.Host.desde_nmap(direccion, datos)
+            reescaneados.append(direccion)
+        parcial = parcial or bool(completo["nmap"].get("parcial"))
+        estadisticas = dict(
+            estadisticas, timestr=completo["nmap"]["scanstats"].get("timestr", "")
+        )
+
+    return modelo.Escaneo(
+        objetivo,
+        puerto,
+        scripts,
+        tipo,
+        argumentos,
+        fecha,
+        estadisticas.get("timestr", ""),
+        estadisticas.get("totalhosts", 0),
+        estadisticas.get("uphosts", 0),
+        estadisticas.get("downhosts", 0),
+        parcial,
+        tuple(hosts[direccion] for direccion in sorted(hosts)),
+        incremental={"base": anterior_id, "reescaneados": sorted(reescaneados)},
+    )
@@ -0,0 +1,362 @@
+"""
+Lotes de escaneos
+Un lote agrupa muchos escaneos enviados en una sola petición: se validan
+todos antes de aceptarlo y un hilo los va lanzando a medida que hay hueco
+en la cola, sin pasar de MAX_ESCANEOS_LOTES en cola o en progreso para no
+acaparar la cola de los escaneos interactivos. El estado del lote agrega el
+de sus escaneos, que se anota al terminar cada trabajo para no perderlo
+cuando se poda el historial de trabajos
+"""
+
+import os
+import queue
+import threading
+import uuid
+from collections import deque
+from datetime import datetime
+
+import trabajos
+
+# Configuración
+MAX_ESCANEOS_POR_LOTE = int(os.environ.get("MAX_ESCANEOS_POR_LOTE", 5000))
+MAX_ESCANEOS_LOTES = int(
+    os.environ.get("MAX_ESCANEOS_LOTES", max(trabajos.TAMANO_COLA // 2, 1))
+)
+MAX_LOTES_HISTORIAL = int(os.environ.get("MAX_LOTES_HISTORIAL", 100))
+# Espera antes de reintentar si la cola de trabajos está llena
+ESPERA_COLA_LLENA = 1
+
+ESTADOS_TERMINADOS = ("completado", "error", "cancelado")
+ESTADOS_ESCANEO = ("pendiente",) + trabajos.ESTADOS_ACTIVOS + ESTADOS_TERMINADOS
+
+# Función que lanza un escaneo:
+# lanzador(parametros, forzar) -> (vista del trabajo, cacheado, nuevo)
+lanzador_escaneos = None
+
+# Lotes conocidos y, por cada trabajo, los escaneos de lote que lo siguen:
+# {trabajo_id: [(lote_id, indice)]}
+lotes = {}
+escaneos_por_trabajo = {}
+lock_lotes = threading.Lock()
+
+# Despierta al hilo que lanza los escaneos (lote nuevo o escaneo terminado)
+condicion_lotes = threading.Condition(lock_lotes)
+hilo_lotes = None
+
+
+def configurar_lanzador(funcion):
+    """Registra la función que lanza un escaneo a partir de sus parámetros"""
+    global lanzador_escaneos
+    lanzador_escaneos = funcion
+
+
+def crear_lote(escaneos, nombre=None):
+    """
+    Registra un lote de escaneos ya validados y empieza a lanzarlos
+
+    Args:
+        escaneos (list): Pares (parámetros validados, forzar)
+        nombre (str): Nombre descriptivo del lote
+
+    Returns:
+        dict: Vista del lote (sin el detalle de cada escaneo)
+    """
+    lote_id = str(uuid.uuid4())
+    lote = {
+        "id": lote_id,
+        "nombre": nombre or f"lote_{datetime.now().strftime('%Y%m%d_%H%M%S')}",
+        "creado": datetime.now().isoformat(),
+        "finalizado": None,
+        "cancelado": False,
+        "escaneos": [
+            {
+                "indice": indice,
+                "parametros": dict(parametros),
+                "forzar": forzar,
+                "trabajo_id": None,
+                "estado": "pendiente",
+                "mensaje": None,
+                "reporte_id": None,
+                "cacheado": False,
+            }
+            for indice, (parametros, forzar) in enumerate(escaneos)
+        ],
+        # Índices de los escaneos aún sin lanzar, en orden
+        "por_lanzar": deque(range(len(escaneos))),
+    }
+    iniciar_lanzamiento()
+    with condicion_lotes:
+        lotes[lote_id] = lote
+        condicion_lotes.notify_all()
+        vista = _vista(lote, detalle=False)
+    _podar_lotes()
+    return vista
+
+
+def _actualizar_escaneo(escaneo, trabajo):
+    """Copia a un escaneo de lote el estado de su trabajo (con el lock tomado)"""
+    escaneo["estado"] = trabajo["estado"]
+    escaneo["mensaje"] = trabajo["mensaje"]
+    escaneo["reporte_id"] = trabajo["reporte_id"]
+
+
+def _comprobar_fin(lote):
+    """Marca el lote como terminado si ya no le queda nada (con el lock tomado)"""
+    if lote["finalizado"] is not None:
+        return
+    if any(e["estado"] not in ESTADOS_TERMINADOS for e in lote["escaneos"]):
+        return
+    lote["finalizado"] = datetime.now().isoformat()
+    completados = sum(1 for e in lote["escaneos"] if e["estado"] == "completado")
+    print(
+        f"[✓] Lote {lote['nombre']} terminado: {completados} de "
+        f"{len(lote['escaneos'])} escaneos completados"
+    )
+
+
+def registrar_fin(trabajo):
+    """Anota el resultado de un trabajo en los escaneos de lote que lo siguen"""
+    with condicion_lotes:
+        for lote_id, indice in escaneos_por_trabajo.get(trabajo["id"], ()):
+            lote = lotes.get(lote_id)
+            if lote is None:
+                continue
+            _actualizar_escaneo(lote["escaneos"][indice], trabajo)
+            _comprobar_fin(lote)
+        # Queda hueco para lanzar otro escaneo
+        condicion_lotes.notify_all()
+
+
+def _activos():
+    """Escaneos de lote en cola o en progreso (con el lock tomado)"""
+    return sum(
+        1
+        for lote in lotes.values()
+        for escaneo in lote["escaneos"]
+        if escaneo["estado"] in trabajos.ESTADOS_ACTIVOS
+    )
+
+
+def _siguiente_pendiente():
+    """
+    Siguiente escaneo que toca lanzar, alternando entre los lotes para que
+    uno grande no retrase a los demás (con el lock tomado)
+
+    Returns:
+        tuple: (lote, escaneo), o None si no hay ninguno o no hay hueco
+    """
+    if _activos() >= MAX_ESCANEOS_LOTES:
+        return None
+    candidatos = [
+        lote for lote in lotes.values() if lote["por_lanzar"] and not lote["cancelado"]
+    ]
+    if not candidatos:
+        return None
+    # El lote que lleva más tiempo sin lanzar nada
+    lote = min(candidatos, key=lambda l: l.get("ultimo_lanzamiento") or l["creado"])
+    lote["ultimo_lanzamiento"] = datetime.now().isoformat()
+    return lote, lote["escaneos"][lote["por_lanzar"].popleft()]
+
+
+def lanzar_siguiente():
+    """
+    Lanza el siguiente escaneo pendiente de los lotes
+
+    Returns:
+        bool: True si lanzó (o descartó) uno, False si no había nada que
+              lanzar o hay que esperar a que se libere la cola
+    """
+    with condicion_lotes:
+        siguiente = _siguiente_pendiente()
+    if siguiente is None:
+        return False
+    lote, escaneo = siguiente
+
+    try:
+        trabajo, cacheado, _ = lanzador_escaneos(
+            dict(escaneo["parametros"]), escaneo["forzar"]
+        )
+    except queue.Full:
+        with condicion_lotes:
+            if lote["cancelado"]:
+                escaneo.update(
+                    estado="cancelado", mensaje="Lote detenido antes de lanzarlo"
+                )
+                _comprobar_fin(lote)
+            else:
+                lote["por_lanzar"].appendleft(escaneo["indice"])
+        return False
+    except Exception as e:
+        print(f"[!] Lote {lote['nombre']}: no se pudo lanzar un escaneo: {e}")
+        with condicion_lotes:
+            escaneo.update(estado="error", mensaje=f"No se pudo lanzar: {e}")
+            _comprobar_fin(lote)
+        return True
+
+    with condicion_lotes:
+        escaneo["trabajo_id"] = trabajo["id"]
+        escaneo["cacheado"] = cacheado
+        escaneos_por_trabajo.setdefault(trabajo["id"], []).append(
+            (lote["id"], escaneo["indice"])
+        )
+        # Puede haber terminado antes de anotarlo en escaneos_por_trabajo
+        _actualizar_escaneo(escaneo, trabajos.obtener_trabajo(trabajo["id"]) or trabajo)
+        _comprobar_fin(lote)
+        cancelado = lote["cancelado"]
+    # El lote se detuvo mientras se lanzaba
+    if cancelado:
+        trabajos.cancelar_trabajo(trabajo["id"])
+    return True
+
+
+def bucle_lotes():
+    """Lanza los escaneos de los lotes a medida que hay hueco"""
+    while True:
+        try:
+            if lanzar_siguiente():
+                continue
+        except Exception as e:
+            print(f"[!] Error al lanzar los escaneos de los lotes: {e}")
+        with condicion_lotes:
+            condicion_lotes.wait(ESPERA_COLA_LLENA)
+
+
+def iniciar_lanzamiento():
+    """Arranca el hilo que lanza los escaneos de los lotes si aún no está en marcha"""
+    global hilo_lotes
+    with lock_lotes:
+        if hilo_lotes is not None:
+            return
+        hilo_lotes = threading.Thread(target=bucle_lotes, name="lotes")
+        hilo_lotes.daemon = True
+        hilo_lotes.start()
+
+
+def cancelar_lote(lote_id):
+    """
+    Detiene un lote: sus escaneos pendientes ya no se lanzan y se cancelan
+    los que están en cola o en progreso
+
+    Returns:
+        list: IDs de los trabajos cancelados, o None si el lote no existe
+    """
+    with condicion_lotes:
+        lote = lotes.get(lote_id)
+        if lote is None:
+            return None
+        lote["cancelado"] = True
+        for indice in lote["por_lanzar"]:
+            lote["escaneos"][indice].update(
+                estado="cancelado", mensaje="Lote detenido antes de lanzarlo"
+            )
+        lote["por_lanzar"].clear()
+        activos = [
+            e["trabajo_id"]
+            for e in lote["escaneos"]
+            if e["estado"] in trabajos.ESTADOS_ACTIVOS
+        ]
+        _comprobar_fin(lote)
+    return [
+        trabajo_id for trabajo_id in activos if trabajos.cancelar_trabajo(trabajo_id)
+    ]
+
+
+def _refrescar(lote):
+    """Actualiza los escaneos en curso con el estado de su trabajo (con el lock tomado)"""
+    for escaneo in lote["escaneos"]:
+        if escaneo["estado"] in trabajos.ESTADOS_ACTIVOS:
+            trabajo = trabajos.obtener_trabajo(escaneo["trabajo_id"])
+            if trabajo is not None:
+                _actualizar_escaneo(escaneo, trabajo)
+    _comprobar_fin(lote)
+
+
+def _vista(lote, detalle=True):
+    """Estado agregado de un lote y, con detalle, el de cada escaneo"""
+    estados = dict.fromkeys(ESTADOS_ESCANEO, 0)
+    for escaneo in lote["escaneos"]:
+        estados[escaneo["estado"]] += 1
+    total = len(lote["escaneos"])
+    terminados = sum(estados[estado] for estado in ESTADOS_TERMINADOS)
+    vista = {
+        "id": lote["id"],
+        "nombre": lote["nombre"],
+        "creado": lote["creado"],
+        "finalizado": lote["finalizado"],
+        "cancelado": lote["cancelado"],
+        "terminado": lote["finalizado"] is not None,
+        "total": total,
+        "terminados": terminados,
+        "progreso": round(100 * terminados / total, 1) if total else 100.0,
+        "estados": estados,
+        "reportes": sum(1 for e in lote["escaneos"] if e["reporte_id"]),
+    }
+    if detalle:
+        vista["escaneos"] = [
+            {
+                "indice": escaneo["indice"],
+                "host": escaneo["parametros"]["host"],
+                "puerto": escaneo["parametros"]["puerto"],
+                "tipo": escaneo["parametros"]["tipo"],
+                "scripts": escaneo["parametros"]["scripts"],
+                "trabajo_id": escaneo["trabajo_id"],
+                "estado": escaneo["estado"],
+                "mensaje": escaneo["mensaje"],
+                "reporte_id": escaneo["reporte_id"],
+                "cacheado": escaneo["cacheado"],
+            }
+            for escaneo in lote["escaneos"]
+        ]
+    return vista
+
+
+def obtener_lote(lote_id):
+    """Devuelve la vista detallada de un lote o None si no existe"""
+    with condicion_lotes:
+        lote = lotes.get(lote_id)
+        if lote is None:
+            return None
+        _refrescar(lote)
+        return _vista(lote)
+
+
+def listar_lotes():
+    """Lista los lotes conocidos (sin el detalle de sus escaneos), del más reciente"""
+    with condicion_lotes:
+        for lote in lotes.values():
+            _refrescar(lote)
+        ordenados = sorted(lotes.values(), key=lambda l: l["creado"], reverse=True)
+        return [_vista(lote, detalle=False) for lote in ordenados]
+
+
+def reportes_lote(lote_id):
+    """
+    IDs de los reportes ya generados por los escaneos de un lote, sin
+    repetir (dos escaneos idénticos comparten reporte)
+
+    Returns:
+        list: IDs en el orden de los escaneos, o None si el lote no existe
+    """
+    with condicion_lotes:
+        lote = lotes.get(lote_id)
+        if lote is None:
+            return None
+        _refrescar(lote)
+        ids = [e["reporte_id"] for e in lote["escaneos"] if e["reporte_id"]]
+    return list(dict.fromkeys(ids))
+
+
+def _podar_lotes():
+    """Descarta los lotes terminados más antiguos por encima del límite"""
+    with condicion_lotes:
+        terminados = sorted(
+            (l for l in lotes.values() if l["finalizado"] is not None),
+            key=lambda l: l["creado"],
+        )
+        for lote in terminados[: max(len(terminados) - MAX_LOTES_HISTORIAL, 0)]:
+            del lotes[lote["id"]]
+            for escaneo in lote["escaneos"]:
+                seguidores = escaneos_por_trabajo.get(escaneo["trabajo_id"], [])
+                seguidores[:] = [s for s in seguidores if s[0] != lote["id"]]
+                if not seguidores:
+                    escaneos_por_trabajo.pop(escaneo["trabajo_id"], None)
@@ -0,0 +1,270 @@
+"""
+Métricas del servicio en formato Prometheus
+Cada worker acumula en memoria sus contadores e histogramas y los suma
+periódicamente a la base de datos, de modo que /metrics devuelve los
+totales de todos los workers de gunicorn; los indicadores instantáneos
+(cola, procesos nmap) los publica cada worker y se suman al leerlos
+"""
+
+import atexit
+import json
+import os
+import threading
+import time
+
+import almacen
+
+# Configuración
+INTERVALO_METRICAS = int(os.environ.get("INTERVALO_METRICAS", 5))
+
+PREFIJO = "escaner_"
+
+# Límites superiores (segundos) de los cubos de cada histograma
+CUBOS_ESCANEO = (1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600, 7200)
+CUBOS_HTTP = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+CUBOS_FASE = (0.01, 0.05, 0.1, 0.5, 1, 5, 15, 60, 300, 1800, 7200)
+
+# Métricas acumulables: tipo, ayuda y cubos (solo los histogramas)
+METRICAS = {
+    "escaneo_duracion_segundos": (
+        "histogram",
+        "Duración de los escaneos por tipo, motor y estado final",
+        CUBOS_ESCANEO,
+    ),
+    "escaneo_fase_segundos": (
+        "histogram",
+        "Duración de cada fase de los escaneos (ver rendimiento.py)",
+        CUBOS_FASE,
+    ),
+    "hosts_escaneados_total": (
+        "counter",
+        "Direcciones recorridas por los escaneos",
+        None,
+    ),
+    "puertos_escaneados_total": (
+        "counter",
+        "Puertos sondeados en los hosts activos",
+        None,
+    ),
+    "webhooks_total": (
+        "counter",
+        "Intentos de envío de los avisos de fin de escaneo por resultado",
+        None,
+    ),
+    "http_peticion_duracion_segundos": (
+        "histogram",
+        "Latencia de la API por ruta, método y código de respuesta",
+        CUBOS_HTTP,
+    ),
+}
+
+# Indicadores instantáneos de cada worker, que se suman entre todos
+INDICADORES = {
+    "cola_trabajos": "Escaneos esperando en la cola",
+    "trabajos_en_progreso": "Escaneos en ejecución",
+    "procesos_nmap_activos": "Procesos nmap en marcha",
+}
+
+# Incrementos aún no sumados a la base de datos:
+# {(nombre, etiquetas en JSON, serie): incremento}
+pendientes = {}
+lock_metricas = threading.Lock()
+
+# Función que devuelve los indicadores de este worker y hilo de volcado
+lector_indicadores = None
+hilo_volcado = None
+
+
+def _etiquetas(etiquetas):
+    """Etiquetas como JSON canónico, para usarlas de clave"""
+    return json.dumps(
+        {clave: str(valor) for clave, valor in sorted(etiquetas.items())},
+        separators=(",", ":"),
+    )
+
+
+def _sumar(nombre, etiquetas, serie, valor):
+    """Acumula un incremento pendiente de volcar"""
+    clave = (nombre, etiquetas, serie)
+    with lock_metricas:
+        pendientes[clave] = pendientes.get(clave, 0) + valor
+
+
+def incrementar(nombre, valor=1, **etiquetas):
+    """Suma valor a un contador"""
+    _sumar(nombre, _etiquetas(etiquetas), "", valor)
+
+
+def observar(nombre, valor, **etiquetas):
+    """Registra una observación en un histograma"""
+    cubos = METRICAS[nombre][2]
+    cubo = next((str(limite) for limite in cubos if valor <= limite), "+Inf")
+    clave = _etiquetas(etiquetas)
+    _sumar(nombre, clave, cubo, 1)
+    _sumar(nombre, clave, "sum", valor)
+    _sumar(nombre, clave, "count", 1)
+
+
+def _contar_puertos(servicios):
+    """Número de puertos de una lista de nmap (1-1000,8080); 0 si no se entiende"""
+    total = 0
+    for parte in (servicios or "").split(","):
+        inicio, separador, fin = parte.strip().partition("-")
+        if not inicio.isdigit() or (separador and not fin.isdigit()):
+            return 0
+        total += int(fin) - int(inicio) + 1 if separador else 1
+    return total
+
+
+def contar_resultado(resultado, tipo):
+    """Suma los hosts y puertos recorridos por un resultado de python-nmap"""
+    info = resultado.get("nmap", {})
+    estadisticas = info.get("scanstats", {})
+    incrementar(
+        "hosts_escaneados_total", int(estadisticas.get("totalhosts") or 0), tipo=tipo
+    )
+    activos = int(estadisticas.get("uphosts") or 0)
+    for protocolo, datos in info.get("scaninfo", {}).items():
+        if not isinstance(datos, dict):
+            continue
+        puertos = _contar_puertos(datos.get("services"))
+        if puertos and activos:
+            incrementar(
+                "puertos_escaneados_total",
+                puertos * activos,
+                tipo=tipo,
+                protocolo=protocolo,
+            )
+
+
+def configurar_indicadores(funcion):
+    """Registra la función que devuelve los indicadores de este worker"""
+    global lector_indicadores
+    lector_indicadores = funcion
+
+
+def volcar():
+    """Suma a la base de datos lo acumulado y publica los indicadores"""
+    global pendientes
+    with lock_metricas:
+        lote, pendientes = pendientes, {}
+    try:
+        if lote:
+            almacen.acumular_metricas(
+                [clave + (valor,) for clave, valor in lote.items()]
+            )
+        if lector_indicadores is not None:
+            almacen.publicar_indicadores(os.getpid(), lector_indicadores())
+    except Exception:
+        # Se reintenta en el siguiente volcado
+        for clave, valor in lote.items():
+            _sumar(*clave, valor)
+        raise
+
+
+def bucle_volcado():
+    """Vuelca las métricas cada INTERVALO_METRICAS segundos"""
+    while True:
+        time.sleep(INTERVALO_METRICAS)
+        try:
+            volcar()
+        except Exception as e:
+            print(f"[!] Error al volcar las métricas: {e}")
+
+
+def iniciar_volcado():
+    """Arranca el volcado periódico de las métricas de este worker"""
+    global hilo_volcado
+    with lock_metricas:
+        if hilo_volcado is not None:
+            return
+        hilo_volcado = threading.Thread(target=bucle_volcado, name="metricas")
+        hilo_volcado.daemon = True
+        hilo_volcado.start()
+    # Lo acumulado desde el último volcado no se pierde al parar el worker
+    atexit.register(volcar)
+
+
+def _numero(valor):
+    """Formatea un valor para la exposición de Prometheus"""
+    return str(int(valor)) if float(valor).is_integer() else repr(float(valor))
+
+
+def _formatear_etiquetas(etiquetas, **extra):
+    """Etiquetas en la sintaxis de Prometheus ({a="b",...})"""
+    pares = dict(json.loads(etiquetas) if etiquetas else {}, **extra)
+    if not pares:
+        return ""
+    escapados = (
+        f'{clave}="'
+        + valor.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        + '"'
+        for clave, valor in pares.items()
+    )
+    return "{" + ",".join(escapados) + "}"
+
+
+def exponer():
+    """Todas las métricas en el formato de texto de Prometheus"""
+    volcar()
+    series = {}
+    for nombre, etiquetas, serie, valor in almacen.leer_metricas():
+        series.setdefault(nombre, {}).setdefault(etiquetas, {})[serie] = valor
+
+    lineas = []
+
+    def cabecera(nombre, tipo, ayuda):
+        lineas.append(f"# HELP {PREFIJO}{nombre} {ayuda}")
+        lineas.append(f"# TYPE {PREFIJO}{nombre} {tipo}")
+
+    for nombre, (tipo, ayuda, cubos) in METRICAS.items():
+        cabecera(nombre, tipo, ayuda)
+        for etiquetas, valores in series.get(nombre, {}).items():
+            if tipo == "counter":
+                lineas.append(
+                    f"{PREFIJO}{nombre}{_formatear_etiquetas(etiquetas)} "
+                    f"{_numero(valores.get('', 0))}"
+                )
+                continue
+            # Los cubos se guardan sueltos; Prometheus los espera acumulados
+            acumulado = 0
+            for limite in [str(limite) for limite in cubos] + ["+Inf"]:
+                acumulado += valores.get(limite, 0)
+                lineas.append(
+                    f"{PREFIJO}{nombre}_bucket"
+                    f"{_formatear_etiquetas(etiquetas, le=limite)} {_numero(acumulado)}"
+                )
+            for serie in ("sum", "count"):
+                lineas.append(
+                    f"{PREFIJO}{nombre}_{serie}{_formatear_etiquetas(etiquetas)} "
+                    f"{_numero(valores.get(serie, 0))}"
+                )
+
+    # Indicadores de los workers que siguen publicando
+    totales = dict.fromkeys(INDICADORES, 0)
+    workers = set()
+    for pid, nombre, valor in almacen.leer_indicadores(3 * INTERVALO_METRICAS):
+        workers.add(pid)
+        if nombre in totales:
+            totales[nombre] += valor
+    for nombre, ayuda in INDICADORES.items():
+        cabecera(nombre, "gauge", ayuda)
+        lineas.append(f"{PREFIJO}{nombre} {_numero(totales[nombre])}")
+    cabecera("workers", "gauge", "Workers que publican métricas")
+    lineas.append(f"{PREFIJO}workers {len(workers)}")
+
+    # Tamaño del almacén de reportes
+    reportes, bytes_reportes = almacen.tamano_almacen()
+    cabecera("reportes_almacenados", "gauge", "Reportes guardados")
+    lineas.append(f"{PREFIJO}reportes_almacenados {reportes}")
+    cabecera("reportes_bytes", "gauge", "Bytes de los datos de los reportes")
+    lineas.append(f"{PREFIJO}reportes_bytes {bytes_reportes}")
+    tamano_base = 0
+    for sufijo in ("", "-wal"):
+        try:
+            tamano_base += os.path.getsize(almacen.RUTA_BASE_DATOS + sufijo)
+        except OSError:
+            pass
+    cabecera("base_datos_bytes", "gauge", "Bytes de la base de datos en disco")
+    lineas.append(f"{PREFIJO}base_datos_bytes {tamano_base}")
+    return "\n".join(lineas) + "\n"
@@ -0,0 +1,473 @@
+"""
+Modelo compacto de los resultados de escaneo
+Cada escaneo se guarda como objetos con __slots__ (hosts, puertos, servicios
+y salida de scripts) en lugar de un texto ya renderizado; el reporte de texto
+se genera solo cuando se pide y queda memorizado
+"""
+
+import fragmentos
+
+
+class Puerto:
+    """Puerto encontrado en un host, con su servicio y la salida de sus scripts"""
+
+    __slots__ = (
+        "numero",
+        "protocolo",
+        "estado",
+        "razon",
+        "servicio",
+        "producto",
+        "version",
+        "extra",
+        "cpe",
+        "scripts",
+    )
+
+    def __init__(
+        self,
+        numero,
+        protocolo,
+        estado,
+        razon="",
+        servicio="",
+        producto="",
+        version="",
+        extra="",
+        cpe="",
+        scripts=(),
+    ):
+        self.numero = numero
+        self.protocolo = protocolo
+        self.estado = estado
+        self.razon = razon
+        self.servicio = servicio
+        self.producto = producto
+        self.version = version
+        self.extra = extra
+        self.cpe = cpe
+        # Pares (id_script, salida) en el orden en que los devolvió nmap
+        self.scripts = scripts
+
+    def a_dict(self):
+        """Vista JSON del puerto"""
+        return {
+            "puerto": self.numero,
+            "protocolo": self.protocolo,
+            "estado": self.estado,
+            "razon": self.razon,
+            "servicio": self.servicio,
+            "producto": self.producto,
+            "version": self.version,
+            "extra": self.extra,
+            "cpe": self.cpe,
+            "scripts": dict(self.scripts),
+        }
+
+    @classmethod
+    def desde_dict(cls, datos):
+        return cls(
+            datos["puerto"],
+            datos["protocolo"],
+            datos["estado"],
+            datos.get("razon", ""),
+            datos.get("servicio", ""),
+            datos.get("producto", ""),
+            datos.get("version", ""),
+            datos.get("extra", ""),
+            datos.get("cpe", ""),
+            tuple(datos.get("scripts", {}).items()),
+        )
+
+
+class Host:
+    """Host escaneado con sus puertos ordenados por protocolo y número"""
+
+    __slots__ = ("direccion", "estado", "nombres", "puertos", "scripts", "sistemas")
+
+    def __init__(
+        self, direccion, estado, nombres=(), puertos=(), scripts=(), sistemas=()
+    ):
+        self.direccion = direccion
+        self.estado = estado
+        self.nombres = nombres
+        self.puertos = puertos
+        # Salida de los scripts de host: pares (id_script, salida)
+        self.scripts = scripts
+        # Coincidencias de sistema operativo: pares (nombre, precisión)
+        self.sistemas = sistemas
+
+    def a_dict(self):
+        """Vista JSON del host"""
+        return {
+            "direccion": self.direccion,
+            "estado": self.estado,
+            "nombres": list(self.nombres),
+            "puertos": [puerto.a_dict() for puerto in self.puertos],
+            "scripts": dict(self.scripts),
+            "sistemas": [
+                {"nombre": nombre, "precision": precision}
+                for nombre, precision in self.sistemas
+            ],
+        }
+
+    @classmethod
+    def desde_dict(cls, datos):
+        return cls(
+            datos["direccion"],
+            datos["estado"],
+            tuple(datos.get("nombres", ())),
+            tuple(Puerto.desde_dict(p) for p in datos.get("puertos", ())),
+            tuple(datos.get("scripts", {}).items()),
+            tuple((s["nombre"], s["precision"]) for s in datos.get("sistemas", ())),
+        )
+
+    @classmethod
+    def desde_nmap(cls, direccion, datos):
+        """Crea el host a partir de los datos de un host de python-nmap"""
+        puertos = []
+        for protocolo in sorted(p for p in datos if p in fragmentos.PROTOCOLOS_NMAP):
+            for numero in sorted(datos[protocolo]):
+                info = datos[protocolo][numero]
+                puertos.append(
+                    Puerto(
+                        numero,
+                        protocolo,
+                        info["state"],
+                        info.get("reason") or "",
+                        info.get("name") or "",
+                        info.get("product") or "",
+                        info.get("version") or "",
+                        info.get("extrainfo") or "",
+                        info.get("cpe") or "",
+                        tuple(info.get("script", {}).items()),
+                    )
+                )
+
+        return cls(
+            direccion,
+            datos.get("status", {}).get("state", ""),
+            tuple(h["name"] for h in datos.get("hostnames", ())),
+            tuple(puertos),
+            tuple((s["id"], s["output"]) for s in datos.get("hostscript", ())),
+            tuple((m["name"], m["accuracy"]) for m in datos.get("osmatch", ())),
+        )
+
+
+class Escaneo:
+    """
+    Resultado completo de un escaneo con los parámetros con que se lanzó
+
+    El texto del reporte se genera con texto() la primera vez que se pide y
+    se reutiliza después (lineas() lo genera sin guardarlo); a_dict()
+    devuelve la vista JSON
+    """
+
+    __slots__ = (
+        "objetivo",
+        "puerto",
+        "scripts",
+        "tipo",
+        "argumentos",
+        "fecha",
+        "duracion",
+        "total_hosts",
+        "hosts_activos",
+        "hosts_inactivos",
+        "parcial",
+        "hosts",
+        "incremental",
+        "_texto",
+    )
+
+    def __init__(
+        self,
+        objetivo,
+        puerto,
+        scripts,
+        tipo,
+        argumentos,
+        fecha,
+        duracion="",
+        total_hosts=0,
+        hosts_activos=0,
+        hosts_inactivos=0,
+        parcial=False,
+        hosts=(),
+        incremental=None,
+    ):
+        self.objetivo = objetivo
+        self.puerto = puerto
+        self.scripts = scripts
+        self.tipo = tipo
+        self.argumentos = argumentos
+        self.fecha = fecha
+        self.duracion = duracion
+        self.total_hosts = total_hosts
+        self.hosts_activos = hosts_activos
+        self.hosts_inactivos = hosts_inactivos
+        self.parcial = parcial
+        self.hosts = hosts
+        # Reescaneo incremental: {"base": ID del reporte anterior,
+        # "reescaneados": direcciones escaneadas de nuevo}; None si no lo es
+        self.incremental = incremental
+        self._texto = None
+
+    @classmethod
+    def desde_nmap(
+        cls, resultado, objetivo, puerto, scripts, tipo, argumentos, fecha, hosts=None
+    ):
+        """
+        Crea el escaneo a partir de un resultado de python-nmap
+
+        Args:
+            resultado (dict): Resultado {"nmap": {...}, "scan": {...}}
+            objetivo (str): Objetivo tal como lo pidió el usuario
+            puerto (str): Puerto(s) pedidos
+            scripts (str): Scripts NSE pedidos
+            tipo (str): Tipo de escaneo
+            argumentos (str): Argumentos de nmap usados
+            fecha (str): Fecha del escaneo ("%Y-%m-%d %H:%M:%S")
+            hosts (list): Hosts ya convertidos a medida que llegaban (ver
+                          motor_nmap.ejecutar_nmap con al_host); si no se
+                          indican, se convierten los de resultado["scan"]
+
+        Returns:
+            Escaneo: Resultado con los hosts ordenados por dirección
+        """
+        info = resultado.get("nmap", {})
+        estadisticas = info.get("scanstats", {})
+        if hosts is None:
+            datos_hosts = resultado.get("scan", {})
+            hosts = [
+                Host.desde_nmap(direccion, datos)
+                for direccion, datos in datos_hosts.items()
+            ]
+        return cls(
+            objetivo,
+            puerto,
+            scripts,
+            tipo,
+            argumentos,
+            fecha,
+            estadisticas.get("timestr", ""),
+            estadisticas.get("totalhosts", 0),
+            estadisticas.get("uphosts", 0),
+            estadisticas.get("downhosts", 0),
+            bool(info.get("parcial")),
+            tuple(sorted(hosts, key=lambda host: host.direccion)),
+        )
+
+    def a_dict(self):
+        """Vista JSON del escaneo"""
+        return {
+            "objetivo": self.objetivo,
+            "puerto": self.puerto,
+            "scripts": self.scripts,
+            "tipo": self.tipo,
+            "argumentos": self.argumentos,
+            "fecha": self.fecha,
+            "parcial": self.parcial,
+            "incremental": self.incremental,
+            "estadisticas": {
+                "duracion": self.duracion,
+                "total_hosts": self.total_hosts,
+                "hosts_activos": self.hosts_activos,
+                "hosts_inactivos": self.hosts_inactivos,
+            },
+            "hosts": [host.a_dict() for host in self.hosts],
+        }
+
+    @classmethod
+    def desde_dict(cls, datos):
+        estadisticas = datos.get("estadisticas", {})
+        return cls(
+            datos["objetivo"],
+            datos["puerto"],
+            datos["scripts"],
+            datos["tipo"],
+            datos["argumentos"],
+            datos["fecha"],
+            estadisticas.get("duracion", ""),
+            estadisticas.get("total_hosts", 0),
+            estadisticas.get("hosts_activos", 0),
+            estadisticas.get("hosts_inactivos", 0),
+            datos.get("parcial", False),
+            tuple(Host.desde_dict(h) for h in datos.get("hosts", ())),
+            datos.get("incremental"),
+        )
+
+    def texto(self):
+        """Devuelve el texto del reporte, generándolo solo la primera vez"""
+        if self._texto is None:
+            self._texto = "\n".join(self.lineas())
+        return self._texto
+
+    def lineas(self):
+        """Genera el texto del reporte línea a línea, un host cada vez"""
+        contenido_reporte = []
+        contenido_reporte.append("=== REPORTE DE ESCANEO ===")
+        contenido_reporte.append(f"Fecha: {self.fecha}")
+        contenido_reporte.append(f"Host objetivo: {self.objetivo}")
+        contenido_reporte.append(f"Puerto(s): {self.puerto}")
+        contenido_reporte.append(f"Tipo de escaneo: {self.tipo.upper()}")
+        contenido_reporte.append(f"Scripts: {self.scripts}")
+        contenido_reporte.append(f"Argumentos Nmap: {self.argumentos}")
+        contenido_reporte.append("=" * 50)
+        contenido_reporte.append("")
+
+        if self.parcial:
+            contenido_reporte.append(
+                "⚠️  Reporte parcial: el escaneo se detuvo antes de terminar."
+            )
+            contenido_reporte.append("")
+
+        if self.incremental:
+            contenido_reporte.append(
+                f"ℹ️  Reescaneo incremental sobre el reporte {self.incremental['base']}: "
+                f"{len(self.incremental['reescaneados'])} host(s) escaneados de nuevo, "
+                "el resto sin cambios."
+            )
+            contenido_reporte.append("")
+
+        # Verificar si hay hosts encontrados
+        if not self.hosts:
+            contenido_reporte.append(
+                "⚠️  No se encontraron hosts o no se pudo acceder al objetivo."
+            )
+            contenido_reporte.append("Posibles causas:")
+            contenido_reporte.append("- El host no está accesible")
+            contenido_reporte.append("- Firewall bloqueando el escaneo")
+            contenido_reporte.append("- Dirección IP incorrecta")
+            contenido_reporte.append("")
+
+        yield from contenido_reporte
+        contenido_reporte.clear()
+
+        for host in self.hosts:
+            contenido_reporte.append(f"Host: {host.direccion} ({host.estado})")
+            contenido_reporte.append("-" * 40)
+
+            # Información del host
+            if host.nombres:
+                contenido_reporte.append(f"Hostnames: {', '.join(host.nombres)}")
+
+            # Información de protocolos (los puertos ya vienen ordenados)
+            protocolo_actual = None
+            for puerto in host.puertos:
+                if puerto.protocolo != protocolo_actual:
+                    protocolo_actual = puerto.protocolo
+                    contenido_reporte.append(f"Protocolo: {protocolo_actual.upper()}")
+
+                # Formatear información del puerto
+                linea_puerto = (
+                    f"  Puerto {puerto.numero}/{puerto.protocolo}: {puerto.estado}"
+                )
+                if puerto.servicio:
+                    linea_puerto += f" - Servicio: {puerto.servicio}"
+                if puerto.producto:
+                    linea_puerto += f" - Producto: {puerto.producto}"
+                if puerto.version:
+                    linea_puerto += f" - Versión: {puerto.version}"
+                if puerto.extra:
+                    linea_puerto += f" - Extra: {puerto.extra}"
+                contenido_reporte.append(linea_puerto)
+
+                # Mostrar resultados de scripts NSE
+                if puerto.scripts:
+                    contenido_reporte.append("    Scripts NSE:")
+                    for nombre_script, salida_script in puerto.scripts:
+                        contenido_reporte.append(f"      [{nombre_script}]:")
+                        # Formatear la salida del script
+                        for linea in salida_script.strip().split("\n"):
+                            contenido_reporte.append(f"        {linea}")
+                    contenido_reporte.append("")
+
+            # Información adicional para escaneos intensivos
+            if self.tipo == "intensivo" and host.sistemas:
+                contenido_reporte.append("Detección de Sistema Operativo:")
+                for nombre, precision in host.sistemas[:3]:  # Top 3 matches
+                    contenido_reporte.append(f"  - {nombre} (Precisión: {precision}%)")
+                contenido_reporte.append("")
+
+            contenido_reporte.append("")
+            yield from contenido_reporte
+            contenido_reporte.clear()
+
+        # Estadísticas del escaneo
+        contenido_reporte.append("=== ESTADÍSTICAS DEL ESCANEO ===")
+        contenido_reporte.append(
+            f"Comando ejecutado: nmap {self.argumentos} {self.objetivo}"
+        )
+        contenido_reporte.append(f"Duración: {self.duracion}")
+        contenido_reporte.append(f"Hosts totales: {self.total_hosts}")
+        contenido_reporte.append(f"Hosts activos: {self.hosts_activos}")
+        contenido_reporte.append(f"Hosts inactivos: {self.hosts_inactivos}")
+
+        yield from contenido_reporte
+
+
+def _servicio(puerto):
+    """Servicio, producto, versión e información extra de un puerto"""
+    return {
+        "servicio": puerto.servicio,
+        "producto": puerto.producto,
+        "version": puerto.version,
+        "extra": puerto.extra,
+    }
+
+
+def diferencias(anterior, actual):
+    """
+    Compara dos escaneos: hosts nuevos y desaparecidos, puertos abiertos y
+    cerrados desde el anterior y cambios de servicio o versión
+
+    Los puertos solo se comparan en los hosts presentes en ambos escaneos
+
+    Args:
+        anterior (Escaneo): Escaneo de referencia
+        actual (Escaneo): Escaneo más reciente
+
+    Returns:
+        dict: Listas hosts_nuevos, hosts_desaparecidos, puertos_abiertos,
+              puertos_cerrados y cambios_servicio
+    """
+    hosts_anteriores = {h.direccion: h for h in anterior.hosts if h.estado == "up"}
+    hosts_actuales = {h.direccion: h for h in actual.hosts if h.estado == "up"}
+    resultado = {
+        "hosts_nuevos": sorted(hosts_actuales.keys() - hosts_anteriores.keys()),
+        "hosts_desaparecidos": sorted(hosts_anteriores.keys() - hosts_actuales.keys()),
+        "puertos_abiertos": [],
+        "puertos_cerrados": [],
+        "cambios_servicio": [],
+    }
+
+    for direccion in sorted(hosts_actuales.keys() & hosts_anteriores.keys()):
+        antes = {
+            (p.protocolo, p.numero): p
+            for p in hosts_anteriores[direccion].puertos
+            if p.estado == "open"
+        }
+        ahora = {(p.protocolo, p.numero): p for p in hosts_actuales[direccion].puertos}
+        for clave in sorted(ahora.keys() | antes.keys()):
+            puerto_antes = antes.get(clave)
+            puerto_ahora = ahora.get(clave)
+            abierto = puerto_ahora is not None and puerto_ahora.estado == "open"
+            entrada = {"host": direccion, "protocolo": clave[0], "puerto": clave[1]}
+            if abierto and puerto_antes is None:
+                resultado["puertos_abiertos"].append(
+                    dict(entrada, **_servicio(puerto_ahora))
+                )
+            elif puerto_antes is not None and not abierto:
+                # Un puerto que nmap ya no lista está en el estado por defecto
+                estado = puerto_ahora.estado if puerto_ahora else "closed"
+                resultado["puertos_cerrados"].append(dict(entrada, estado=estado))
+            elif abierto and _servicio(puerto_antes) != _servicio(puerto_ahora):
+                resultado["cambios_servicio"].append(
+                    dict(
+                        entrada,
+                        antes=_servicio(puerto_antes),
+                        despues=_servicio(puerto_ahora),
+                    )
+                )
+    return resultado
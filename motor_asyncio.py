@@ -0,0 +1,522 @@
+"""
+Motor de escaneo TCP connect con asyncio
+Alternativa a nmap para los escaneos -sT: abre las conexiones directamente
+desde Python, con concurrencia limitada (global y por host), timeouts y
+reintentos, y devuelve el mismo resultado que motor_nmap.ejecutar_nmap para
+que los reportes salgan iguales
+"""
+
+import asyncio
+import errno
+import functools
+import ipaddress
+import itertools
+import os
+import shlex
+import socket
+import statistics
+import time
+
+import fragmentos
+
+# Configuración
+CONEXIONES_SIMULTANEAS = int(os.environ.get("CONEXIONES_SIMULTANEAS", 512))
+CONEXIONES_POR_HOST = int(os.environ.get("CONEXIONES_POR_HOST", 64))
+HOSTS_SIMULTANEOS = int(os.environ.get("HOSTS_SIMULTANEOS", 64))
+INTERVALO_PROGRESO = float(os.environ.get("INTERVALO_PROGRESO", 1))
+
+# Timeout de conexión (segundos) y reintentos de cada plantilla -T de nmap
+PLANTILLAS_TIEMPO = {
+    0: (300.0, 10),
+    1: (15.0, 10),
+    2: (10.0, 10),
+    3: (1.0, 10),
+    4: (1.0, 6),
+    5: (0.3, 2),
+}
+
+# Como nmap: los estados que no sean open con más puertos se resumen
+MAX_PUERTOS_POR_ESTADO = 25
+
+# Opciones de nmap que el motor entiende (con valor) y que ignora
+OPCIONES_CON_VALOR = (
+    "-p",
+    "--max-retries",
+    "--host-timeout",
+    "--max-parallelism",
+    "--min-parallelism",
+    "--min-rate",
+    "--max-rate",
+    "--script",
+    "--script-args",
+)
+OPCIONES_IGNORADAS = ("-sT", "-n", "-v", "-vv", "--open", "--reason")
+
+ERRORES_INALCANZABLE = {
+    errno.EHOSTUNREACH: "host-unreach",
+    errno.ENETUNREACH: "net-unreach",
+}
+
+
+def _segundos(valor):
+    """Convierte un tiempo de nmap (500ms, 30s, 5m, 1h o segundos) a segundos"""
+    for sufijo, factor in (("ms", 0.001), ("s", 1), ("m", 60), ("h", 3600)):
+        if valor.endswith(sufijo):
+            return float(valor[: -len(sufijo)]) * factor
+    return float(valor)
+
+
+def interpretar_argumentos(argumentos):
+    """
+    Traduce los argumentos de nmap a la configuración del motor
+
+    Args:
+        argumentos (str): Argumentos de nmap de un escaneo -sT
+
+    Returns:
+        dict: puertos (str), timeout, reintentos, timeout_host (o None),
+              concurrencia, tasa_maxima (o None), sin_ping y scripts
+
+    Raises:
+        ValueError: Si hay opciones que solo nmap sabe hacer
+    """
+    config = {
+        "puertos": "1-1000",
+        "timeout": PLANTILLAS_TIEMPO[3][0],
+        "reintentos": PLANTILLAS_TIEMPO[3][1],
+        "timeout_host": None,
+        "concurrencia": CONEXIONES_SIMULTANEAS,
+        "tasa_maxima": None,
+        "sin_ping": False,
+        "scripts": None,
+    }
+    args = shlex.split(argumentos)
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        opcion, igual, valor = arg.partition("=")
+        if opcion in OPCIONES_CON_VALOR:
+            if not igual:
+                if i + 1 >= len(args):
+                    raise ValueError(f"Falta el valor de {opcion}")
+                valor = args[i + 1]
+                i += 1
+            if opcion == "-p":
+                config["puertos"] = valor
+            elif opcion == "--max-retries":
+                config["reintentos"] = int(valor)
+            elif opcion == "--host-timeout":
+                config["timeout_host"] = _segundos(valor) or None
+            elif opcion == "--max-parallelism":
+                config["concurrencia"] = max(int(valor), 1)
+            elif opcion == "--max-rate":
+                config["tasa_maxima"] = float(valor) or None
+            elif opcion == "--script":
+                config["scripts"] = valor
+        elif len(arg) == 3 and arg.startswith("-T") and arg[2].isdigit():
+            config["timeout"], config["reintentos"] = PLANTILLAS_TIEMPO[int(arg[2])]
+        elif arg == "-Pn":
+            config["sin_ping"] = True
+        elif arg not in OPCIONES_IGNORADAS:
+            raise ValueError(f"El motor asyncio no admite la opción {arg}")
+        i += 1
+
+    if fragmentos._rangos_puertos(config["puertos"]) is None:
+        raise ValueError(
+            f"El motor asyncio no admite la lista de puertos {config['puertos']}"
+        )
+    return config
+
+
+def _puertos(especificacion):
+    """Lista ordenada de los puertos de una especificación de nmap"""
+    return sorted(
+        {
+            numero
+            for inicio, fin in fragmentos._rangos_puertos(especificacion)
+            for numero in range(max(inicio, 1), fin + 1)
+        }
+    )
+
+
+async def _direcciones(objetivos):
+    """
+    Expande los objetivos de nmap en pares (dirección, nombre dado)
+
+    Admite direcciones, CIDR, rangos por octeto y nombres de host
+    """
+    loop = asyncio.get_running_loop()
+    vistas = set()
+    for objetivo in objetivos.split():
+        partes = objetivo.split(".")
+        if "/" in objetivo:
+            red = ipaddress.ip_network(objetivo, strict=False)
+            direcciones = red.hosts() if red.num_addresses > 2 else iter(red)
+            candidatos = ((str(ip), "") for ip in direcciones)
+        elif len(partes) == 4 and all(
+            parte and set(parte) <= set("0123456789-,*") for parte in partes
+        ):
+            octetos = [fragmentos._valores_octeto(parte) for parte in partes]
+            candidatos = (
+                (".".join(map(str, combinacion)), "")
+                for combinacion in itertools.product(*octetos)
+            )
+        else:
+            try:
+                candidatos = [(str(ipaddress.ip_address(objetivo)), "")]
+            except ValueError:
+                info = await loop.getaddrinfo(objetivo, None, type=socket.SOCK_STREAM)
+                candidatos = [(info[0][4][0], objetivo)] if info else []
+        for direccion, nombre in candidatos:
+            if direccion not in vistas:
+                vistas.add(direccion)
+                yield direccion, nombre
+
+
+@functools.lru_cache(maxsize=4096)
+def _servicio(puerto):
+    """Nombre del servicio de un puerto TCP según la tabla del sistema"""
+    try:
+        return socket.getservbyport(puerto, "tcp")
+    except OSError:
+        return "unknown"
+
+
+class _Limitador:
+    """Reparte el inicio de las conexiones para no superar una tasa máxima"""
+
+    def __init__(self, tasa):
+        self.cambiar(tasa)
+        self.siguiente = 0.0
+        self.lock = asyncio.Lock()
+
+    def cambiar(self, tasa):
+        self.intervalo = 1 / tasa if tasa else 0
+
+    async def esperar(self):
+        if not self.intervalo:
+            return
+        async with self.lock:
+            ahora = time.monotonic()
+            espera = self.siguiente - ahora
+            self.siguiente = max(ahora, self.siguiente) + self.intervalo
+        if espera > 0:
+            await asyncio.sleep(espera)
+
+
+class _Concurrencia:
+    """Semáforo cuyo número de conexiones simultáneas puede cambiar en marcha"""
+
+    def __init__(self, limite):
+        self.semaforo = asyncio.Semaphore(limite)
+        self.limite = limite
+        # Permisos que se retienen al liberarlos hasta bajar al nuevo límite
+        self.deuda = 0
+
+    def cambiar(self, limite):
+        diferencia = limite - self.limite
+        self.limite = limite
+        if diferencia < 0:
+            self.deuda -= diferencia
+            return
+        saldados = min(self.deuda, diferencia)
+        self.deuda -= saldados
+        for _ in range(diferencia - saldados):
+            self.semaforo.release()
+
+    async def __aenter__(self):
+        await self.semaforo.acquire()
+
+    async def __aexit__(self, *excepcion):
+        if self.deuda:
+            self.deuda -= 1
+        else:
+            self.semaforo.release()
+
+
+def _limites(config, cuota):
+    """Concurrencia y tasa efectivas: las del escaneo recortadas a la cuota"""
+    concurrencia = config["concurrencia"]
+    tasa = config["tasa_maxima"]
+    if cuota.get("sondas"):
+        concurrencia = min(concurrencia, cuota["sondas"])
+    if cuota.get("pps"):
+        tasa = min(tasa, cuota["pps"]) if tasa else cuota["pps"]
+    return concurrencia, tasa
+
+
+async def _sondear(direccion, puerto, config, global_, limitador):
+    """
+    Intenta conectar a un puerto, con reintentos si no hay respuesta
+
+    Returns:
+        tuple: (estado, razón, segundos hasta la respuesta o None)
+    """
+    async with global_:
+        for _ in range(config["reintentos"] + 1):
+            await limitador.esperar()
+            inicio = time.monotonic()
+            try:
+                _, escritor = await asyncio.wait_for(
+                    asyncio.open_connection(direccion, puerto), config["timeout"]
+                )
+            except asyncio.TimeoutError:
+                continue
+            except ConnectionRefusedError:
+                return "closed", "conn-refused", time.monotonic() - inicio
+            except OSError as e:
+                razon = ERRORES_INALCANZABLE.get(e.errno)
+                if razon:
+                    return "filtered", razon, None
+                continue
+            rtt = time.monotonic() - inicio
+            escritor.close()
+            try:
+                await escritor.wait_closed()
+            except OSError:
+                pass
+            return "open", "syn-ack", rtt
+    return "filtered", "no-response", None
+
+
+def _datos_host(direccion, nombre, estados, config, inicio, fin):
+    """Construye los datos de un host con el formato de python-nmap"""
+    por_estado = {}
+    for puerto, (estado, _, _) in estados.items():
+        por_estado.setdefault(estado, []).append(puerto)
+
+    tcp = {}
+    for puerto, (estado, razon, _) in sorted(estados.items()):
+        if estado != "open" and len(por_estado[estado]) > MAX_PUERTOS_POR_ESTADO:
+            continue
+        tcp[puerto] = {
+            "state": estado,
+            "reason": razon,
+            "name": _servicio(puerto),
+            "product": "",
+            "version": "",
+            "extrainfo": "",
+            "conf": "3",
+            "cpe": "",
+        }
+
+    rtts = [rtt * 1e6 for _, _, rtt in estados.values() if rtt is not None]
+    responde = bool(rtts)
+    datos = {
+        "hostnames": [{"name": nombre, "type": "user" if nombre else ""}],
+        "addresses": {
+            "ipv6" if ":" in direccion else "ipv4": direccion,
+        },
+        "vendor": {},
+        "status": {
+            "state": "up",
+            "reason": (
+                "user-set"
+                if config["sin_ping"] and not responde
+                else ("syn-ack" if por_estado.get("open") else "conn-refused")
+            ),
+        },
+        "medidas": {
+            "srtt": int(statistics.median(rtts)) if rtts else None,
+            "rttvar": int(statistics.pstdev(rtts)) if rtts else None,
+            "segundos": int(fin - inicio),
+            "puertos": len(estados),
+            "sin_respuesta": sum(
+                1 for _, razon, _ in estados.values() if razon == "no-response"
+            ),
+        },
+    }
+    if tcp:
+        datos["tcp"] = tcp
+    return datos
+
+
+async def _escanear(objetivos, config, al_evento, cancelacion, cuota=None):
+    """Escanea todos los objetivos y devuelve (hosts, direcciones, parcial)"""
+    puertos = _puertos(config["puertos"])
+    concurrencia, tasa = _limites(
+        config, await asyncio.to_thread(cuota) if cuota else {}
+    )
+    global_ = _Concurrencia(concurrencia)
+    limitador = _Limitador(tasa)
+    hosts = {}
+    totales = {"direcciones": 0, "sondas": 0, "hechas": 0}
+    cola = asyncio.Queue(maxsize=HOSTS_SIMULTANEOS)
+
+    async def escanear_host(direccion, nombre):
+        inicio = time.time()
+        estados = {}
+        pendientes = iter(puertos)
+
+        # Cada host tiene a lo sumo CONEXIONES_POR_HOST conexiones abiertas
+        async def sondear():
+            for puerto in pendientes:
+                estados[puerto] = await _sondear(
+                    direccion, puerto, config, global_, limitador
+                )
+                totales["hechas"] += 1
+
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(
+                    *(sondear() for _ in range(min(CONEXIONES_POR_HOST, len(puertos))))
+                ),
+                config["timeout_host"],
+            )
+        except asyncio.TimeoutError:
+            # Como nmap con --host-timeout: el host se descarta
+            return
+        # Un puerto cerrado también demuestra que el host está activo
+        responde = any(rtt is not None for _, _, rtt in estados.values())
+        if not responde and not config["sin_ping"]:
+            return
+        datos = _datos_host(direccion, nombre, estados, config, inicio, time.time())
+        hosts[direccion] = datos
+        al_evento(
+            "host",
+            {
+                "host": direccion,
+                "estado": "up",
+                "puertos": [
+                    {
+                        "puerto": puerto,
+                        "protocolo": "tcp",
+                        "estado": "open",
+                        "servicio": info["name"],
+                    }
+                    for puerto, info in datos.get("tcp", {}).items()
+                    if info["state"] == "open"
+                ],
+            },
+        )
+
+    async def trabajador():
+        while True:
+            elemento = await cola.get()
+            try:
+                if elemento is None:
+                    return
+                await escanear_host(*elemento)
+            finally:
+                cola.task_done()
+
+    async def alimentar():
+        async for direccion, nombre in _direcciones(objetivos):
+            totales["direcciones"] += 1
+            totales["sondas"] += len(puertos)
+            await cola.put((direccion, nombre))
+        for _ in range(HOSTS_SIMULTANEOS):
+            await cola.put(None)
+
+    async def informar():
+        inicio = time.monotonic()
+        while True:
+            await asyncio.sleep(INTERVALO_PROGRESO)
+            porcentaje = 100 * totales["hechas"] / max(totales["sondas"], 1)
+            transcurrido = time.monotonic() - inicio
+            restante = (
+                transcurrido * (100 - porcentaje) / porcentaje if porcentaje else 0
+            )
+            al_evento(
+                "progreso",
+                {
+                    "tarea": "Connect Scan",
+                    "porcentaje": round(porcentaje, 2),
+                    "restante": int(restante),
+                    "etc": int(time.time() + restante),
+                },
+            )
+
+    async def ajustar_cuota():
+        # La cuota cambia cuando otros escaneos empiezan o terminan
+        while True:
+            await asyncio.sleep(INTERVALO_PROGRESO)
+            try:
+                concurrencia, tasa = _limites(config, await asyncio.to_thread(cuota))
+            except Exception as e:
+                print(f"[!] Error al recalcular la cuota del escaneo: {e}")
+                continue
+            global_.cambiar(concurrencia)
+            limitador.cambiar(tasa)
+
+    async def vigilar_cancelacion():
+        while not cancelacion.is_set():
+            await asyncio.sleep(0.2)
+
+    trabajo = asyncio.gather(
+        alimentar(), *(trabajador() for _ in range(HOSTS_SIMULTANEOS))
+    )
+    vigilantes = [asyncio.ensure_future(informar())]
+    if cuota is not None:
+        vigilantes.append(asyncio.ensure_future(ajustar_cuota()))
+    esperados = [trabajo]
+    if cancelacion is not None:
+        vigilantes.append(asyncio.ensure_future(vigilar_cancelacion()))
+        esperados.append(vigilantes[-1])
+    try:
+        terminados, _ = await asyncio.wait(
+            esperados, return_when=asyncio.FIRST_COMPLETED
+        )
+        parcial = trabajo not in terminados
+        if parcial:
+            trabajo.cancel()
+            try:
+                await trabajo
+            except asyncio.CancelledError:
+                pass
+        else:
+            trabajo.result()
+    finally:
+        for vigilante in vigilantes:
+            vigilante.cancel()
+    return hosts, totales["direcciones"], parcial
+
+
+def ejecutar_escaneo_conexion(
+    objetivos, argumentos, al_evento=None, cancelacion=None, cuota=None
+):
+    """
+    Ejecuta un escaneo TCP connect y devuelve el resultado con el formato
+    de python-nmap (el mismo que motor_nmap.ejecutar_nmap)
+
+    Args:
+        objetivos (str): Especificación de objetivos de nmap
+        argumentos (str): Argumentos de nmap (ver interpretar_argumentos)
+        al_evento (callable): Llamada con (tipo, datos) para los eventos
+                              "progreso" y "host"
+        cancelacion (threading.Event): Si se activa, el escaneo se detiene y
+                                       el resultado queda como parcial
+        cuota (callable): Devuelve la parte del presupuesto de tráfico
+                          ({"pps", "sondas"}) que toca en cada momento; se
+                          consulta al empezar y cada INTERVALO_PROGRESO
+
+    Returns:
+        dict: Resultado {"nmap": {...}, "scan": {...}}
+    """
+    config = interpretar_argumentos(argumentos)
+    notificar = al_evento or (lambda tipo, datos: None)
+    inicio = time.time()
+    hosts, total, parcial = asyncio.run(
+        _escanear(objetivos, config, notificar, cancelacion, cuota)
+    )
+    fin = time.time()
+
+    info = {
+        "command_line": f"asyncio-connect {argumentos} {objetivos}",
+        "scaninfo": {"tcp": {"method": "connect", "services": config["puertos"]}},
+        "scanstats": {
+            "timestr": time.ctime(fin),
+            "elapsed": f"{fin - inicio:.2f}",
+            "uphosts": str(len(hosts)),
+            "downhosts": str(max(total - len(hosts), 0)),
+            "totalhosts": str(total),
+        },
+    }
+    if config["scripts"]:
+        info["scaninfo"]["warning"] = [
+            f"Los scripts NSE ({config['scripts']}) solo se ejecutan con nmap"
+            + os.linesep
+        ]
+    if parcial:
+        info["parcial"] = True
+    return {"nmap": info, "scan": hosts}
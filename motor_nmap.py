@@ -0,0 +1,433 @@
+"""
+Motor de ejecución de nmap
+Lanza nmap con salida XML por stdout y estadísticas periódicas, y va
+notificando el progreso y los hosts a medida que nmap los escribe
+"""
+
+import os
+import re
+import shlex
+import signal
+import subprocess
+import threading
+import time
+import xml.etree.ElementTree as ET
+
+import nmap
+
+# Configuración
+RUTA_NMAP = os.environ.get("RUTA_NMAP", "nmap")
+INTERVALO_ESTADISTICAS = os.environ.get("INTERVALO_ESTADISTICAS", "5s")
+TIEMPO_GRACIA_CANCELACION = float(os.environ.get("TIEMPO_GRACIA_CANCELACION", 5))
+
+REGEX_AVISO = re.compile(r"^Warning: .*", re.IGNORECASE)
+
+# PIDs de nmap detenidos con terminar_procesos: {pid: True}. nmap captura
+# SIGTERM y sale con 1, así que el código de salida no basta para saber que
+# su resultado es parcial. fragmentos lo cambia por un diccionario compartido
+# con los procesos de su pool
+detenidos = {}
+
+
+def evento_progreso(atributos):
+    """Convierte los atributos de <taskprogress> en un evento de progreso"""
+    return {
+        "tarea": atributos.get("task", ""),
+        "porcentaje": float(atributos.get("percent", 0) or 0),
+        "restante": int(atributos.get("remaining", 0) or 0),
+        "etc": int(atributos.get("etc", 0) or 0),
+    }
+
+
+def evento_host(elemento):
+    """Resume un elemento <host> o <hosthint> en un evento con sus puertos abiertos"""
+    direccion = ""
+    for address in elemento.findall("address"):
+        if address.get("addrtype") in ("ipv4", "ipv6") or not direccion:
+            direccion = address.get("addr", "")
+
+    status = elemento.find("status")
+    puertos = []
+    for port in elemento.findall("ports/port"):
+        state = port.find("state")
+        if state is None or state.get("state") != "open":
+            continue
+        service = port.find("service")
+        puertos.append(
+            {
+                "puerto": int(port.get("portid")),
+                "protocolo": port.get("protocol"),
+                "estado": state.get("state"),
+                "servicio": service.get("name", "") if service is not None else "",
+            }
+        )
+
+    return {
+        "host": direccion,
+        "estado": status.get("state") if status is not None else "",
+        "puertos": puertos,
+    }
+
+
+def terminar_procesos(pids, gracia=None):
+    """
+    Detiene los grupos de procesos de nmap indicados: primero con SIGTERM
+    y, si siguen vivos pasado el tiempo de gracia, con SIGKILL
+    """
+    gracia = TIEMPO_GRACIA_CANCELACION if gracia is None else gracia
+    pids = list(pids)
+
+    for pid in pids:
+        detenidos[pid] = True
+        try:
+            os.killpg(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+
+    def rematar():
+        time.sleep(gracia)
+        for pid in pids:
+            try:
+                os.killpg(pid, signal.SIGKILL)
+                print(f"[!] nmap (pid {pid}) no terminó a tiempo, forzado con SIGKILL")
+            except ProcessLookupError:
+                pass
+
+    hilo = threading.Thread(target=rematar)
+    hilo.daemon = True
+    hilo.start()
+
+
+def convertir_host(elemento):
+    """
+    Convierte un elemento <host> al formato de python-nmap
+
+    Returns:
+        tuple: (direccion, datos) con las mismas claves que
+               PortScanner()[direccion], más "medidas" (tiempos de respuesta
+               y sondas sin respuesta, para los perfiles de red)
+    """
+    direccion = None
+    direcciones = {}
+    fabricantes = {}
+    for address in elemento.findall("address"):
+        tipo = address.get("addrtype")
+        direcciones[tipo] = address.get("addr")
+        if tipo == "ipv4":
+            direccion = direcciones[tipo]
+        elif tipo == "mac" and address.get("vendor") is not None:
+            fabricantes[direcciones[tipo]] = address.get("vendor")
+    if direccion is None:
+        direccion = elemento.find("address").get("addr")
+
+    nombres = [
+        {"name": hostname.get("name"), "type": hostname.get("type")}
+        for hostname in elemento.findall("hostnames/hostname")
+    ] or [{"name": "", "type": ""}]
+
+    datos = {"hostnames": nombres, "addresses": direcciones, "vendor": fabricantes}
+
+    for status in elemento.findall("status"):
+        datos["status"] = {
+            "state": status.get("state"),
+            "reason": status.get("reason"),
+        }
+    for uptime in elemento.findall("uptime"):
+        datos["uptime"] = {
+            "seconds": uptime.get("seconds"),
+            "lastboot": uptime.get("lastboot"),
+        }
+
+    for port in elemento.findall("ports/port"):
+        state = port.find("state")
+        info = {
+            "state": state.get("state"),
+            "reason": state.get("reason"),
+            "name": "",
+            "product": "",
+            "version": "",
+            "extrainfo": "",
+            "conf": "",
+            "cpe": "",
+        }
+        for service in port.findall("service"):
+            info["name"] = service.get("name")
+            for campo in ("product", "version", "extrainfo", "conf"):
+                if service.get(campo):
+                    info[campo] = service.get(campo)
+            for cpe in service.findall("cpe"):
+                info["cpe"] = cpe.text
+        for script in port.findall("script"):
+            info.setdefault("script", {})[script.get("id")] = script.get("output")
+        datos.setdefault(port.get("protocol"), {})[int(port.get("portid"))] = info
+
+    for script in elemento.findall("hostscript/script"):
+        datos.setdefault("hostscript", []).append(
+            {"id": script.get("id"), "output": script.get("output")}
+        )
+
+    for os_nmap in elemento.findall("os"):
+        datos["portused"] = [
+            {
+                "state": usado.get("state"),
+                "proto": usado.get("proto"),
+                "portid": usado.get("portid"),
+            }
+            for usado in os_nmap.findall("portused")
+        ]
+        coincidencias = []
+        for osmatch in os_nmap.findall("osmatch"):
+            clases = [
+                {
+                    "type": osclass.get("type"),
+                    "vendor": osclass.get("vendor"),
+                    "osfamily": osclass.get("osfamily"),
+                    "osgen": osclass.get("osgen"),
+                    "accuracy": osclass.get("accuracy"),
+                    "cpe": [cpe.text for cpe in osclass.findall("cpe")],
+                }
+                for osclass in osmatch.findall("osclass")
+            ]
+            # Igual que python-nmap: la precisión es la de la última osclass
+            coincidencias.append(
+                {
+                    "name": osmatch.get("name"),
+                    "accuracy": (
+                        clases[-1]["accuracy"] if clases else osmatch.get("accuracy")
+                    ),
+                    "line": osmatch.get("line"),
+                    "osclass": clases,
+                }
+            )
+        datos["osmatch"] = coincidencias
+
+    for huella in elemento.findall("osfingerprint"):
+        datos["fingerprint"] = huella.get("fingerprint")
+
+    datos["medidas"] = medidas_host(elemento)
+    return direccion, datos
+
+
+def medidas_host(elemento):
+    """
+    Medidas de red de un elemento <host> que python-nmap no conserva
+
+    Returns:
+        dict: srtt y rttvar (microsegundos, o None), segundos que tardó el
+              host, puertos sondeados y cuántos no respondieron
+    """
+    tiempos = elemento.find("times")
+    puertos = 0
+    sin_respuesta = 0
+    for port in elemento.findall("ports/port"):
+        puertos += 1
+        state = port.find("state")
+        if state is not None and state.get("reason") == "no-response":
+            sin_respuesta += 1
+    # Los puertos agrupados (<extraports>) también cuentan
+    for extra in elemento.findall("ports/extraports"):
+        puertos += int(extra.get("count") or 0)
+        for razon in extra.findall("extrareasons"):
+            if razon.get("reason") == "no-response":
+                sin_respuesta += int(razon.get("count") or 0)
+
+    inicio = elemento.get("starttime")
+    fin = elemento.get("endtime")
+    return {
+        "srtt": int(tiempos.get("srtt")) if tiempos is not None else None,
+        "rttvar": int(tiempos.get("rttvar")) if tiempos is not None else None,
+        "segundos": (
+            int(fin) - int(inicio)
+            if inicio and fin and inicio.isdigit() and fin.isdigit()
+            else None
+        ),
+        "puertos": puertos,
+        "sin_respuesta": sin_respuesta,
+    }
+
+
+def analizar_xml_incremental(lineas):
+    """
+    Analiza la salida XML de nmap a medida que llega
+
+    Cada elemento de primer nivel se convierte y se descarta en cuanto se
+    cierra, así que la memoria usada no crece con el número de hosts. Si la
+    salida se corta (nmap interrumpido), simplemente deja de producir
+    elementos sin lanzar error
+
+    Args:
+        lineas (iterable): Trozos de texto de la salida -oX de nmap
+
+    Yields:
+        tuple: (tipo, datos) con tipo "inicio" (atributos de <nmaprun>),
+               "scaninfo", "progreso", "host_descubierto", "host"
+               (elemento <host> aún sin descartar) o "estadisticas"
+    """
+    analizador = ET.XMLPullParser(events=("start", "end"))
+    raiz = None
+    profundidad = 0
+
+    for linea in lineas:
+        analizador.feed(linea)
+        for evento, elemento in analizador.read_events():
+            if evento == "start":
+                profundidad += 1
+                if raiz is None:
+                    raiz = elemento
+                    yield "inicio", dict(elemento.attrib)
+                continue
+
+            profundidad -= 1
+            # Solo interesan los hijos directos de <nmaprun>, ya completos
+            if profundidad != 1:
+                continue
+
+            etiqueta = elemento.tag
+            if etiqueta == "host":
+                yield "host", elemento
+            elif etiqueta == "hosthint":
+                yield "host_descubierto", evento_host(elemento)
+            elif etiqueta == "taskprogress":
+                yield "progreso", evento_progreso(elemento.attrib)
+            elif etiqueta == "scaninfo":
+                yield "scaninfo", dict(elemento.attrib)
+            elif etiqueta == "runstats":
+                finished = elemento.find("finished")
+                hosts = elemento.find("hosts")
+                yield "estadisticas", {
+                    "timestr": finished.get("timestr"),
+                    "elapsed": finished.get("elapsed"),
+                    "uphosts": hosts.get("up"),
+                    "downhosts": hosts.get("down"),
+                    "totalhosts": hosts.get("total"),
+                }
+
+            # Descartar el elemento ya procesado
+            raiz.remove(elemento)
+
+
+def _estadisticas_parciales(hosts_activos):
+    """Estadísticas para un escaneo que nmap no llegó a cerrar"""
+    ahora = int(time.time())
+    return {
+        "timestr": time.ctime(ahora),
+        "elapsed": "0",
+        "uphosts": str(hosts_activos),
+        "downhosts": "0",
+        "totalhosts": str(hosts_activos),
+    }
+
+
+def construir_comando(objetivos, argumentos):
+    """Construye la línea de comandos de nmap con salida XML por stdout"""
+    args = shlex.split(argumentos)
+    comando = [RUTA_NMAP, "-oX", "-"]
+    if "--stats-every" not in args:
+        comando.extend(["--stats-every", INTERVALO_ESTADISTICAS])
+    return comando + args + shlex.split(objetivos)
+
+
+def ejecutar_nmap(objetivos, argumentos, al_evento=None, al_host=None):
+    """
+    Ejecuta nmap y devuelve el resultado con el formato de python-nmap
+
+    Args:
+        objetivos (str): Especificación de objetivos de nmap
+        argumentos (str): Argumentos de nmap
+        al_evento (callable): Llamada con (tipo, datos) para cada evento:
+                              "progreso", "host_descubierto", "host", y
+                              "proceso"/"fin_proceso" con el pid de nmap
+        al_host (callable): Si se indica, recibe (direccion, datos) de cada
+                            host en cuanto se convierte y el resultado no los
+                            guarda: la memoria no crece con el escaneo
+
+    Returns:
+        dict: Resultado {"nmap": {...}, "scan": {...}} como PortScanner.scan()
+              ("scan" vacío con al_host); si nmap fue interrumpido por una
+              señal o con terminar_procesos, recoge los hosts completos
+              hasta ese momento y "nmap"["parcial"] = True
+    """
+    notificar = al_evento or (lambda tipo, datos: None)
+
+    proceso = subprocess.Popen(
+        construir_comando(objetivos, argumentos),
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+        errors="replace",
+        # Grupo de procesos propio para poder detener nmap y sus hijos
+        start_new_session=True,
+    )
+    # Una marca que quedara de otro nmap con el mismo PID no es de este
+    detenidos.pop(proceso.pid, None)
+    notificar("proceso", {"pid": proceso.pid})
+
+    # stderr se lee aparte para que nmap no se bloquee si lo llena
+    errores = []
+    hilo_errores = threading.Thread(
+        target=lambda: errores.append(proceso.stderr.read())
+    )
+    hilo_errores.daemon = True
+    hilo_errores.start()
+
+    info = {"command_line": None, "scaninfo": {}, "scanstats": None}
+    hosts = {}
+    recibidos = 0
+    try:
+        for tipo, datos in analizar_xml_incremental(proceso.stdout):
+            if tipo == "inicio":
+                info["command_line"] = datos.get("args")
+            elif tipo == "scaninfo":
+                info["scaninfo"][datos.get("protocol")] = {
+                    "method": datos.get("type"),
+                    "services": datos.get("services"),
+                }
+            elif tipo == "estadisticas":
+                info["scanstats"] = datos
+            elif tipo == "host":
+                notificar("host", evento_host(datos))
+                direccion, datos_host = convertir_host(datos)
+                recibidos += 1
+                if al_host is not None:
+                    al_host(direccion, datos_host)
+                else:
+                    hosts[direccion] = datos_host
+            else:
+                notificar(tipo, datos)
+    except ET.ParseError:
+        # Salida que no es XML (p. ej. error de argumentos): se informa abajo
+        # con el stderr de nmap; se vacía stdout para que nmap pueda salir
+        proceso.stdout.read()
+
+    proceso.wait()
+    hilo_errores.join()
+    notificar("fin_proceso", {"pid": proceso.pid})
+    salida_errores = "".join(errores)
+    detenido = detenidos.pop(proceso.pid, None) is not None
+
+    if info["scanstats"] is None:
+        # nmap detenido (muerto por la señal o tras capturar SIGTERM):
+        # conservar los hosts que llegó a completar
+        if proceso.returncode < 0 or detenido:
+            info["scanstats"] = _estadisticas_parciales(recibidos)
+            info["parcial"] = True
+            return {"nmap": info, "scan": hosts}
+        # Mismo error que PortScanner.scan() cuando nmap no produce un XML válido
+        raise nmap.PortScannerError(salida_errores or "nmap no produjo salida XML")
+
+    avisos = []
+    trazas_error = []
+    for linea in salida_errores.splitlines():
+        if not linea:
+            continue
+        if REGEX_AVISO.search(linea):
+            avisos.append(linea + os.linesep)
+        else:
+            trazas_error.append(linea + os.linesep)
+    if trazas_error:
+        info["scaninfo"]["error"] = trazas_error
+    if avisos:
+        info["scaninfo"]["warning"] = avisos
+
+    return {"nmap": info, "scan": hosts}
@@ -0,0 +1,307 @@
+"""
+Avisos de fin de escaneo (webhooks)
+Cuando un trabajo termina (completado, con error o cancelado) se envía un
+POST JSON con su estado, el ID del reporte y un resumen a la URL indicada
+en el escaneo ("webhook"), a las que se sumen después quienes se unan al
+mismo trabajo y a las globales de WEBHOOKS_ESCANEOS. El envío lo hacen
+unos hilos propios desde un buzón acotado, con reintentos y espera
+exponencial, para que un receptor lento nunca frene a los trabajadores
+"""
+
+import hashlib
+import heapq
+import hmac
+import itertools
+import json
+import os
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import OrderedDict
+from datetime import datetime
+from urllib.parse import urlsplit
+
+import almacen
+import metricas
+
+# Configuración
+WEBHOOKS_ESCANEOS = [
+    url.strip()
+    for url in os.environ.get("WEBHOOKS_ESCANEOS", "").split(",")
+    if url.strip()
+]
+# Si se define, cada aviso lleva su firma HMAC-SHA256 en FIRMA_WEBHOOK
+SECRETO_WEBHOOKS = os.environ.get("SECRETO_WEBHOOKS", "")
+TAMANO_BUZON_WEBHOOKS = int(os.environ.get("TAMANO_BUZON_WEBHOOKS", 1000))
+HILOS_WEBHOOKS = int(os.environ.get("HILOS_WEBHOOKS", 2))
+INTENTOS_WEBHOOK = int(os.environ.get("INTENTOS_WEBHOOK", 6))
+ESPERA_INICIAL_WEBHOOK = float(os.environ.get("ESPERA_INICIAL_WEBHOOK", 2))
+ESPERA_MAXIMA_WEBHOOK = float(os.environ.get("ESPERA_MAXIMA_WEBHOOK", 300))
+TIMEOUT_WEBHOOK = float(os.environ.get("TIMEOUT_WEBHOOK", 10))
+# Trabajos terminados que se recuerdan para avisar a quien se suscriba tarde
+MAX_TRABAJOS_AVISADOS = int(os.environ.get("MAX_TRABAJOS_AVISADOS", 1000))
+
+FIRMA_WEBHOOK = "X-Firma-Webhook"
+# Respuestas 4xx que sí merecen reintento
+CODIGOS_REINTENTABLES = (408, 425, 429)
+
+# Buzón de entregas: montículo de (momento del próximo intento, secuencia, entrega)
+buzon = []
+secuencia = itertools.count()
+condicion_buzon = threading.Condition()
+hilos_envio = []
+
+# Último aviso de cada trabajo: {trabajo_id: vista} y URLs de quienes se
+# unieron a un trabajo ya en marcha: {trabajo_id: [url]}
+avisados = OrderedDict()
+suscripciones = {}
+lock_avisos = threading.Lock()
+
+contadores = {"entregados": 0, "fallidos": 0, "descartados": 0, "reintentos": 0}
+
+
+def validar_url(url):
+    """
+    Comprueba una URL de aviso
+
+    Returns:
+        str: La URL sin espacios alrededor
+
+    Raises:
+        ValueError: Con el mensaje para el cliente si no es http(s)
+    """
+    if not isinstance(url, str):
+        raise ValueError("webhook debe ser una URL http o https")
+    url = url.strip()
+    partes = urlsplit(url)
+    if partes.scheme not in ("http", "https") or not partes.hostname:
+        raise ValueError("webhook debe ser una URL http o https")
+    return url
+
+
+def _urls_trabajo(vista):
+    """URLs a las que se avisa del fin de un trabajo (con el lock tomado)"""
+    urls = list(WEBHOOKS_ESCANEOS)
+    for url in [vista.get("webhook")] + suscripciones.get(vista["id"], []):
+        if url and url not in urls:
+            urls.append(url)
+    return urls
+
+
+def _carga(vista):
+    """Aviso de un trabajo terminado; el resumen del reporte se añade al enviarlo"""
+    return {
+        "evento": f"escaneo.{vista['estado']}",
+        "trabajo_id": vista["id"],
+        "estado": vista["estado"],
+        "mensaje": vista["mensaje"],
+        "reporte_id": vista["reporte_id"],
+        "host": vista.get("host"),
+        "puerto": vista.get("puerto"),
+        "tipo": vista.get("tipo"),
+        "creado": vista["creado"],
+        "iniciado": vista["iniciado"],
+        "finalizado": vista["finalizado"],
+        "resumen": None,
+    }
+
+
+def avisar_fin(vista):
+    """
+    Encola el aviso del fin de un trabajo para todas sus URLs
+
+    Un trabajo cancelado en progreso avisa dos veces: al cancelarlo y, si
+    llega a guardar un reporte parcial, otra vez con su ID. Los avisos
+    repetidos con el mismo estado y reporte se ignoran
+    """
+    with lock_avisos:
+        anterior = avisados.get(vista["id"])
+        if anterior is not None and (anterior["estado"], anterior["reporte_id"]) == (
+            vista["estado"],
+            vista["reporte_id"],
+        ):
+            return
+        avisados[vista["id"]] = vista
+        avisados.move_to_end(vista["id"])
+        while len(avisados) > MAX_TRABAJOS_AVISADOS:
+            trabajo_id, _ = avisados.popitem(last=False)
+            suscripciones.pop(trabajo_id, None)
+        urls = _urls_trabajo(vista)
+    carga = _carga(vista)
+    for url in urls:
+        _encolar(url, carga)
+
+
+def suscribir(trabajo_id, url):
+    """
+    Añade una URL de aviso a un trabajo existente (al unirse a uno idéntico
+    en curso); si ya terminó, se le avisa en el momento
+    """
+    with lock_avisos:
+        vista = avisados.get(trabajo_id)
+        if vista is not None and url in _urls_trabajo(vista):
+            return
+        suscripciones.setdefault(trabajo_id, [])
+        if url in suscripciones[trabajo_id]:
+            return
+        suscripciones[trabajo_id].append(url)
+    if vista is not None:
+        _encolar(url, _carga(vista))
+
+
+def _encolar(url, carga):
+    """Coloca una entrega en el buzón, descartando la más reintentada si está lleno"""
+    iniciar_envios()
+    entrega = {"url": url, "carga": carga, "intentos": 0, "ultimo_error": None}
+    with condicion_buzon:
+        if len(buzon) >= TAMANO_BUZON_WEBHOOKS:
+            indice = max(range(len(buzon)), key=lambda i: buzon[i][2]["intentos"])
+            descartada = buzon[indice][2]
+            buzon[indice] = buzon[-1]
+            buzon.pop()
+            heapq.heapify(buzon)
+            contadores["descartados"] += 1
+            print(
+                f"[!] Buzón de webhooks lleno: se descarta el aviso del trabajo "
+                f"{descartada['carga']['trabajo_id']} a {descartada['url']}"
+            )
+        heapq.heappush(buzon, (time.monotonic(), next(secuencia), entrega))
+        condicion_buzon.notify()
+
+
+def _resumen(reporte_id):
+    """Resumen de un reporte para el aviso, o None si no existe"""
+    reporte = almacen.obtener_reporte(reporte_id)
+    if reporte is None:
+        return None
+    escaneo = reporte["escaneo"]
+    return {
+        "nombre": reporte["nombre"],
+        "fecha": reporte["fecha"],
+        "parcial": bool(reporte["parcial"]),
+        "duracion": escaneo.duracion,
+        "total_hosts": escaneo.total_hosts,
+        "hosts_activos": escaneo.hosts_activos,
+        "hosts_inactivos": escaneo.hosts_inactivos,
+        "puertos_abiertos": sum(
+            1
+            for host in escaneo.hosts
+            for puerto in host.puertos
+            if puerto.estado == "open"
+        ),
+    }
+
+
+def enviar(url, carga):
+    """
+    Hace el POST de un aviso
+
+    Raises:
+        urllib.error.HTTPError: Si el receptor respondió con un error
+        OSError: Si no se pudo conectar o no respondió a tiempo
+    """
+    cuerpo = json.dumps(carga, ensure_ascii=False).encode("utf-8")
+    cabeceras = {
+        "Content-Type": "application/json",
+        "User-Agent": "escaner-webhooks",
+    }
+    if SECRETO_WEBHOOKS:
+        firma = hmac.new(SECRETO_WEBHOOKS.encode(), cuerpo, hashlib.sha256)
+        cabeceras[FIRMA_WEBHOOK] = f"sha256={firma.hexdigest()}"
+    peticion = urllib.request.Request(url, data=cuerpo, headers=cabeceras)
+    with urllib.request.urlopen(peticion, timeout=TIMEOUT_WEBHOOK) as respuesta:
+        respuesta.read()
+
+
+def _espera(intentos):
+    """Segundos hasta el siguiente intento (exponencial, con variación)"""
+    espera = min(ESPERA_INICIAL_WEBHOOK * 2 ** (intentos - 1), ESPERA_MAXIMA_WEBHOOK)
+    return espera * random.uniform(0.5, 1)
+
+
+def _entregar(entrega):
+    """Intenta una entrega y la reprograma si falla y quedan intentos"""
+    carga = entrega["carga"]
+    if carga["reporte_id"] and carga["resumen"] is None:
+        try:
+            carga["resumen"] = _resumen(carga["reporte_id"])
+        except Exception as e:
+            print(f"[!] No se pudo resumir el reporte {carga['reporte_id']}: {e}")
+    carga = dict(carga, enviado=datetime.now().isoformat())
+
+    entrega["intentos"] += 1
+    try:
+        enviar(entrega["url"], carga)
+    except urllib.error.HTTPError as e:
+        reintentable = e.code >= 500 or e.code in CODIGOS_REINTENTABLES
+        entrega["ultimo_error"] = f"HTTP {e.code}"
+    except Exception as e:
+        reintentable = True
+        entrega["ultimo_error"] = str(e)
+    else:
+        with condicion_buzon:
+            contadores["entregados"] += 1
+        metricas.incrementar("webhooks_total", resultado="entregado")
+        return
+
+    if reintentable and entrega["intentos"] < INTENTOS_WEBHOOK:
+        with condicion_buzon:
+            contadores["reintentos"] += 1
+            heapq.heappush(
+                buzon,
+                (
+                    time.monotonic() + _espera(entrega["intentos"]),
+                    next(secuencia),
+                    entrega,
+                ),
+            )
+            condicion_buzon.notify()
+        metricas.incrementar("webhooks_total", resultado="reintento")
+        return
+
+    with condicion_buzon:
+        contadores["fallidos"] += 1
+    metricas.incrementar("webhooks_total", resultado="fallido")
+    print(
+        f"[!] Webhook {entrega['url']} abandonado tras {entrega['intentos']} "
+        f"intentos ({entrega['ultimo_error']}): trabajo {carga['trabajo_id']}"
+    )
+
+
+def bucle_envio():
+    """Saca del buzón las entregas que ya toca intentar"""
+    while True:
+        with condicion_buzon:
+            while not buzon or buzon[0][0] > time.monotonic():
+                condicion_buzon.wait(buzon[0][0] - time.monotonic() if buzon else None)
+            _, _, entrega = heapq.heappop(buzon)
+        try:
+            _entregar(entrega)
+        except Exception as e:
+            print(f"[!] Error al enviar el webhook a {entrega['url']}: {e}")
+
+
+def iniciar_envios():
+    """Arranca los hilos de envío de webhooks si aún no están en marcha"""
+    with condicion_buzon:
+        if hilos_envio:
+            return
+        for numero in range(max(HILOS_WEBHOOKS, 1)):
+            hilo = threading.Thread(target=bucle_envio, name=f"webhooks-{numero + 1}")
+            hilo.daemon = True
+            hilo.start()
+            hilos_envio.append(hilo)
+
+
+def estado():
+    """Configuración y contadores de los avisos de este worker"""
+    with condicion_buzon:
+        return {
+            "globales": WEBHOOKS_ESCANEOS,
+            "firmados": bool(SECRETO_WEBHOOKS),
+            "pendientes": len(buzon),
+            "capacidad": TAMANO_BUZON_WEBHOOKS,
+            **contadores,
+        }
@@ -0,0 +1,343 @@
+"""
+Perfiles de tiempo aprendidos por red
+Tras cada escaneo completo se guardan, por cada red /24 (/64 en IPv6), el
+RTT medido por nmap, la proporción de sondas sin respuesta, los hosts por
+segundo y lo que tardó cada host; los escaneos siguientes de esas redes
+eligen con ellos --min-rate, --max-retries, --host-timeout y el paralelismo
+"""
+
+import ipaddress
+import os
+
+import almacen
+import fragmentos
+
+# Configuración
+PREFIJO_PERFIL_IPV4 = int(os.environ.get("PREFIJO_PERFIL_IPV4", 24))
+PREFIJO_PERFIL_IPV6 = int(os.environ.get("PREFIJO_PERFIL_IPV6", 64))
+# Peso (en %) de cada escaneo nuevo frente a lo ya aprendido
+PESO_MEDIDA_NUEVA = int(os.environ.get("PESO_MEDIDA_NUEVA", 30))
+PERFILES_AUTOMATICOS = os.environ.get("PERFILES_AUTOMATICOS", "1") != "0"
+
+# Ajustes de un perfil y la opción de nmap que fija cada uno
+OPCIONES_TIEMPO = {
+    "min_rate": "--min-rate",
+    "max_retries": "--max-retries",
+    "host_timeout": "--host-timeout",
+    "min_parallelism": "--min-parallelism",
+    "max_parallelism": "--max-parallelism",
+}
+
+# Pares (mínimo, máximo) de OPCIONES_TIEMPO: nmap se niega a arrancar si el
+# mínimo supera al máximo
+PARES_TIEMPO = (("min_parallelism", "max_parallelism"),)
+# Opciones que no admiten 0
+OPCIONES_POSITIVAS = ("min_rate", "min_parallelism", "max_parallelism")
+
+# Medidas que se promedian; en una unión de redes manda la más desfavorable
+MEDIDAS_PEOR_MAYOR = ("srtt_ms", "rttvar_ms", "sin_respuesta")
+MEDIDAS_PEOR_MENOR = ("hosts_por_segundo",)
+
+
+def red_de(direccion):
+    """Red del perfil al que pertenece una dirección, o None si no es una IP"""
+    try:
+        ip = ipaddress.ip_address(direccion)
+    except ValueError:
+        return None
+    prefijo = PREFIJO_PERFIL_IPV4 if ip.version == 4 else PREFIJO_PERFIL_IPV6
+    return ipaddress.ip_network(f"{ip}/{prefijo}", strict=False)
+
+
+def _hex(ip):
+    """Dirección como texto de ancho fijo que se ordena igual que la dirección"""
+    return f"{ip.version}:{int(ip):032x}"
+
+
+def acumular_medidas(por_red, direccion, datos):
+    """Suma a por_red ({red: acumulado}) las medidas de un host de python-nmap"""
+    red = red_de(direccion)
+    medidas = datos.get("medidas")
+    if red is None or not medidas:
+        return
+    acumulado = por_red.setdefault(
+        red, {"rtt": [], "var": [], "puertos": 0, "sin": 0, "segundos": []}
+    )
+    if medidas["srtt"] is not None and medidas["srtt"] >= 0:
+        acumulado["rtt"].append(medidas["srtt"])
+        acumulado["var"].append(max(medidas["rttvar"] or 0, 0))
+    if medidas["segundos"] is not None:
+        acumulado["segundos"].append(medidas["segundos"])
+    acumulado["puertos"] += medidas["puertos"]
+    acumulado["sin"] += medidas["sin_respuesta"]
+
+
+def medir(resultado, tipo, por_red=None):
+    """
+    Medidas de cada red a partir de un resultado de python-nmap
+
+    Args:
+        resultado (dict): Resultado de python-nmap
+        tipo (str): Tipo de escaneo
+        por_red (dict): Medidas ya acumuladas con acumular_medidas a medida
+                        que llegaban los hosts; si no, se toman de
+                        resultado["scan"]
+
+    Returns:
+        dict: {red: medidas} con srtt_ms, rttvar_ms, sin_respuesta (0-1),
+              hosts_por_segundo y segundos_por_host {tipo: segundos}
+    """
+    estadisticas = resultado["nmap"].get("scanstats", {})
+    total = int(estadisticas.get("totalhosts") or 0)
+    duracion = float(estadisticas.get("elapsed") or 0)
+    hosts_por_segundo = round(total / duracion, 2) if total and duracion else None
+
+    if por_red is None:
+        por_red = {}
+        for direccion, datos in resultado.get("scan", {}).items():
+            acumular_medidas(por_red, direccion, datos)
+
+    resultado_medidas = {}
+    for red, acumulado in por_red.items():
+        medidas = {"hosts_por_segundo": hosts_por_segundo, "segundos_por_host": {}}
+        if acumulado["rtt"]:
+            # La mediana evita que un host lento marque a toda la red
+            rtts = sorted(acumulado["rtt"])
+            variaciones = sorted(acumulado["var"])
+            medidas["srtt_ms"] = round(rtts[len(rtts) // 2] / 1000, 2)
+            medidas["rttvar_ms"] = round(variaciones[len(variaciones) // 2] / 1000, 2)
+        if acumulado["puertos"]:
+            medidas["sin_respuesta"] = round(acumulado["sin"] / acumulado["puertos"], 3)
+        if acumulado["segundos"]:
+            medidas["segundos_por_host"][tipo] = max(acumulado["segundos"])
+        resultado_medidas[str(red)] = medidas
+    return resultado_medidas
+
+
+def _promediar(anterior, nuevo):
+    """Media móvil exponencial de una medida"""
+    if anterior is None:
+        return nuevo
+    if nuevo is None:
+        return anterior
+    return round(anterior + (nuevo - anterior) * PESO_MEDIDA_NUEVA / 100, 3)
+
+
+def _combinar_medidas(anteriores, nuevas):
+    """Incorpora las medidas de un escaneo a las ya aprendidas de una red"""
+    anteriores = anteriores or {}
+    combinadas = {
+        clave: _promediar(anteriores.get(clave), nuevas.get(clave))
+        for clave in MEDIDAS_PEOR_MAYOR + MEDIDAS_PEOR_MENOR
+    }
+    segundos = dict(anteriores.get("segundos_por_host", {}))
+    for tipo, valor in nuevas.get("segundos_por_host", {}).items():
+        segundos[tipo] = _promediar(segundos.get(tipo), valor)
+    combinadas["segundos_por_host"] = segundos
+    return combinadas
+
+
+def registrar(resultado, tipo, por_red=None):
+    """Aprende de un escaneo completo las medidas de cada red escaneada"""
+    for red, medidas in medir(resultado, tipo, por_red).items():
+        red_ip = ipaddress.ip_network(red)
+        almacen.actualizar_perfil_red(
+            red,
+            _hex(red_ip[0]),
+            _hex(red_ip[-1]),
+            lambda anteriores, medidas=medidas: _combinar_medidas(anteriores, medidas),
+        )
+
+
+def ajustar_red(red, ajuste):
+    """Impone a mano opciones de tiempo a una red (ipaddress.ip_network)"""
+    almacen.ajustar_perfil_red(str(red), _hex(red[0]), _hex(red[-1]), ajuste)
+
+
+def ajustes(medidas, tipo):
+    """
+    Elige las opciones de tiempo de nmap a partir de las medidas de una red
+
+    Returns:
+        dict: Valores para las claves de OPCIONES_TIEMPO que se pueden deducir
+    """
+    resultado = {}
+    srtt = medidas.get("srtt_ms")
+    perdida = medidas.get("sin_respuesta")
+    if srtt is not None:
+        # Como el timeout de sonda de nmap: RTT más cuatro veces su variación
+        rtt = srtt + 4 * (medidas.get("rttvar_ms") or 0)
+        resultado["min_rate"] = max(50, min(5000, int(50000 / max(rtt, 1))))
+        rapida = rtt < 10
+    else:
+        rapida = False
+
+    if perdida is not None or srtt is not None:
+        perdida = perdida or 0
+        # En enlaces con pérdidas los reintentos casi nunca obtienen respuesta
+        if perdida >= 0.5:
+            resultado["max_retries"] = 1
+            resultado["max_parallelism"] = 32
+        elif perdida >= 0.2 or rapida:
+            resultado["max_retries"] = 2
+        else:
+            resultado["max_retries"] = 3
+        if rapida and perdida < 0.2:
+            resultado["min_parallelism"] = 64
+
+    segundos = medidas.get("segundos_por_host", {}).get(tipo)
+    if segundos:
+        resultado["host_timeout"] = max(60, int(segundos * 3))
+    return resultado
+
+
+def _unir_medidas(lista):
+    """Une las medidas de varias redes quedándose con las más desfavorables"""
+    unidas = {"segundos_por_host": {}}
+    for medidas in lista:
+        for clave in MEDIDAS_PEOR_MAYOR + MEDIDAS_PEOR_MENOR:
+            valor = medidas.get(clave)
+            if valor is None:
+                continue
+            actual = unidas.get(clave)
+            if actual is None:
+                unidas[clave] = valor
+            elif clave in MEDIDAS_PEOR_MAYOR:
+                unidas[clave] = max(actual, valor)
+            else:
+                unidas[clave] = min(actual, valor)
+        for tipo, valor in medidas.get("segundos_por_host", {}).items():
+            unidas["segundos_por_host"][tipo] = max(
+                unidas["segundos_por_host"].get(tipo, 0), valor
+            )
+    return unidas
+
+
+def validar_ajuste(datos):
+    """
+    Comprueba unos ajustes impuestos a mano ({opción: entero positivo})
+
+    Returns:
+        dict: Ajustes validados (sin las claves a None)
+
+    Raises:
+        ValueError: Si hay claves desconocidas o valores no válidos
+    """
+    if not isinstance(datos, dict):
+        raise ValueError("El perfil debe ser un objeto JSON")
+    ajuste = {}
+    for clave, valor in datos.items():
+        if clave not in OPCIONES_TIEMPO:
+            raise ValueError(
+                f"Opción de perfil desconocida: {clave}. Opciones válidas: "
+                f"{', '.join(OPCIONES_TIEMPO)}"
+            )
+        if valor is None:
+            continue
+        if isinstance(valor, bool) or not isinstance(valor, int) or valor < 0:
+            raise ValueError(f"{clave} debe ser un entero no negativo")
+        if valor == 0 and clave in OPCIONES_POSITIVAS:
+            raise ValueError(f"{clave} debe ser al menos 1")
+        ajuste[clave] = valor
+    return ajuste
+
+
+def combinar_ajustes(aprendido, explicitos):
+    """
+    Une los ajustes aprendidos con los impuestos (a mano o en el escaneo)
+
+    Los impuestos mandan; si al unirlos un mínimo queda por encima de su
+    máximo, se mueve el valor aprendido hasta el impuesto (o el mínimo hasta
+    el máximo si los dos son impuestos)
+    """
+    valores = dict(aprendido, **explicitos)
+    for minimo, maximo in PARES_TIEMPO:
+        if minimo not in valores or maximo not in valores:
+            continue
+        if valores[minimo] <= valores[maximo]:
+            continue
+        if minimo in explicitos and maximo not in explicitos:
+            valores[maximo] = valores[minimo]
+        else:
+            valores[minimo] = valores[maximo]
+    return valores
+
+
+def perfil_objetivo(objetivos, tipo):
+    """
+    Perfil efectivo de unos objetivos: medidas de las redes que cubren,
+    ajustes deducidos y ajustes impuestos a mano
+
+    Returns:
+        dict: redes, medidas, aprendido, ajuste y ajustes (el resultado final)
+    """
+    perfiles_red = {}
+    for inicio, fin in fragmentos.rangos_objetivo(objetivos):
+        for perfil in almacen.perfiles_en_rango(_hex(inicio), _hex(fin)):
+            perfiles_red[perfil["red"]] = perfil
+
+    medidas = _unir_medidas(p["medidas"] for p in perfiles_red.values())
+    aprendido = ajustes(medidas, tipo)
+    ajuste = {}
+    for perfil in perfiles_red.values():
+        ajuste.update(perfil["ajuste"])
+    return {
+        "redes": sorted(perfiles_red),
+        "medidas": medidas,
+        "aprendido": aprendido,
+        "ajuste": ajuste,
+        "ajustes": combinar_ajustes(aprendido, ajuste),
+    }
+
+
+def argumentos_perfil(objetivos, tipo, args_nmap, perfil=None):
+    """
+    Opciones de tiempo de nmap para un escaneo según su perfil
+
+    Las opciones que ya vienen en args_nmap (argumentos del usuario) se
+    respetan y no se añaden
+
+    Args:
+        objetivos (str): Especificación de objetivos de nmap
+        tipo (str): Tipo de escaneo
+        args_nmap (list): Argumentos del escaneo
+        perfil: None para usar el perfil aprendido, False para no usar
+                ninguno o un dict con valores que se imponen en este escaneo
+
+    Returns:
+        tuple: (argumentos a añadir, ajustes aplicados)
+    """
+    if perfil is False or (perfil is None and not PERFILES_AUTOMATICOS):
+        return [], {}
+    datos = perfil_objetivo(objetivos, tipo)
+    explicitos = dict(datos["ajuste"])
+    if isinstance(perfil, dict):
+        explicitos.update(perfil)
+    valores = combinar_ajustes(datos["aprendido"], explicitos)
+
+    def presente(opcion):
+        return any(arg == opcion or arg.startswith(opcion + "=") for arg in args_nmap)
+
+    # Un mínimo aprendido no puede superar el máximo que haya fijado el
+    # usuario, ni un máximo aprendido quedar por debajo de su mínimo: nmap
+    # se niega a arrancar con min > max
+    for clave, opcion_usuario in (
+        ("min_rate", "--max-rate"),
+        ("min_parallelism", "--max-parallelism"),
+        ("max_parallelism", "--min-parallelism"),
+    ):
+        if presente(opcion_usuario):
+            valores.pop(clave, None)
+
+    argumentos = []
+    aplicados = {}
+    for clave, valor in valores.items():
+        opcion = OPCIONES_TIEMPO[clave]
+        if presente(opcion):
+            continue
+        if clave == "host_timeout":
+            argumentos.extend([opcion, f"{valor}s"])
+        else:
+            argumentos.extend([opcion, str(valor)])
+        aplicados[clave] = valor
+    return argumentos, aplicados
@@ -0,0 +1,435 @@
+"""
+Escaneos programados
+Cada programación guarda en el almacén los parámetros de un escaneo y cuándo
+repetirlo: una expresión cron o un intervalo. Un hilo revisa periódicamente
+las que ya tocan y las lanza con un tope de escaneos programados simultáneos
+y otro por programación; si la ejecución anterior de una programación sigue
+en curso, la nueva se omite. Los escaneos en curso se anotan en el almacén
+con el proceso que los ejecuta, así que los topes valen para todos los
+workers y se liberan solos si ese proceso ya no existe.
+
+Para que la carga se reparta a lo largo del día, en cron se admite H (como
+en Jenkins): "H 3 * * *" se ejecuta a las 3 en un minuto que depende de la
+programación, y @daily equivale a "H H * * *". Los intervalos también se
+desfasan según la programación y, además, cada ejecución se retrasa al azar
+hasta "jitter" segundos
+"""
+
+import hashlib
+import os
+import random
+import re
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import almacen
+import trabajos
+
+# Configuración
+PLANIFICADOR_ACTIVO = os.environ.get("PLANIFICADOR_ACTIVO", "1") != "0"
+PERIODO_PLANIFICADOR = float(os.environ.get("PERIODO_PLANIFICADOR", 5))
+MAX_ESCANEOS_PROGRAMADOS = int(os.environ.get("MAX_ESCANEOS_PROGRAMADOS", 2))
+JITTER_PROGRAMACIONES = int(os.environ.get("JITTER_PROGRAMACIONES", 300))
+INTERVALO_MINIMO = int(os.environ.get("INTERVALO_MINIMO_PROGRAMACION", 60))
+
+# Campos de una expresión cron: (mínimo, máximo)
+RANGOS_CRON = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+ALIAS_CRON = {
+    "@hourly": "H * * * *",
+    "@daily": "H H * * *",
+    "@midnight": "H H(0-2) * * *",
+    "@weekly": "H H * * H",
+    "@monthly": "H H H(1-28) * *",
+}
+UNIDADES_DURACION = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+# Función que lanza un escaneo: lanzador(parametros) -> vista del trabajo
+lanzador_escaneos = None
+
+# Un solo hilo de cada proceso lanza o repasa las ejecuciones a la vez
+lock_planificador = threading.Lock()
+hilo_planificador = None
+
+
+def configurar_lanzador(funcion):
+    """Registra la función que lanza un escaneo a partir de sus parámetros"""
+    global lanzador_escaneos
+    lanzador_escaneos = funcion
+
+
+def _hash(semilla, campo):
+    """Número estable para el H de un campo cron de una programación"""
+    return int(hashlib.sha1(f"{semilla}:{campo}".encode()).hexdigest()[:8], 16)
+
+
+def _valores_cron(campo, indice, semilla):
+    """Valores que admite un campo cron (*, H, listas, rangos y pasos)"""
+    minimo, maximo = RANGOS_CRON[indice]
+    valores = set()
+    for parte in campo.split(","):
+        paso = 1
+        if "/" in parte:
+            parte, paso = parte.split("/", 1)
+            paso = int(paso)
+            if paso < 1:
+                raise ValueError(f"Paso inválido en el campo cron {campo}")
+        if parte == "*":
+            inicio, fin = minimo, maximo
+        elif parte.startswith("H"):
+            inicio, fin = minimo, maximo
+            if indice == 4:
+                # H en el día de la semana: de 0 a 6, sin el 7 repetido
+                fin = 6
+            if parte != "H":
+                rango = re.fullmatch(r"H\((\d+)-(\d+)\)", parte)
+                if not rango:
+                    raise ValueError(f"Campo cron inválido: {campo}")
+                inicio, fin = int(rango.group(1)), int(rango.group(2))
+                if not minimo <= inicio <= fin <= maximo:
+                    raise ValueError(f"Campo cron fuera de rango: {campo}")
+            if paso > 1:
+                inicio += _hash(semilla, indice) % paso
+            else:
+                inicio = fin = inicio + _hash(semilla, indice) % (fin - inicio + 1)
+        elif "-" in parte:
+            inicio, fin = (int(valor) for valor in parte.split("-", 1))
+        else:
+            # "5/15" empieza en 5 y sigue cada 15 hasta el final del rango
+            inicio = int(parte)
+            fin = maximo if paso > 1 else inicio
+        if not minimo <= inicio <= fin <= maximo:
+            raise ValueError(f"Campo cron fuera de rango: {campo}")
+        valores.update(range(inicio, fin + 1, paso))
+    return valores
+
+
+def interpretar_cron(expresion, semilla):
+    """
+    Interpreta una expresión cron de cinco campos (o un alias como @daily)
+
+    Args:
+        expresion (str): minuto hora día-del-mes mes día-de-la-semana
+        semilla (str): Valor del que salen los H (el ID de la programación)
+
+    Returns:
+        dict: Conjuntos de valores de cada campo y si el día del mes y el
+              de la semana están restringidos
+
+    Raises:
+        ValueError: Si la expresión no es válida
+    """
+    campos = ALIAS_CRON.get(expresion.strip(), expresion).split()
+    if len(campos) != 5:
+        raise ValueError("La expresión cron debe tener cinco campos")
+    try:
+        minutos, horas, dias, meses, semana = (
+            _valores_cron(campo, indice, semilla) for indice, campo in enumerate(campos)
+        )
+    except ValueError as e:
+        if "cron" in str(e):
+            raise
+        raise ValueError(f"Expresión cron inválida: {expresion}")
+    if 7 in semana:
+        semana = (semana - {7}) | {0}
+    return {
+        "minutos": minutos,
+        "horas": horas,
+        "dias": dias,
+        "meses": meses,
+        "semana": semana,
+        "dia_restringido": not campos[2].startswith("*"),
+        "semana_restringida": not campos[4].startswith("*"),
+    }
+
+
+def _dia_valido(cron, momento):
+    """Comprueba el día del mes y el de la semana con la regla de cron"""
+    en_mes = momento.day in cron["dias"]
+    # weekday(): lunes = 0; en cron el domingo es 0
+    en_semana = (momento.weekday() + 1) % 7 in cron["semana"]
+    if cron["dia_restringido"] and cron["semana_restringida"]:
+        return en_mes or en_semana
+    return en_mes and en_semana
+
+
+def siguiente_cron(cron, desde):
+    """Primer minuto posterior a desde que cumple la expresión"""
+    momento = desde.replace(second=0, microsecond=0) + timedelta(minutes=1)
+    limite = momento + timedelta(days=366 * 5)
+    while momento < limite:
+        if momento.month not in cron["meses"]:
+            siguiente_mes = momento.replace(day=1, hour=0, minute=0) + timedelta(
+                days=32
+            )
+            momento = siguiente_mes.replace(day=1)
+        elif not _dia_valido(cron, momento):
+            momento = momento.replace(hour=0, minute=0) + timedelta(days=1)
+        elif momento.hour not in cron["horas"]:
+            momento = momento.replace(minute=0) + timedelta(hours=1)
+        elif momento.minute not in cron["minutos"]:
+            momento += timedelta(minutes=1)
+        else:
+            return momento
+    raise ValueError("La expresión cron no se cumple nunca")
+
+
+def duracion(valor):
+    """Segundos de un intervalo: entero o texto como 90s, 30m, 6h o 1d"""
+    if isinstance(valor, bool):
+        raise ValueError("Intervalo inválido")
+    if isinstance(valor, int):
+        return valor
+    coincidencia = re.fullmatch(r"\s*(\d+)\s*([smhd]?)\s*", str(valor))
+    if not coincidencia:
+        raise ValueError(f"Intervalo inválido: {valor}")
+    return int(coincidencia.group(1)) * UNIDADES_DURACION[coincidencia.group(2) or "s"]
+
+
+def _siguiente_nominal(programacion, despues):
+    """Hora nominal (sin jitter) de la primera ejecución posterior a despues"""
+    if programacion["cron"]:
+        return siguiente_cron(
+            interpretar_cron(programacion["cron"], programacion["id"]), despues
+        )
+    # Los intervalos se alinean a un desfase propio de cada programación, de
+    # modo que las que comparten intervalo no coinciden
+    intervalo = programacion["intervalo"]
+    desfase = _hash(programacion["id"], "intervalo") % intervalo
+    marca = despues.timestamp()
+    siguiente = desfase + (int((marca - desfase) // intervalo) + 1) * intervalo
+    return datetime.fromtimestamp(siguiente)
+
+
+def planificar(programacion, despues):
+    """
+    Próxima ejecución de una programación
+
+    El jitter nunca pasa de la mitad del tiempo hasta la ejecución siguiente,
+    para que no se salte ninguna
+
+    Returns:
+        tuple: (hora nominal, hora con jitter), en ISO
+    """
+    prevista = _siguiente_nominal(programacion, despues)
+    hueco = (_siguiente_nominal(programacion, prevista) - prevista).total_seconds()
+    jitter = min(programacion["jitter"], hueco / 2)
+    proxima = prevista + timedelta(seconds=random.uniform(0, jitter))
+    return (
+        prevista.isoformat(timespec="seconds"),
+        proxima.isoformat(timespec="seconds"),
+    )
+
+
+def crear_programacion(
+    parametros, cron=None, intervalo=None, jitter=None, max_simultaneos=1, nombre=None
+):
+    """
+    Valida y guarda una programación nueva
+
+    Args:
+        parametros (dict): Parámetros del escaneo ya validados
+        cron (str): Expresión cron (o None si se usa intervalo)
+        intervalo: Segundos entre ejecuciones (entero o texto como 6h)
+        jitter (int): Retraso máximo al azar de cada ejecución en segundos
+                      (por defecto JITTER_PROGRAMACIONES)
+        max_simultaneos (int): Ejecuciones de la programación en curso a la vez
+
+    Returns:
+        dict: La programación guardada
+
+    Raises:
+        ValueError: Si la programación no es válida
+    """
+    if bool(cron) == (intervalo is not None):
+        raise ValueError('Debe indicar "cron" o "intervalo" (solo uno de los dos)')
+    programacion = {
+        "id": str(uuid.uuid4()),
+        "nombre": nombre or parametros["host"],
+        "parametros": parametros,
+        "cron": cron,
+        "intervalo": None,
+        "jitter": JITTER_PROGRAMACIONES if jitter is None else jitter,
+        "max_simultaneos": max_simultaneos,
+        "activa": True,
+        "creada": datetime.now().isoformat(timespec="seconds"),
+    }
+    if cron:
+        if not isinstance(cron, str):
+            raise ValueError("cron debe ser un texto")
+        interpretar_cron(cron, programacion["id"])
+    else:
+        programacion["intervalo"] = duracion(intervalo)
+        if programacion["intervalo"] < INTERVALO_MINIMO:
+            raise ValueError(f"El intervalo mínimo es de {INTERVALO_MINIMO}s")
+    for campo in ("jitter", "max_simultaneos"):
+        valor = programacion[campo]
+        if isinstance(valor, bool) or not isinstance(valor, int) or valor < 0:
+            raise ValueError(f"{campo} debe ser un entero no negativo")
+    if programacion["max_simultaneos"] < 1:
+        raise ValueError("max_simultaneos debe ser al menos 1")
+
+    programacion["prevista"], programacion["proxima"] = planificar(
+        programacion, datetime.now()
+    )
+    almacen.guardar_programacion(programacion)
+    return programacion
+
+
+def pausar_programacion(programacion_id):
+    """Pausa una programación; devuelve False si no existe"""
+    return almacen.actualizar_programacion(programacion_id, activa=False)
+
+
+def reanudar_programacion(programacion_id):
+    """
+    Reactiva una programación a partir de ahora (las ejecuciones perdidas
+    mientras estuvo en pausa no se recuperan)
+
+    Returns:
+        dict: La programación, o None si no existe
+    """
+    programacion = almacen.obtener_programacion(programacion_id)
+    if programacion is None:
+        return None
+    prevista, proxima = planificar(programacion, datetime.now())
+    almacen.actualizar_programacion(
+        programacion_id, activa=True, prevista=prevista, proxima=proxima
+    )
+    return almacen.obtener_programacion(programacion_id)
+
+
+def _actualizar_ejecuciones():
+    """
+    Repasa las ejecuciones programadas en curso (con lock_planificador
+    tomado): las de este proceso según el estado de su trabajo y las de los
+    procesos que ya no existen se olvidan
+    """
+    pid = os.getpid()
+    terminadas = []
+    for ejecucion in almacen.listar_ejecuciones():
+        if ejecucion["pid"] != pid:
+            if not trabajos.proceso_vivo(ejecucion["pid"]):
+                terminadas.append(ejecucion["id"])
+            continue
+        # Sin trabajo y con el lock tomado es que el lanzamiento no terminó
+        # (o es de un proceso anterior con el mismo PID)
+        trabajo = ejecucion["trabajo_id"] and trabajos.obtener_trabajo(
+            ejecucion["trabajo_id"]
+        )
+        if not trabajo or trabajo["estado"] not in trabajos.ESTADOS_ACTIVOS:
+            terminadas.append(ejecucion["id"])
+        elif trabajo["estado"] != ejecucion["estado"]:
+            almacen.actualizar_ejecucion(
+                ejecucion["id"], trabajo["id"], trabajo["estado"]
+            )
+    if terminadas:
+        almacen.eliminar_ejecuciones(*terminadas)
+
+
+def trabajo_terminado(vista):
+    """Libera en el momento el hueco de un escaneo programado que terminó"""
+    if vista["estado"] not in trabajos.ESTADOS_ACTIVOS:
+        almacen.eliminar_ejecuciones_trabajo(vista["id"])
+
+
+def trabajos_activos(programacion_id=None):
+    """
+    IDs de los trabajos en curso lanzados por una programación (o por todas),
+    en cualquier worker
+    """
+    with lock_planificador:
+        _actualizar_ejecuciones()
+    return [
+        ejecucion["trabajo_id"]
+        for ejecucion in almacen.listar_ejecuciones(programacion_id)
+        if ejecucion["trabajo_id"]
+    ]
+
+
+def revisar_programaciones(ahora=None):
+    """
+    Lanza las programaciones que ya tocan
+
+    Si la ejecución anterior de una programación sigue en curso (tiene
+    max_simultaneos en marcha) la de ahora se omite; si se alcanzó
+    MAX_ESCANEOS_PROGRAMADOS las pendientes esperan a que se libere un hueco
+    """
+    ahora = ahora or datetime.now()
+    pendientes = almacen.programaciones_pendientes(ahora.isoformat(timespec="seconds"))
+    if not pendientes:
+        return
+    pid = os.getpid()
+    # El lock cubre hasta que la ejecución tiene su trabajo anotado
+    with lock_planificador:
+        _actualizar_ejecuciones()
+        for programacion in pendientes:
+            programacion_id = programacion["id"]
+            # Sin recuperar ejecuciones perdidas: la siguiente es posterior a ahora
+            prevista, proxima = planificar(
+                programacion,
+                max(ahora, datetime.fromisoformat(programacion["prevista"])),
+            )
+            ejecucion_id = str(uuid.uuid4())
+            reserva = almacen.reservar_ejecucion(
+                programacion_id,
+                programacion["proxima"],
+                prevista,
+                proxima,
+                ejecucion_id,
+                pid,
+                MAX_ESCANEOS_PROGRAMADOS,
+            )
+            if reserva == "esperar":
+                break
+            if reserva is None:
+                # Otro worker se adelantó
+                continue
+            if reserva == "omitir":
+                print(
+                    f"[!] Programación {programacion['nombre']}: la ejecución "
+                    "anterior sigue en curso, se omite esta"
+                )
+                continue
+
+            try:
+                trabajo = lanzador_escaneos(dict(programacion["parametros"]))
+            except Exception as e:
+                print(
+                    f"[!] Programación {programacion['nombre']}: no se pudo lanzar: {e}"
+                )
+                almacen.eliminar_ejecuciones(ejecucion_id)
+                almacen.actualizar_programacion(programacion_id, ultimo_error=str(e))
+                continue
+            almacen.actualizar_ejecucion(ejecucion_id, trabajo["id"], trabajo["estado"])
+            almacen.actualizar_programacion(
+                programacion_id, ultimo_trabajo=trabajo["id"], ultimo_error=None
+            )
+            print(
+                f"[+] Programación {programacion['nombre']}: escaneo {trabajo['id']} "
+                f"lanzado; la siguiente, {proxima}"
+            )
+
+
+def bucle_planificador():
+    """Revisa las programaciones cada PERIODO_PLANIFICADOR segundos"""
+    while True:
+        try:
+            revisar_programaciones()
+        except Exception as e:
+            print(f"[!] Error en el planificador: {e}")
+        time.sleep(PERIODO_PLANIFICADOR)
+
+
+def iniciar_planificador():
+    """Arranca el hilo del planificador si está activo y aún no está en marcha"""
+    global hilo_planificador
+    with lock_planificador:
+        if not PLANIFICADOR_ACTIVO or hilo_planificador is not None:
+            return
+        hilo_planificador = threading.Thread(
+            target=bucle_planificador, name="planificador"
+        )
+        hilo_planificador.daemon = True
+        hilo_planificador.start()
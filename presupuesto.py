@@ -0,0 +1,325 @@
+"""
+Presupuestos de tráfico
+Limita los paquetes por segundo y las sondas simultáneas que suman todos
+los escaneos en marcha, en global y por red de destino. Cada escaneo nmap
+reserva su parte del presupuesto antes de arrancar (--max-rate y
+--max-parallelism, repartidos entre sus procesos si está fragmentado) y la
+libera al terminar; los escaneos asyncio ajustan su parte mientras corren.
+Las reservas se guardan en la base de datos, así que el reparto abarca los
+procesos del pool y todos los workers
+"""
+
+import functools
+import ipaddress
+import os
+import shlex
+import time
+import uuid
+
+import almacen
+import fragmentos
+import motor_nmap
+import trabajos
+
+# Configuración (0 = sin límite)
+PRESUPUESTO_PPS = int(os.environ.get("PRESUPUESTO_PPS", 0))
+PRESUPUESTO_SONDAS = int(os.environ.get("PRESUPUESTO_SONDAS", 0))
+# Presupuestos por red: "10.0.0.0/8=2000:200,192.168.1.0/24=500" (pps:sondas)
+PRESUPUESTOS_RED = os.environ.get("PRESUPUESTOS_RED", "")
+# Espera máxima por una parte del presupuesto; después se arranca con lo que quede
+ESPERA_MAXIMA_PRESUPUESTO = int(os.environ.get("ESPERA_MAXIMA_PRESUPUESTO", 120))
+INTERVALO_PRESUPUESTO = 0.5
+
+DIMENSIONES = ("pps", "sondas")
+
+# Opción de nmap que limita cada dimensión y la mínima que no puede superarla
+OPCIONES_PRESUPUESTO = {
+    "pps": ("--max-rate", "--min-rate"),
+    "sondas": ("--max-parallelism", "--min-parallelism"),
+}
+
+
+def interpretar_presupuestos(global_pps, global_sondas, por_red):
+    """
+    Construye los presupuestos a partir de la configuración
+
+    Returns:
+        dict: {clave: {"red", "pps", "sondas"}}; "global" para el presupuesto
+              global y el CIDR para cada red
+
+    Raises:
+        ValueError: Si la lista de presupuestos por red no es válida
+    """
+    presupuestos = {}
+    if global_pps or global_sondas:
+        presupuestos["global"] = {
+            "red": None,
+            "pps": global_pps,
+            "sondas": global_sondas,
+        }
+    for entrada in por_red.split(","):
+        entrada = entrada.strip()
+        if not entrada:
+            continue
+        red, _, limites = entrada.partition("=")
+        pps, _, sondas = limites.partition(":")
+        try:
+            red = ipaddress.ip_network(red.strip(), strict=False)
+            pps = int(pps or 0)
+            sondas = int(sondas or 0)
+        except ValueError:
+            raise ValueError(f"Presupuesto de red inválido: {entrada}")
+        if pps < 0 or sondas < 0:
+            raise ValueError(f"Presupuesto de red inválido: {entrada}")
+        presupuestos[str(red)] = {"red": red, "pps": pps, "sondas": sondas}
+    return presupuestos
+
+
+PRESUPUESTOS = interpretar_presupuestos(
+    PRESUPUESTO_PPS, PRESUPUESTO_SONDAS, PRESUPUESTOS_RED
+)
+
+
+def claves_objetivo(objetivos):
+    """Presupuestos que afectan a unos objetivos de nmap"""
+    claves = []
+    rangos = fragmentos.rangos_objetivo(objetivos) if PRESUPUESTOS else []
+    for clave, presupuesto in PRESUPUESTOS.items():
+        red = presupuesto["red"]
+        if red is None or any(
+            inicio.version == red.version and inicio <= red[-1] and fin >= red[0]
+            for inicio, fin in rangos
+        ):
+            claves.append(clave)
+    return claves
+
+
+def _repartir(reserva_id, reservas, forzar=False):
+    """
+    Calcula la parte de una reserva en cada presupuesto que le afecta
+
+    Cada presupuesto se reparte a partes iguales entre sus consumidores
+    (en marcha y esperando). Una reserva que espera solo se admite si su
+    parte cabe junto a lo ya concedido; los consumidores ajustables cuentan
+    con su parte justa, porque la reducen en cuanto llega otro escaneo
+
+    Args:
+        reserva_id (str): ID de la reserva
+        reservas (list): Todas las reservas
+        forzar (bool): Admitirla con lo que quede aunque no llegue a su parte
+
+    Returns:
+        dict: Nuevos pps, sondas y activa, o None si debe seguir esperando
+    """
+    propia = next(r for r in reservas if r["id"] == reserva_id)
+    cuota = {}
+    admitida = True
+    for clave in propia["claves"]:
+        presupuesto = PRESUPUESTOS.get(clave)
+        if presupuesto is None:
+            continue
+        consumidores = [r for r in reservas if clave in r["claves"]]
+        otros = [r for r in consumidores if r["activa"] and r["id"] != reserva_id]
+        esperando = [r for r in consumidores if not r["activa"]]
+        for dimension in DIMENSIONES:
+            limite = presupuesto[dimension]
+            if not limite:
+                continue
+            parte = max(limite // len(consumidores), 1)
+            fijos = sum(r[dimension] or 0 for r in otros if not r["ajustable"])
+            ajustables = sum(1 for r in otros if r["ajustable"])
+            if propia["activa"]:
+                # Consumidor ajustable: lo que dejan libre los fijos y los
+                # que esperan, repartido entre los ajustables
+                libre = limite - fijos - parte * len(esperando)
+                valor = max(min(libre // (ajustables + 1), limite), 1)
+            else:
+                libre = limite - fijos - parte * ajustables
+                if libre < parte:
+                    admitida = False
+                valor = max(min(parte, libre), 1)
+            cuota[dimension] = min(cuota.get(dimension, valor), valor)
+
+    if not propia["activa"] and not admitida and not forzar:
+        return None
+    return {
+        "pps": cuota.get("pps"),
+        "sondas": cuota.get("sondas"),
+        "activa": True,
+    }
+
+
+def _cuota(reserva):
+    """Parte concedida a una reserva, solo con las dimensiones limitadas"""
+    return {d: reserva[d] for d in DIMENSIONES if reserva.get(d) is not None}
+
+
+def limpiar_reservas():
+    """Libera las reservas de procesos que ya no existen"""
+    for pid in {r["pid"] for r in almacen.listar_reservas()}:
+        if not trabajos.proceso_vivo(pid):
+            almacen.eliminar_reservas_proceso(pid)
+
+
+def reservar(objetivos, ajustable=False):
+    """
+    Reserva la parte del presupuesto de un escaneo, esperando si hace falta
+    a que otros terminen
+
+    Args:
+        objetivos (str): Especificación de objetivos de nmap
+        ajustable (bool): El escaneo ajusta su ritmo mientras corre
+                          (ver cuota); si no, su parte es fija
+
+    Returns:
+        tuple: (ID de la reserva o None si no hay presupuestos que le
+               afecten, cuota {"pps", "sondas"} con las dimensiones limitadas)
+    """
+    claves = claves_objetivo(objetivos)
+    if not claves:
+        return None, {}
+
+    limpiar_reservas()
+    reserva_id = str(uuid.uuid4())
+    almacen.crear_reserva(reserva_id, claves, ajustable, os.getpid())
+    inicio = time.monotonic()
+    try:
+        while True:
+            forzar = time.monotonic() - inicio >= ESPERA_MAXIMA_PRESUPUESTO
+            reserva = almacen.recalcular_reserva(
+                reserva_id,
+                lambda reservas: _repartir(reserva_id, reservas, forzar),
+            )
+            if reserva["activa"]:
+                if forzar:
+                    print(
+                        f"[!] Presupuesto agotado tras {ESPERA_MAXIMA_PRESUPUESTO}s "
+                        f"de espera; {objetivos} arranca con {_cuota(reserva)}"
+                    )
+                return reserva_id, _cuota(reserva)
+            time.sleep(INTERVALO_PRESUPUESTO)
+    except BaseException:
+        almacen.eliminar_reservas(reserva_id)
+        raise
+
+
+def cuota(reserva_id):
+    """Recalcula la parte de una reserva ajustable según quién esté en marcha"""
+    if reserva_id is None:
+        return {}
+    reserva = almacen.recalcular_reserva(
+        reserva_id, lambda reservas: _repartir(reserva_id, reservas)
+    )
+    return _cuota(reserva) if reserva else {}
+
+
+def liberar(reserva_id):
+    """Devuelve al presupuesto la parte de una reserva"""
+    if reserva_id is not None:
+        almacen.eliminar_reservas(reserva_id)
+
+
+def _numero(valor):
+    """Formatea un valor numérico de nmap sin decimales innecesarios"""
+    return str(int(valor)) if float(valor).is_integer() else str(valor)
+
+
+def aplicar_cuota(argumentos, cuota):
+    """
+    Limita unos argumentos de nmap a la cuota concedida
+
+    Respeta un --max-rate o --max-parallelism menor del usuario y rebaja
+    --min-rate y --min-parallelism para que no superen el máximo
+
+    Args:
+        argumentos (str): Argumentos de nmap
+        cuota (dict): Parte concedida ({"pps", "sondas"})
+
+    Returns:
+        str: Argumentos con la cuota aplicada
+    """
+    if not cuota:
+        return argumentos
+    args = shlex.split(argumentos)
+
+    def extraer(opcion):
+        """Quita una opción (--opcion valor o --opcion=valor) y devuelve su valor"""
+        valor = None
+        resto = []
+        indice = 0
+        while indice < len(args):
+            arg = args[indice]
+            if arg == opcion and indice + 1 < len(args):
+                valor = args[indice + 1]
+                indice += 2
+                continue
+            if arg.startswith(opcion + "="):
+                valor = arg.split("=", 1)[1]
+            else:
+                resto.append(arg)
+            indice += 1
+        args[:] = resto
+        try:
+            return float(valor) if valor is not None else None
+        except ValueError:
+            return None
+
+    for dimension, (maxima, minima) in OPCIONES_PRESUPUESTO.items():
+        limite = cuota.get(dimension)
+        if not limite:
+            continue
+        actual = extraer(maxima)
+        valor = limite if actual is None else min(actual, limite)
+        valor_minimo = extraer(minima)
+        if valor_minimo is not None:
+            args.extend([minima, _numero(min(valor_minimo, valor))])
+        args.extend([maxima, _numero(valor)])
+    return shlex.join(args)
+
+
+def ejecutar_nmap(objetivos, argumentos, al_evento=None, al_host=None):
+    """Como motor_nmap.ejecutar_nmap, con la parte del presupuesto que le toque"""
+    reserva_id, cuota_nmap = reservar(objetivos)
+    try:
+        return motor_nmap.ejecutar_nmap(
+            objetivos, aplicar_cuota(argumentos, cuota_nmap), al_evento, al_host
+        )
+    finally:
+        liberar(reserva_id)
+
+
+def repartir_cuota(cuota, partes):
+    """Divide una cuota entre varios procesos nmap que corren a la vez"""
+    return {d: max(valor // max(partes, 1), 1) for d, valor in cuota.items()}
+
+
+def escanear_fragmento(subescaneo_id, objetivos, argumentos, cuota=None):
+    """Como fragmentos.escanear_fragmento, limitado a una cuota ya reservada"""
+    return fragmentos.escanear_fragmento(
+        subescaneo_id, objetivos, aplicar_cuota(argumentos, cuota)
+    )
+
+
+def ejecutor_fragmentos(cuota, procesos):
+    """
+    Ejecutor para fragmentos.ejecutar_subescaneos que reparte la cuota de
+    un escaneo entre los procesos nmap que van a correr a la vez
+
+    Un escaneo fragmentado reserva una sola vez: si cada subescaneo
+    reservase por su cuenta, el primero en arrancar se llevaría todo el
+    presupuesto y los demás esperarían a que terminase
+    """
+    if not cuota:
+        return None
+    return functools.partial(escanear_fragmento, cuota=repartir_cuota(cuota, procesos))
+
+
+def estado():
+    """Presupuestos configurados y reservas en curso"""
+    return {
+        "presupuestos": {
+            clave: {d: presupuesto[d] for d in DIMENSIONES}
+            for clave, presupuesto in PRESUPUESTOS.items()
+        },
+        "reservas": almacen.listar_reservas(),
+    }
@@ -0,0 +1,98 @@
+"""
+Medición del rendimiento de cada escaneo
+Cronometra las fases de ejecutar_escaneo (preparación, motor, sondeo HTTP,
+modelo, almacenamiento...) para distinguir el tiempo de nmap del de nuestro
+código y, si se pide, perfila el escaneo con cProfile y mide su pico de
+memoria con tracemalloc
+"""
+
+import cProfile
+import io
+import os
+import pstats
+import resource
+import threading
+import time
+import tracemalloc
+
+# Configuración
+PERFILADO_ESCANEOS = os.environ.get("PERFILADO_ESCANEOS", "0") != "0"
+FUNCIONES_PERFIL = int(os.environ.get("FUNCIONES_PERFIL", 25))
+
+# Fase en la que trabaja el motor (nmap o asyncio) y no nuestro código
+FASE_MOTOR = "motor"
+
+# tracemalloc mide todo el proceso: solo se perfila un escaneo a la vez
+lock_perfilado = threading.Lock()
+
+
+def iniciar(perfilar=None):
+    """
+    Empieza a medir un escaneo
+
+    Args:
+        perfilar (bool): Activar cProfile y tracemalloc (None: según
+                         PERFILADO_ESCANEOS)
+
+    Returns:
+        dict: Medición en curso, para marcar y terminar
+    """
+    if perfilar is None:
+        perfilar = PERFILADO_ESCANEOS
+    ahora = time.perf_counter()
+    medicion = {"inicio": ahora, "ultima": ahora, "fases": {}, "perfil": None}
+    if perfilar:
+        if lock_perfilado.acquire(blocking=False):
+            tracemalloc.start()
+            tracemalloc.reset_peak()
+            medicion["perfil"] = cProfile.Profile()
+            medicion["perfil"].enable()
+        else:
+            print("[!] Ya hay un escaneo perfilándose: este solo se cronometra")
+    return medicion
+
+
+def marcar(medicion, fase):
+    """Atribuye a una fase el tiempo transcurrido desde la marca anterior"""
+    if medicion is None:
+        return
+    ahora = time.perf_counter()
+    fases = medicion["fases"]
+    fases[fase] = round(fases.get(fase, 0) + ahora - medicion["ultima"], 4)
+    medicion["ultima"] = ahora
+
+
+def terminar(medicion):
+    """
+    Termina una medición y devuelve su resumen
+
+    Returns:
+        dict: fases {fase: segundos}, total, fuera_del_motor (segundos de
+              nuestro código), memoria_maxima_proceso_mb y, si se perfiló,
+              memoria_pico_mb y perfil (las funciones más costosas)
+    """
+    total = time.perf_counter() - medicion["inicio"]
+    resumen = {
+        "fases": medicion["fases"],
+        "total": round(total, 4),
+        "fuera_del_motor": round(total - medicion["fases"].get(FASE_MOTOR, 0), 4),
+        # ru_maxrss viene en KiB en Linux
+        "memoria_maxima_proceso_mb": round(
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1
+        ),
+    }
+    perfil = medicion["perfil"]
+    if perfil is not None:
+        perfil.disable()
+        _, pico = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        medicion["perfil"] = None
+        lock_perfilado.release()
+
+        salida = io.StringIO()
+        pstats.Stats(perfil, stream=salida).sort_stats("cumulative").print_stats(
+            FUNCIONES_PERFIL
+        )
+        resumen["memoria_pico_mb"] = round(pico / 2**20, 2)
+        resumen["perfil"] = salida.getvalue()
+    return resumen
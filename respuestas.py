@@ -0,0 +1,204 @@
+"""
+Respuestas HTTP condicionales y comprimidas
+Un reporte terminado no cambia: sus respuestas llevan un ETag fuerte, una
+petición con If-None-Match recibe un 304 sin cuerpo y el cuerpo comprimido
+(gzip o deflate) se guarda por reporte para no volver a comprimirlo
+"""
+
+import gzip
+import os
+import threading
+import zlib
+from collections import OrderedDict
+
+from flask import Response, request
+
+# Configuración
+MAX_RESPUESTAS_COMPRIMIDAS = int(os.environ.get("MAX_RESPUESTAS_COMPRIMIDAS", 128))
+MEMORIA_RESPUESTAS_COMPRIMIDAS = int(
+    os.environ.get("MEMORIA_RESPUESTAS_COMPRIMIDAS", 32 * 1024 * 1024)
+)
+TAMANO_MINIMO_COMPRESION = int(os.environ.get("TAMANO_MINIMO_COMPRESION", 1024))
+NIVEL_COMPRESION = int(os.environ.get("NIVEL_COMPRESION", 6))
+TAMANO_DESCARGA_EN_TROZOS = int(
+    os.environ.get("TAMANO_DESCARGA_EN_TROZOS", 1024 * 1024)
+)
+
+CODIFICACIONES = ("gzip", "deflate")
+
+# Cuerpos ya comprimidos por (reporte, representación, codificación)
+cache_comprimidos = OrderedDict()
+memoria_comprimidos = 0
+lock_comprimidos = threading.Lock()
+
+
+def negociar_codificacion():
+    """Elige gzip o deflate según Accept-Encoding, o None para no comprimir"""
+    return request.accept_encodings.best_match(CODIFICACIONES)
+
+
+def comprimir(cuerpo, codificacion):
+    """Comprime un cuerpo en bytes con la codificación indicada"""
+    if codificacion == "gzip":
+        return gzip.compress(cuerpo, NIVEL_COMPRESION, mtime=0)
+    return zlib.compress(cuerpo, NIVEL_COMPRESION)
+
+
+def _etiqueta(huella, representacion, codificacion=None):
+    """ETag de una representación concreta (y codificación) de un reporte"""
+    partes = [huella, representacion] + ([codificacion] if codificacion else [])
+    return "-".join(partes)
+
+
+def _variantes(huella, representacion):
+    """Todas las ETags válidas de una representación (una por codificación)"""
+    return [_etiqueta(huella, representacion)] + [
+        _etiqueta(huella, representacion, c) for c in CODIFICACIONES
+    ]
+
+
+def no_modificado(*etiquetas):
+    """
+    Devuelve un 304 si el cliente ya tiene alguna de las etiquetas, o None
+
+    Args:
+        etiquetas (str): ETags (sin comillas) válidos para el recurso
+    """
+    for etiqueta in etiquetas:
+        if request.if_none_match.contains_weak(etiqueta):
+            respuesta = Response(status=304)
+            respuesta.set_etag(etiqueta)
+            respuesta.headers["Cache-Control"] = "no-cache"
+            return respuesta
+    return None
+
+
+def _comprimido_en_cache(clave):
+    """Devuelve un cuerpo comprimido de la caché o None"""
+    with lock_comprimidos:
+        comprimido = cache_comprimidos.get(clave)
+        if comprimido is not None:
+            cache_comprimidos.move_to_end(clave)
+        return comprimido
+
+
+def _guardar_comprimido(clave, comprimido):
+    """
+    Guarda un cuerpo comprimido en la caché LRU, sin pasar de
+    MAX_RESPUESTAS_COMPRIMIDAS cuerpos ni de MEMORIA_RESPUESTAS_COMPRIMIDAS bytes
+    """
+    global memoria_comprimidos
+    if len(comprimido) > MEMORIA_RESPUESTAS_COMPRIMIDAS:
+        return
+    with lock_comprimidos:
+        memoria_comprimidos -= len(cache_comprimidos.pop(clave, b""))
+        cache_comprimidos[clave] = comprimido
+        memoria_comprimidos += len(comprimido)
+        while (
+            len(cache_comprimidos) > MAX_RESPUESTAS_COMPRIMIDAS
+            or memoria_comprimidos > MEMORIA_RESPUESTAS_COMPRIMIDAS
+        ):
+            _, descartado = cache_comprimidos.popitem(last=False)
+            memoria_comprimidos -= len(descartado)
+
+
+def olvidar_reporte(reporte_id=None):
+    """Quita de la caché los cuerpos de un reporte (sin ID, todos)"""
+    global memoria_comprimidos
+    with lock_comprimidos:
+        for clave in list(cache_comprimidos):
+            if reporte_id is None or clave[0] == reporte_id:
+                memoria_comprimidos -= len(cache_comprimidos.pop(clave))
+
+
+def respuesta_reporte(reporte, representacion, generar_cuerpo, mimetype, headers=None):
+    """
+    Responde con una representación de un reporte inmutable
+
+    El ETag depende de la huella de los datos del reporte, de la
+    representación y de la codificación; si el cliente ya la tiene se
+    responde 304 sin llamar a generar_cuerpo
+
+    Args:
+        reporte (dict): Metadatos del reporte (con "id" y "huella")
+        representacion (str): Nombre de la representación ("contenido", ...)
+        generar_cuerpo (callable): Devuelve el cuerpo en bytes
+        mimetype (str): Tipo MIME de la respuesta
+        headers (dict): Cabeceras adicionales
+
+    Returns:
+        Response: 200 con el cuerpo (comprimido si procede) o 304
+    """
+    huella = reporte["huella"]
+    codificacion = negociar_codificacion()
+    respuesta = no_modificado(*_variantes(huella, representacion))
+    if respuesta is not None:
+        return respuesta
+
+    clave = (reporte["id"], huella, representacion, codificacion)
+    cuerpo = _comprimido_en_cache(clave) if codificacion else None
+    if cuerpo is None:
+        cuerpo = generar_cuerpo()
+        # Los cuerpos pequeños no compensan el coste de comprimirlos
+        if codificacion and len(cuerpo) >= TAMANO_MINIMO_COMPRESION:
+            cuerpo = comprimir(cuerpo, codificacion)
+            _guardar_comprimido(clave, cuerpo)
+        else:
+            codificacion = None
+
+    respuesta = Response(cuerpo, mimetype=mimetype, headers=headers)
+    if codificacion:
+        respuesta.headers["Content-Encoding"] = codificacion
+    respuesta.set_etag(_etiqueta(huella, representacion, codificacion))
+    respuesta.headers["Cache-Control"] = "no-cache"
+    respuesta.vary.add("Accept-Encoding")
+    return respuesta
+
+
+def _comprimir_trozos(trozos, codificacion):
+    """Comprime una secuencia de trozos sobre la marcha"""
+    # wbits 31 = formato gzip, 15 = formato zlib (deflate en HTTP)
+    compresor = zlib.compressobj(
+        NIVEL_COMPRESION, zlib.DEFLATED, 31 if codificacion == "gzip" else 15
+    )
+    for trozo in trozos:
+        comprimido = compresor.compress(trozo)
+        if comprimido:
+            yield comprimido
+    yield compresor.flush()
+
+
+def respuesta_reporte_en_trozos(
+    reporte, representacion, generar_trozos, mimetype, headers=None
+):
+    """
+    Como respuesta_reporte, pero el cuerpo se envía a medida que se genera
+    (y se comprime sobre la marcha) en lugar de construirlo entero en memoria
+
+    Args:
+        generar_trozos (callable): Devuelve un iterable de trozos en bytes
+    """
+    huella = reporte["huella"]
+    codificacion = negociar_codificacion()
+    respuesta = no_modificado(*_variantes(huella, representacion))
+    if respuesta is not None:
+        return respuesta
+
+    trozos = generar_trozos()
+    if codificacion:
+        trozos = _comprimir_trozos(trozos, codificacion)
+
+    respuesta = Response(trozos, mimetype=mimetype, headers=headers)
+    if codificacion:
+        respuesta.headers["Content-Encoding"] = codificacion
+    respuesta.set_etag(_etiqueta(huella, representacion, codificacion))
+    respuesta.headers["Cache-Control"] = "no-cache"
+    respuesta.vary.add("Accept-Encoding")
+    return respuesta
+
+
+def respuesta_json_condicional(respuesta):
+    """Añade un ETag a una respuesta JSON y la convierte en 304 si no cambió"""
+    respuesta.add_etag()
+    respuesta.headers["Cache-Control"] = "no-cache"
+    return respuesta.make_conditional(request)
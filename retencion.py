@@ -0,0 +1,94 @@
+"""
+Retención de reportes
+Mantiene acotados la memoria y el tamaño de la base aunque el servicio
+lleve mucho tiempo en marcha. Los escaneos más usados quedan decodificados
+en memoria en orden LRU, con un límite de bytes (almacen.MEMORIA_ESCANEOS_CACHE);
+cuando los datos guardados en la base superan PRESUPUESTO_REPORTES_BYTES o
+un reporte lleva más de EDAD_MAXIMA_CALIENTE segundos sin consultarse, sus
+datos pasan a un archivo comprimido y se vuelven a leer de él al pedirlo
+"""
+
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+import almacen
+
+# Configuración (0 = sin límite)
+PRESUPUESTO_REPORTES_BYTES = int(os.environ.get("PRESUPUESTO_REPORTES_BYTES", 0))
+EDAD_MAXIMA_CALIENTE = int(os.environ.get("EDAD_MAXIMA_CALIENTE", 0))
+INTERVALO_RETENCION = int(os.environ.get("INTERVALO_RETENCION", 60))
+
+hilo_retencion = None
+lock_retencion = threading.Lock()
+
+
+def aplicar_retencion():
+    """
+    Enfría los reportes que no caben en el presupuesto o llevan demasiado
+    tiempo sin consultarse, empezando por los menos usados
+
+    Returns:
+        tuple: (reportes enfriados, bytes de datos sacados de la base)
+    """
+    # El orden LRU se decide con los usos de todos los workers
+    almacen.volcar_accesos()
+    if not PRESUPUESTO_REPORTES_BYTES and not EDAD_MAXIMA_CALIENTE:
+        return 0, 0
+
+    exceso = 0
+    if PRESUPUESTO_REPORTES_BYTES:
+        _, calientes = almacen.bytes_calientes()
+        exceso = max(calientes - PRESUPUESTO_REPORTES_BYTES, 0)
+    accedido_antes = None
+    if EDAD_MAXIMA_CALIENTE:
+        accedido_antes = (
+            datetime.now() - timedelta(seconds=EDAD_MAXIMA_CALIENTE)
+        ).isoformat()
+
+    enfriados = 0
+    liberados = 0
+    for reporte_id in almacen.reportes_para_enfriar(exceso, accedido_antes):
+        tamano = almacen.enfriar_reporte(reporte_id)
+        if tamano:
+            enfriados += 1
+            liberados += tamano
+    if enfriados:
+        print(
+            f"[+] Retención: {enfriados} reportes ({liberados} bytes) "
+            f"comprimidos en {almacen.CARPETA_REPORTES_FRIOS}"
+        )
+    return enfriados, liberados
+
+
+def bucle_retencion():
+    """Aplica la retención cada INTERVALO_RETENCION segundos"""
+    while True:
+        time.sleep(INTERVALO_RETENCION)
+        try:
+            aplicar_retencion()
+        except Exception as e:
+            print(f"[!] Error al aplicar la retención de reportes: {e}")
+
+
+def iniciar_retencion():
+    """Arranca la retención periódica de reportes de este worker"""
+    global hilo_retencion
+    with lock_retencion:
+        if hilo_retencion is not None:
+            return
+        hilo_retencion = threading.Thread(target=bucle_retencion, name="retencion")
+        hilo_retencion.daemon = True
+        hilo_retencion.start()
+
+
+def estado():
+    """Límites configurados y reportes calientes, fríos y en memoria"""
+    return {
+        "presupuesto_bytes": PRESUPUESTO_REPORTES_BYTES,
+        "edad_maxima_caliente": EDAD_MAXIMA_CALIENTE,
+        "memoria_maxima_bytes": almacen.MEMORIA_ESCANEOS_CACHE,
+        "carpeta_frios": almacen.CARPETA_REPORTES_FRIOS,
+        "reportes": almacen.resumen_retencion(),
+    }
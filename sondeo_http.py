@@ -0,0 +1,686 @@
+"""
+Sondeo HTTP/HTTPS nativo
+Sustituye a los scripts NSE http-title, http-headers y ssl-cert: después del
+escaneo de puertos se conecta con asyncio a los puertos abiertos en los que
+nmap ejecutaría esos scripts, reutiliza la misma conexión para el HEAD y el
+GET y deja la salida en la sección "script" de cada puerto con el formato de
+nmap; NSE solo hace falta para los scripts que no se cubren aquí
+"""
+
+import asyncio
+import functools
+import hashlib
+import html
+import ipaddress
+import os
+import re
+import ssl
+import time
+from urllib.parse import urljoin, urlsplit
+
+# Configuración
+SONDEO_HTTP_NATIVO = os.environ.get("SONDEO_HTTP_NATIVO", "1") != "0"
+SONDAS_HTTP_SIMULTANEAS = int(os.environ.get("SONDAS_HTTP_SIMULTANEAS", 64))
+TIMEOUT_SONDA_HTTP = float(os.environ.get("TIMEOUT_SONDA_HTTP", 5))
+MAX_CUERPO_HTTP = int(os.environ.get("MAX_CUERPO_HTTP", 256 * 1024))
+MAX_REDIRECCIONES_HTTP = int(os.environ.get("MAX_REDIRECCIONES_HTTP", 2))
+
+SCRIPTS_NATIVOS = ("http-title", "http-headers", "ssl-cert")
+AGENTE_HTTP = "Mozilla/5.0 (compatible; escaner-puertos)"
+
+# Puertos y servicios en los que nmap ejecuta los scripts http-* y ssl-*
+# (shortport.http y shortport.ssl)
+PUERTOS_HTTP = {80, 443, 631, 3872, 5800, 7080, 8000, 8080, 8088, 8180, 8443}
+SERVICIOS_HTTP = {
+    "http",
+    "https",
+    "ipp",
+    "http-alt",
+    "https-alt",
+    "vnc-http",
+    "oem-agent",
+    "soap",
+    "http-proxy",
+    "caldav",
+    "carddav",
+    "webdav",
+}
+PUERTOS_SSL = {
+    261,
+    271,
+    324,
+    443,
+    465,
+    563,
+    585,
+    636,
+    853,
+    989,
+    990,
+    992,
+    993,
+    994,
+    995,
+    2221,
+    2252,
+    2376,
+    3269,
+    3389,
+    4433,
+    4911,
+    5061,
+    5986,
+    6679,
+    6697,
+    8443,
+    8883,
+    9001,
+}
+SERVICIOS_SSL = {
+    "https",
+    "https-alt",
+    "ftps",
+    "ftps-data",
+    "imaps",
+    "pop3s",
+    "ldapssl",
+    "smtps",
+    "ssmtp",
+    "nntps",
+    "ircs",
+    "sip-tls",
+    "xmpps",
+}
+
+# Nombres de los OID que aparecen en el resumen del certificado
+ATRIBUTOS_NOMBRE = {
+    "2.5.4.3": "commonName",
+    "2.5.4.5": "serialNumber",
+    "2.5.4.6": "countryName",
+    "2.5.4.7": "localityName",
+    "2.5.4.8": "stateOrProvinceName",
+    "2.5.4.10": "organizationName",
+    "2.5.4.11": "organizationalUnitName",
+    "1.2.840.113549.1.9.1": "emailAddress",
+}
+ALGORITMOS_CLAVE = {
+    "1.2.840.113549.1.1.1": "rsa",
+    "1.2.840.10045.2.1": "ec",
+    "1.2.840.10040.4.1": "dsa",
+    "1.3.101.112": "ed25519",
+    "1.3.101.113": "ed448",
+}
+BITS_CURVA = {
+    "1.2.840.10045.3.1.7": 256,
+    "1.3.132.0.34": 384,
+    "1.3.132.0.35": 521,
+    "1.3.101.112": 256,
+    "1.3.101.113": 456,
+}
+ALGORITMOS_FIRMA = {
+    "1.2.840.113549.1.1.4": "md5WithRSAEncryption",
+    "1.2.840.113549.1.1.5": "sha1WithRSAEncryption",
+    "1.2.840.113549.1.1.10": "rsassaPss",
+    "1.2.840.113549.1.1.11": "sha256WithRSAEncryption",
+    "1.2.840.113549.1.1.12": "sha384WithRSAEncryption",
+    "1.2.840.113549.1.1.13": "sha512WithRSAEncryption",
+    "1.2.840.10045.4.1": "ecdsa-with-SHA1",
+    "1.2.840.10045.4.3.2": "ecdsa-with-SHA256",
+    "1.2.840.10045.4.3.3": "ecdsa-with-SHA384",
+    "1.2.840.10045.4.3.4": "ecdsa-with-SHA512",
+    "1.3.101.112": "ED25519",
+    "1.3.101.113": "ED448",
+}
+OID_NOMBRES_ALTERNATIVOS = "2.5.29.17"
+
+TITULO = re.compile(rb"<title[^>]*>(.*?)</title\s*>", re.IGNORECASE | re.DOTALL)
+CHARSET = re.compile(r"charset=[\"']?([\w.:-]+)", re.IGNORECASE)
+
+
+def separar_scripts(args_nmap):
+    """
+    Quita de --script los scripts que se sondean de forma nativa
+
+    Si no queda ningún script se quitan --script y --script-args; las
+    categorías y comodines (default, http-*) se dejan enteros a NSE
+
+    Returns:
+        tuple: (argumentos para nmap, scripts nativos pedidos)
+    """
+    argumentos = []
+    nativos = []
+    restantes = None
+    for anterior, arg in zip([None] + list(args_nmap), args_nmap):
+        if anterior == "--script" or arg.startswith("--script="):
+            valor = arg.split("=", 1)[1] if anterior != "--script" else arg
+            restantes = []
+            for script in valor.split(","):
+                if script.strip() in SCRIPTS_NATIVOS:
+                    nativos.append(script.strip())
+                elif script.strip():
+                    restantes.append(script.strip())
+            if restantes:
+                argumentos.extend(["--script", ",".join(restantes)])
+        elif arg != "--script":
+            argumentos.append(arg)
+
+    if restantes == []:
+        # Sin scripts, --script-args no sirve de nada
+        sin_argumentos = []
+        saltar = False
+        for arg in argumentos:
+            if saltar:
+                saltar = False
+            elif arg == "--script-args":
+                saltar = True
+            elif not arg.startswith("--script-args="):
+                sin_argumentos.append(arg)
+        argumentos = sin_argumentos
+    return argumentos, nativos
+
+
+def es_http(puerto, info):
+    """Indica si nmap ejecutaría los scripts http-* en un puerto"""
+    return puerto in PUERTOS_HTTP or info.get("name") in SERVICIOS_HTTP
+
+
+def es_ssl(puerto, info):
+    """Indica si un puerto habla TLS desde el principio"""
+    return puerto in PUERTOS_SSL or info.get("name") in SERVICIOS_SSL
+
+
+# === CERTIFICADOS ===
+
+
+def _tlv(datos, posicion=0):
+    """Lee un elemento DER: (etiqueta, contenido, posición siguiente)"""
+    etiqueta = datos[posicion]
+    longitud = datos[posicion + 1]
+    posicion += 2
+    if longitud & 0x80:
+        bytes_longitud = longitud & 0x7F
+        longitud = int.from_bytes(datos[posicion : posicion + bytes_longitud], "big")
+        posicion += bytes_longitud
+    if posicion + longitud > len(datos):
+        raise ValueError("Elemento DER truncado")
+    return etiqueta, datos[posicion : posicion + longitud], posicion + longitud
+
+
+def _elementos(datos):
+    """Elementos DER consecutivos de una secuencia o un conjunto"""
+    elementos = []
+    posicion = 0
+    while posicion < len(datos):
+        etiqueta, contenido, posicion = _tlv(datos, posicion)
+        elementos.append((etiqueta, contenido))
+    return elementos
+
+
+def _oid(contenido):
+    """Identificador de objeto DER en notación de puntos"""
+    primero = min(contenido[0] // 40, 2)
+    partes = [primero, contenido[0] - 40 * primero]
+    valor = 0
+    for byte in contenido[1:]:
+        valor = (valor << 7) | (byte & 0x7F)
+        if not byte & 0x80:
+            partes.append(valor)
+            valor = 0
+    return ".".join(str(parte) for parte in partes)
+
+
+def _texto(etiqueta, contenido):
+    """Cadena DER (BMPString en UTF-16, el resto en UTF-8)"""
+    if etiqueta == 0x1E:
+        return contenido.decode("utf-16-be", errors="replace")
+    return contenido.decode("utf-8", errors="replace")
+
+
+def _nombre_distinguido(contenido):
+    """Nombre de un certificado como lo escribe nmap (commonName=x/...)"""
+    partes = []
+    for _, conjunto in _elementos(contenido):
+        for _, atributo in _elementos(conjunto):
+            (_, oid), (etiqueta, valor) = _elementos(atributo)[:2]
+            oid = _oid(oid)
+            partes.append(f"{ATRIBUTOS_NOMBRE.get(oid, oid)}={_texto(etiqueta, valor)}")
+    return "/".join(partes)
+
+
+def _fecha(etiqueta, contenido):
+    """UTCTime o GeneralizedTime como fecha ISO"""
+    texto = contenido.decode("ascii").rstrip("Z")
+    if etiqueta == 0x17:
+        # UTCTime: los años 50-99 son del siglo XX (RFC 5280)
+        texto = ("19" if int(texto[:2]) >= 50 else "20") + texto
+    return (
+        f"{texto[0:4]}-{texto[4:6]}-{texto[6:8]}T"
+        f"{texto[8:10]}:{texto[10:12]}:{texto[12:14] or '00'}"
+    )
+
+
+def _nombres_alternativos(contenido):
+    """Entradas de la extensión subjectAltName"""
+    nombres = []
+    for etiqueta, valor in _elementos(contenido):
+        if etiqueta == 0x82:
+            nombres.append(f"DNS:{valor.decode('ascii', errors='replace')}")
+        elif etiqueta == 0x87:
+            nombres.append(f"IP Address:{ipaddress.ip_address(valor)}")
+        elif etiqueta == 0x81:
+            nombres.append(f"email:{valor.decode('ascii', errors='replace')}")
+        elif etiqueta == 0x86:
+            nombres.append(f"URI:{valor.decode('ascii', errors='replace')}")
+    return nombres
+
+
+def _huella(algoritmo, der):
+    """Resumen del certificado en grupos de cuatro cifras, como nmap"""
+    digest = hashlib.new(algoritmo, der).hexdigest()
+    return " ".join(digest[i : i + 4] for i in range(0, len(digest), 4))
+
+
+def resumen_certificado(der):
+    """
+    Salida del script ssl-cert a partir del certificado en DER
+
+    Returns:
+        str: Sujeto, nombres alternativos, emisor, clave, firma, validez y
+             huellas MD5 y SHA-1
+    """
+    lineas = []
+    try:
+        _, certificado, _ = _tlv(der)
+        (_, datos), (_, firma) = _elementos(certificado)[:2]
+        campos = _elementos(datos)
+        if campos[0][0] == 0xA0:
+            # Versión explícita (v3)
+            campos = campos[1:]
+        emisor, validez, sujeto, clave = (contenido for _, contenido in campos[2:6])
+        extensiones = next((c for etiqueta, c in campos[6:] if etiqueta == 0xA3), None)
+
+        lineas.append(f"Subject: {_nombre_distinguido(sujeto)}")
+        if extensiones:
+            for _, extension in _elementos(_tlv(extensiones)[1]):
+                partes = _elementos(extension)
+                if _oid(partes[0][1]) == OID_NOMBRES_ALTERNATIVOS:
+                    nombres = _nombres_alternativos(_tlv(partes[-1][1])[1])
+                    lineas.append(f"Subject Alternative Name: {', '.join(nombres)}")
+        lineas.append(f"Issuer: {_nombre_distinguido(emisor)}")
+
+        (_, algoritmo), (_, bits_clave) = _elementos(clave)[:2]
+        algoritmo = _elementos(algoritmo)
+        oid_clave = _oid(algoritmo[0][1])
+        lineas.append(f"Public Key type: {ALGORITMOS_CLAVE.get(oid_clave, oid_clave)}")
+        bits = None
+        if oid_clave == "1.2.840.113549.1.1.1":
+            # La clave RSA es una secuencia (módulo, exponente) dentro del BIT STRING
+            _, modulo = _elementos(_tlv(bits_clave[1:])[1])[0]
+            bits = int.from_bytes(modulo, "big").bit_length()
+        elif len(algoritmo) > 1 and algoritmo[1][0] == 0x06:
+            bits = BITS_CURVA.get(_oid(algoritmo[1][1]))
+        else:
+            bits = BITS_CURVA.get(oid_clave)
+        if bits:
+            lineas.append(f"Public Key bits: {bits}")
+        oid_firma = _oid(_elementos(firma)[0][1])
+        lineas.append(
+            f"Signature Algorithm: {ALGORITMOS_FIRMA.get(oid_firma, oid_firma)}"
+        )
+
+        (inicio, desde), (fin, hasta) = _elementos(validez)[:2]
+        lineas.append(f"Not valid before: {_fecha(inicio, desde)}")
+        lineas.append(f"Not valid after:  {_fecha(fin, hasta)}")
+    except (ValueError, IndexError, TypeError):
+        # Certificado que no se sabe interpretar: al menos sus huellas
+        lineas.append("Certificado no interpretable")
+    lineas.append(f"MD5:   {_huella('md5', der)}")
+    lineas.append(f"SHA-1: {_huella('sha1', der)}")
+    return "\n".join(lineas)
+
+
+# === HTTP ===
+
+
+@functools.lru_cache(maxsize=None)
+def _contexto_tls():
+    """Contexto TLS que acepta cualquier certificado (solo se inspecciona)"""
+    contexto = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+    contexto.check_hostname = False
+    contexto.verify_mode = ssl.CERT_NONE
+    try:
+        # Los servicios antiguos todavía usan claves y cifrados débiles
+        contexto.set_ciphers("DEFAULT:@SECLEVEL=0")
+    except ssl.SSLError:
+        pass
+    return contexto
+
+
+def _cabecera(cabeceras, nombre):
+    """Valor de una cabecera (sin distinguir mayúsculas), o cadena vacía"""
+    for clave, valor in cabeceras:
+        if clave.lower() == nombre:
+            return valor
+    return ""
+
+
+async def _leer_hasta_cierre(lector, limite):
+    """Lee hasta que el servidor cierra la conexión o se llega al límite"""
+    cuerpo = b""
+    while len(cuerpo) < limite:
+        bloque = await lector.read(limite - len(cuerpo))
+        if not bloque:
+            break
+        cuerpo += bloque
+    return cuerpo
+
+
+async def _leer_respuesta(lector, sin_cuerpo):
+    """
+    Lee una respuesta HTTP/1.x
+
+    Returns:
+        tuple: (código, cabeceras [(nombre, valor)], cuerpo (a lo sumo
+                MAX_CUERPO_HTTP bytes), si la conexión se puede reutilizar)
+    """
+    linea = await lector.readline()
+    if not linea.startswith(b"HTTP/"):
+        raise ValueError("Respuesta no HTTP")
+    version, codigo = linea.decode("latin-1").split(None, 2)[:2]
+    codigo = int(codigo)
+    cabeceras = []
+    while True:
+        linea = await lector.readline()
+        if linea in (b"\r\n", b"\n", b""):
+            break
+        nombre, _, valor = linea.decode("latin-1").partition(":")
+        cabeceras.append((nombre.strip(), valor.strip()))
+
+    conexion = _cabecera(cabeceras, "connection").lower()
+    reutilizable = (
+        "close" not in conexion if version == "HTTP/1.1" else "keep-alive" in conexion
+    )
+    if sin_cuerpo or codigo in (204, 304) or codigo < 200:
+        return codigo, cabeceras, b"", reutilizable
+
+    cuerpo = b""
+    if "chunked" in _cabecera(cabeceras, "transfer-encoding").lower():
+        while True:
+            tamano = int((await lector.readline()).split(b";")[0].strip() or b"0", 16)
+            if tamano == 0:
+                while (await lector.readline()) not in (b"\r\n", b"\n", b""):
+                    pass
+                break
+            if len(cuerpo) + tamano > MAX_CUERPO_HTTP:
+                cuerpo += await lector.readexactly(MAX_CUERPO_HTTP - len(cuerpo))
+                reutilizable = False
+                break
+            cuerpo += await lector.readexactly(tamano)
+            await lector.readline()
+    elif _cabecera(cabeceras, "content-length").isdigit():
+        longitud = int(_cabecera(cabeceras, "content-length"))
+        cuerpo = await lector.readexactly(min(longitud, MAX_CUERPO_HTTP))
+        reutilizable = reutilizable and longitud <= MAX_CUERPO_HTTP
+    else:
+        cuerpo = await _leer_hasta_cierre(lector, MAX_CUERPO_HTTP)
+        reutilizable = False
+    return codigo, cabeceras, cuerpo, reutilizable
+
+
+class _Conexion:
+    """Conexión persistente a un puerto, en claro o con TLS"""
+
+    def __init__(self, direccion, puerto, nombre, tls):
+        self.direccion = direccion
+        self.puerto = puerto
+        self.nombre = nombre
+        self.tls = tls
+        self.lector = None
+        self.escritor = None
+        self.certificado = None
+
+    async def abrir(self):
+        self.lector, self.escritor = await asyncio.wait_for(
+            asyncio.open_connection(
+                self.direccion,
+                self.puerto,
+                ssl=_contexto_tls() if self.tls else None,
+                server_hostname=self.nombre if self.tls else None,
+            ),
+            TIMEOUT_SONDA_HTTP,
+        )
+        if self.tls and self.certificado is None:
+            objeto_ssl = self.escritor.get_extra_info("ssl_object")
+            self.certificado = objeto_ssl.getpeercert(binary_form=True)
+
+    async def pedir(self, metodo, ruta):
+        """Envía una petición, reabriendo la conexión si el servidor la cerró"""
+        if self.escritor is None:
+            await self.abrir()
+        anfitrion = f"[{self.nombre}]" if ":" in self.nombre else self.nombre
+        if self.puerto != (443 if self.tls else 80):
+            anfitrion += f":{self.puerto}"
+        self.escritor.write(
+            f"{metodo} {ruta} HTTP/1.1\r\n"
+            f"Host: {anfitrion}\r\n"
+            f"User-Agent: {AGENTE_HTTP}\r\n"
+            "Accept: */*\r\n"
+            "Connection: keep-alive\r\n\r\n".encode("latin-1")
+        )
+        await self.escritor.drain()
+        codigo, cabeceras, cuerpo, reutilizable = await asyncio.wait_for(
+            _leer_respuesta(self.lector, metodo == "HEAD"), TIMEOUT_SONDA_HTTP
+        )
+        if not reutilizable:
+            await self.cerrar()
+        return codigo, cabeceras, cuerpo
+
+    async def cerrar(self):
+        if self.escritor is None:
+            return
+        escritor, self.escritor = self.escritor, None
+        escritor.close()
+        try:
+            await escritor.wait_closed()
+        except (OSError, ssl.SSLError):
+            pass
+
+    def ruta_local(self, ubicacion, ruta_actual):
+        """Ruta de una redirección al mismo servicio, o None si sale de él"""
+        destino = urlsplit(urljoin(ruta_actual, ubicacion))
+        if destino.netloc:
+            esquema = "https" if self.tls else "http"
+            puerto = destino.port or (443 if destino.scheme == "https" else 80)
+            if (
+                destino.scheme != esquema
+                or destino.hostname not in (self.nombre, self.direccion)
+                or puerto != self.puerto
+            ):
+                return None
+        ruta = destino.path or "/"
+        return f"{ruta}?{destino.query}" if destino.query else ruta
+
+
+def _titulo(cabeceras, cuerpo):
+    """Salida de http-title para el cuerpo de una respuesta"""
+    tipo = _cabecera(cabeceras, "content-type")
+    encontrado = TITULO.search(cuerpo)
+    if not encontrado or not encontrado.group(1).strip():
+        return (
+            f"Site doesn't have a title ({tipo})."
+            if tipo
+            else ("Site doesn't have a title.")
+        )
+    charset = CHARSET.search(tipo)
+    try:
+        texto = encontrado.group(1).decode(charset.group(1) if charset else "utf-8")
+    except (LookupError, UnicodeDecodeError):
+        texto = encontrado.group(1).decode("latin-1")
+    return " ".join(html.unescape(texto).split())
+
+
+async def _sondear_http(conexion, scripts):
+    """Ejecuta http-headers y http-title sobre una conexión"""
+    salidas = {}
+    tipo_peticion = "HEAD"
+    codigo, cabeceras, _ = await conexion.pedir("HEAD", "/")
+    if codigo in (405, 501):
+        # Servidores que no admiten HEAD: las cabeceras salen del GET
+        tipo_peticion = "GET"
+
+    if "http-title" in scripts or tipo_peticion == "GET":
+        ruta = "/"
+        redirigido = None
+        for _ in range(MAX_REDIRECCIONES_HTTP + 1):
+            codigo, cabeceras_get, cuerpo = await conexion.pedir("GET", ruta)
+            if tipo_peticion == "GET" and redirigido is None:
+                cabeceras = cabeceras_get
+            ubicacion = _cabecera(cabeceras_get, "location")
+            if not (300 <= codigo < 400 and ubicacion):
+                break
+            siguiente = conexion.ruta_local(ubicacion, ruta)
+            if siguiente is None:
+                salidas["http-title"] = f"Did not follow redirect to {ubicacion}"
+                break
+            ruta = redirigido = siguiente
+        if "http-title" in scripts and "http-title" not in salidas:
+            titulo = _titulo(cabeceras_get, cuerpo)
+            if redirigido:
+                titulo += f"\nRequested resource was {redirigido}"
+            salidas["http-title"] = titulo
+
+    if "http-headers" in scripts:
+        lineas = [f"  {nombre}: {valor}" for nombre, valor in cabeceras]
+        lineas += ["  ", f"  (Request type: {tipo_peticion})"]
+        salidas["http-headers"] = "\n" + "\n".join(lineas) + "\n"
+    return salidas
+
+
+async def _sondear_puerto(direccion, nombre, puerto, info, scripts):
+    """Salida de los scripts nativos que aplican a un puerto abierto"""
+    http = es_http(puerto, info) and (
+        "http-title" in scripts or "http-headers" in scripts
+    )
+    tls = es_ssl(puerto, info)
+    if not http and not (tls and "ssl-cert" in scripts):
+        return {}
+
+    # Si el modo esperado falla se prueba el otro (HTTPS en un puerto HTTP...)
+    for modo in (tls, not tls) if http else (True,):
+        conexion = _Conexion(direccion, puerto, nombre, modo)
+        salidas = {}
+        try:
+            if http:
+                salidas = await _sondear_http(conexion, scripts)
+            else:
+                await conexion.abrir()
+        except (OSError, EOFError, ValueError, asyncio.TimeoutError):
+            continue
+        finally:
+            await conexion.cerrar()
+        if conexion.certificado and "ssl-cert" in scripts:
+            salidas["ssl-cert"] = resumen_certificado(conexion.certificado)
+        return salidas
+    return {}
+
+
+async def _sondear_todos(pendientes, scripts, cancelacion):
+    """Sondea los puertos pendientes con concurrencia limitada"""
+    semaforo = asyncio.Semaphore(SONDAS_HTTP_SIMULTANEAS)
+
+    async def sondear(direccion, nombre, puerto, info):
+        async with semaforo:
+            # Con la cancelación no empiezan sondas nuevas; las abiertas
+            # terminan como mucho en TIMEOUT_SONDA_HTTP
+            if cancelacion is not None and cancelacion.is_set():
+                return
+            salidas = await _sondear_puerto(direccion, nombre, puerto, info, scripts)
+        for script, salida in salidas.items():
+            # La salida de NSE (p. ej. con -A) tiene preferencia
+            info.setdefault("script", {}).setdefault(script, salida)
+
+    await asyncio.gather(*(sondear(*pendiente) for pendiente in pendientes))
+
+
+def nombre_host(direccion, datos):
+    """Host y SNI de las sondas: el nombre que dio el usuario, como hace nmap"""
+    return next(
+        (
+            h["name"]
+            for h in datos.get("hostnames", ())
+            if h.get("type") == "user" and h.get("name")
+        ),
+        direccion,
+    )
+
+
+def pendientes_modelo(host, nombre):
+    """
+    Puertos TCP abiertos de un modelo.Host que se pueden sondear
+
+    Returns:
+        list: (direccion, nombre, puerto, info, Puerto) para sondear_modelo;
+              info lleva el servicio y la salida que ya dio NSE
+    """
+    if host.estado != "up":
+        return []
+    return [
+        (
+            host.direccion,
+            nombre,
+            puerto.numero,
+            {"name": puerto.servicio, "script": dict(puerto.scripts)},
+            puerto,
+        )
+        for puerto in host.puertos
+        if puerto.protocolo == "tcp" and puerto.estado == "open"
+    ]
+
+
+def sondear_modelo(pendientes, scripts, cancelacion=None):
+    """
+    Como sondear, sobre los puertos de hosts ya convertidos al modelo (los
+    de pendientes_modelo), para escaneos que no guardan el resultado de
+    python-nmap
+
+    Returns:
+        dict: puertos sondeados y segundos empleados
+    """
+    inicio = time.time()
+    if pendientes and scripts:
+        asyncio.run(
+            _sondear_todos(
+                [pendiente[:4] for pendiente in pendientes], scripts, cancelacion
+            )
+        )
+        for _, _, _, info, puerto in pendientes:
+            if len(info["script"]) != len(puerto.scripts):
+                puerto.scripts = tuple(info["script"].items())
+    return {"puertos": len(pendientes), "segundos": round(time.time() - inicio, 2)}
+
+
+def sondear(resultado, scripts, cancelacion=None):
+    """
+    Ejecuta los scripts nativos sobre los puertos TCP abiertos de un
+    resultado de python-nmap y añade su salida a la sección "script"
+
+    Args:
+        resultado (dict): Resultado de python-nmap (se modifica)
+        scripts (list): Scripts nativos pedidos (ver SCRIPTS_NATIVOS)
+        cancelacion (threading.Event): Si se activa no se inician más sondas
+
+    Returns:
+        dict: puertos sondeados y segundos empleados
+    """
+    inicio = time.time()
+    pendientes = []
+    for direccion, datos in resultado.get("scan", {}).items():
+        if datos.get("status", {}).get("state") != "up":
+            continue
+        nombre = nombre_host(direccion, datos)
+        for puerto, info in datos.get("tcp", {}).items():
+            if info.get("state") == "open":
+                pendientes.append((direccion, nombre, puerto, info))
+    if pendientes and scripts:
+        asyncio.run(_sondear_todos(pendientes, scripts, cancelacion))
+    return {"puertos": len(pendientes), "segundos": round(time.time() - inicio, 2)}
@@ -0,0 +1,121 @@
+"""
+Pruebas del motor asyncio contra puertos locales de 127.0.0.1
+"""
+
+import asyncio
+import socket
+
+import pytest
+
+import motor_asyncio
+
+
+@pytest.fixture
+def puerto_abierto():
+    """Puerto de 127.0.0.1 con un socket escuchando"""
+    servidor = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    servidor.bind(("127.0.0.1", 0))
+    servidor.listen(16)
+    yield servidor.getsockname()[1]
+    servidor.close()
+
+
+@pytest.fixture
+def puerto_cerrado():
+    """Puerto de 127.0.0.1 sin nadie escuchando"""
+    libre = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    libre.bind(("127.0.0.1", 0))
+    puerto = libre.getsockname()[1]
+    libre.close()
+    return puerto
+
+
+@pytest.fixture
+def conexiones_colgadas(monkeypatch):
+    """Hace que ninguna conexión responda y cuenta los intentos"""
+    intentos = []
+
+    async def conectar(direccion, puerto):
+        intentos.append((direccion, puerto))
+        await asyncio.sleep(3600)
+
+    monkeypatch.setattr(asyncio, "open_connection", conectar)
+    return intentos
+
+
+def test_puerto_abierto_y_cerrado(puerto_abierto, puerto_cerrado):
+    resultado = motor_asyncio.ejecutar_escaneo_conexion(
+        "127.0.0.1", f"-sT -T4 -p {puerto_abierto},{puerto_cerrado}"
+    )
+
+    tcp = resultado["scan"]["127.0.0.1"]["tcp"]
+    assert tcp[puerto_abierto]["state"] == "open"
+    assert tcp[puerto_abierto]["reason"] == "syn-ack"
+    assert tcp[puerto_cerrado]["state"] == "closed"
+    assert tcp[puerto_cerrado]["reason"] == "conn-refused"
+    assert resultado["nmap"]["scanstats"]["uphosts"] == "1"
+    assert "parcial" not in resultado["nmap"]
+
+
+def test_eventos_del_host(puerto_abierto):
+    eventos = []
+    motor_asyncio.ejecutar_escaneo_conexion(
+        "127.0.0.1",
+        f"-sT -p {puerto_abierto}",
+        lambda tipo, datos: eventos.append((tipo, datos)),
+    )
+
+    hosts = [datos for tipo, datos in eventos if tipo == "host"]
+    assert [p["puerto"] for p in hosts[0]["puertos"]] == [puerto_abierto]
+
+
+def test_reintentos_sin_respuesta(conexiones_colgadas):
+    resultado = motor_asyncio.ejecutar_escaneo_conexion(
+        "127.0.0.1", "-sT -Pn -T5 --max-retries 2 -p 9"
+    )
+
+    # Un intento y dos reintentos, cada uno cortado por el timeout de -T5
+    assert len(conexiones_colgadas) == 3
+    puerto = resultado["scan"]["127.0.0.1"]["tcp"][9]
+    assert (puerto["state"], puerto["reason"]) == ("filtered", "no-response")
+
+
+def test_host_sin_respuesta_se_descarta(conexiones_colgadas):
+    resultado = motor_asyncio.ejecutar_escaneo_conexion(
+        "127.0.0.1", "-sT -T5 --max-retries 0 -p 9"
+    )
+
+    assert resultado["scan"] == {}
+    assert resultado["nmap"]["scanstats"]["downhosts"] == "1"
+
+
+def test_timeout_de_host(conexiones_colgadas):
+    resultado = motor_asyncio.ejecutar_escaneo_conexion(
+        "127.0.0.1", "-sT -Pn -T3 --host-timeout 200ms -p 9"
+    )
+
+    # Como nmap: el host que agota --host-timeout no aparece en el resultado
+    assert resultado["scan"] == {}
+    assert len(conexiones_colgadas) == 1
+
+
+def test_interpretar_argumentos():
+    config = motor_asyncio.interpretar_argumentos(
+        "-sT -T5 --max-retries 1 --host-timeout 2s --max-rate 100 -p 80,443 -Pn"
+    )
+
+    assert config["puertos"] == "80,443"
+    assert config["timeout"] == motor_asyncio.PLANTILLAS_TIEMPO[5][0]
+    assert config["reintentos"] == 1
+    assert config["timeout_host"] == 2
+    assert config["tasa_maxima"] == 100
+    assert config["sin_ping"] is True
+
+
+@pytest.mark.parametrize(
+    "argumentos",
+    ["-sS -p 80", "-sT -O -p 80", "-sT -p", "-sT -p T:80,U:53", "-sT -p http"],
+)
+def test_interpretar_argumentos_rechaza(argumentos):
+    with pytest.raises(ValueError):
+        motor_asyncio.interpretar_argumentos(argumentos)
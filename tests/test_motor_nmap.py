@@ -0,0 +1,113 @@
+"""
+Pruebas de la ejecución de nmap con un sustituto que se comporta como el
+real al detenerlo: captura SIGTERM, limpia y sale con 1
+"""
+
+import stat
+import sys
+import textwrap
+import threading
+
+import nmap
+import pytest
+
+import fragmentos
+import motor_nmap
+
+SUSTITUTO = textwrap.dedent("""\
+    import signal, sys, time
+
+    def al_terminar(senal, marco):
+        sys.stderr.write("caught SIGTERM signal, cleaning up\\n")
+        sys.exit(1)
+
+    signal.signal(signal.SIGTERM, al_terminar)
+    if "fallo" in sys.argv:
+        sys.stderr.write("Failed to resolve fallo\\n")
+        sys.exit(1)
+    print('<?xml version="1.0"?>')
+    print('<nmaprun scanner="nmap" args="nmap {args}" start="0">')
+    print('<scaninfo type="connect" protocol="tcp" numservices="1" services="80"/>')
+    print('<host starttime="0" endtime="0"><status state="up" reason="syn-ack"/>')
+    print('<address addr="10.0.0.1" addrtype="ipv4"/><ports>')
+    print('<port protocol="tcp" portid="80"><state state="open" reason="syn-ack"/>')
+    print('<service name="http"/></port></ports></host>', flush=True)
+    time.sleep(60)
+    """)
+
+
+@pytest.fixture
+def sustituto(tmp_path, monkeypatch):
+    """nmap de prueba: escribe un host y espera hasta que lo detengan"""
+    ruta = tmp_path / "nmap"
+    ruta.write_text(f"#!{sys.executable}\n" + SUSTITUTO)
+    ruta.chmod(ruta.stat().st_mode | stat.S_IXUSR)
+    monkeypatch.setattr(motor_nmap, "RUTA_NMAP", str(ruta))
+    monkeypatch.setattr(motor_nmap, "detenidos", {})
+    return ruta
+
+
+def test_detenido_conserva_hosts_aunque_salga_con_1(sustituto):
+    primer_host = threading.Event()
+    pids = []
+
+    def al_evento(tipo, datos):
+        if tipo == "proceso":
+            pids.append(datos["pid"])
+        elif tipo == "host":
+            primer_host.set()
+
+    resultado = {}
+    hilo = threading.Thread(
+        target=lambda: resultado.update(
+            motor_nmap.ejecutar_nmap("10.0.0.1", "-sT -p 80", al_evento)
+        )
+    )
+    hilo.start()
+    assert primer_host.wait(10)
+    motor_nmap.terminar_procesos(pids, gracia=10)
+    hilo.join(10)
+
+    assert not hilo.is_alive()
+    assert resultado["nmap"]["parcial"] is True
+    assert resultado["scan"]["10.0.0.1"]["tcp"][80]["state"] == "open"
+    assert pids[0] not in motor_nmap.detenidos
+
+
+def test_salida_con_error_sin_detener_falla(sustituto):
+    with pytest.raises(nmap.PortScannerError, match="Failed to resolve"):
+        motor_nmap.ejecutar_nmap("fallo", "-sT -p 80")
+
+
+def test_detenido_en_el_pool_de_fragmentos(sustituto, monkeypatch):
+    # Los procesos del pool leen RUTA_NMAP al importar motor_nmap
+    monkeypatch.setenv("RUTA_NMAP", str(sustituto))
+    monkeypatch.setattr(fragmentos, "pool_fragmentos", None)
+    primer_host = threading.Event()
+    pids = []
+
+    def al_evento(subescaneo, tipo, datos):
+        if tipo == "proceso":
+            pids.append(datos["pid"])
+        elif tipo == "host":
+            primer_host.set()
+
+    subescaneos = [{"objetivos": "10.0.0.1", "argumentos": "-sT -p 80"}]
+    completados = []
+    hilo = threading.Thread(
+        target=lambda: completados.extend(
+            fragmentos.ejecutar_subescaneos(subescaneos, al_evento=al_evento)
+        )
+    )
+    hilo.start()
+    try:
+        assert primer_host.wait(30)
+        motor_nmap.terminar_procesos(pids, gracia=10)
+        hilo.join(30)
+    finally:
+        fragmentos.pool_fragmentos.shutdown()
+        fragmentos.gestor_pool.shutdown()
+
+    ((_, resultado),) = completados
+    assert resultado["nmap"]["parcial"] is True
+    assert "10.0.0.1" in resultado["scan"]
@@ -0,0 +1,184 @@
+"""
+Pruebas de los avisos de fin de escaneo contra un receptor HTTP local
+"""
+
+import hashlib
+import hmac
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import notificaciones
+
+
+class Receptor(BaseHTTPRequestHandler):
+    """Guarda cada aviso recibido y responde con el siguiente código de la lista"""
+
+    def do_POST(self):
+        cuerpo = self.rfile.read(int(self.headers["Content-Length"]))
+        servidor = self.server
+        with servidor.lock:
+            servidor.recibidos.append((dict(self.headers), cuerpo))
+            codigo = servidor.codigos.pop(0) if servidor.codigos else 200
+        self.send_response(codigo)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, formato, *args):
+        pass
+
+
+@pytest.fixture
+def receptor():
+    """Servidor HTTP en 127.0.0.1; sus códigos de respuesta se ponen en .codigos"""
+    servidor = ThreadingHTTPServer(("127.0.0.1", 0), Receptor)
+    servidor.lock = threading.Lock()
+    servidor.recibidos = []
+    servidor.codigos = []
+    servidor.url = f"http://127.0.0.1:{servidor.server_address[1]}/aviso"
+    hilo = threading.Thread(target=servidor.serve_forever, args=(0.05,), daemon=True)
+    hilo.start()
+    yield servidor
+    servidor.shutdown()
+    servidor.server_close()
+
+
+@pytest.fixture(autouse=True)
+def avisos(monkeypatch):
+    """Reintentos rápidos, sin URLs globales y con el buzón y los contadores vacíos"""
+    monkeypatch.setattr(notificaciones, "WEBHOOKS_ESCANEOS", [])
+    monkeypatch.setattr(notificaciones, "SECRETO_WEBHOOKS", "")
+    monkeypatch.setattr(notificaciones, "INTENTOS_WEBHOOK", 3)
+    monkeypatch.setattr(notificaciones, "ESPERA_INICIAL_WEBHOOK", 0.01)
+    monkeypatch.setattr(notificaciones, "ESPERA_MAXIMA_WEBHOOK", 0.05)
+    monkeypatch.setattr(notificaciones, "TIMEOUT_WEBHOOK", 5)
+    with notificaciones.condicion_buzon:
+        notificaciones.buzon.clear()
+        for contador in notificaciones.contadores:
+            notificaciones.contadores[contador] = 0
+    yield
+    with notificaciones.condicion_buzon:
+        notificaciones.buzon.clear()
+
+
+def vista_trabajo(trabajo_id, webhook):
+    """Vista de un trabajo terminado, como la que pasa trabajos al terminar"""
+    return {
+        "id": trabajo_id,
+        "estado": "completado",
+        "mensaje": "Escaneo completado",
+        "reporte_id": None,
+        "host": "127.0.0.1",
+        "puerto": "80",
+        "tipo": "rapido",
+        "creado": "2026-01-01T00:00:00",
+        "iniciado": "2026-01-01T00:00:01",
+        "finalizado": "2026-01-01T00:00:02",
+        "webhook": webhook,
+    }
+
+
+def esperar(condicion, limite=5):
+    """Espera a que se cumpla la condición o a que pase el límite"""
+    fin = time.monotonic() + limite
+    while not condicion() and time.monotonic() < fin:
+        time.sleep(0.01)
+    return condicion()
+
+
+def terminado():
+    """Ninguna entrega pendiente ni en el buzón"""
+    contadores = notificaciones.contadores
+    return not notificaciones.buzon and (
+        contadores["entregados"] + contadores["fallidos"] > 0
+    )
+
+
+def test_entrega_firmada(receptor, monkeypatch):
+    monkeypatch.setattr(notificaciones, "SECRETO_WEBHOOKS", "secreto")
+    notificaciones.avisar_fin(vista_trabajo("firmado", receptor.url))
+
+    assert esperar(lambda: notificaciones.contadores["entregados"] == 1)
+    assert len(receptor.recibidos) == 1
+    cabeceras, cuerpo = receptor.recibidos[0]
+    esperada = hmac.new(b"secreto", cuerpo, hashlib.sha256).hexdigest()
+    assert cabeceras[notificaciones.FIRMA_WEBHOOK] == f"sha256={esperada}"
+    carga = json.loads(cuerpo)
+    assert carga["evento"] == "escaneo.completado"
+    assert carga["trabajo_id"] == "firmado"
+    assert carga["host"] == "127.0.0.1"
+
+
+def test_sin_secreto_no_se_firma(receptor):
+    notificaciones.avisar_fin(vista_trabajo("sin-firma", receptor.url))
+
+    assert esperar(lambda: notificaciones.contadores["entregados"] == 1)
+    cabeceras, _ = receptor.recibidos[0]
+    assert notificaciones.FIRMA_WEBHOOK not in cabeceras
+
+
+def test_reintenta_errores_5xx(receptor):
+    receptor.codigos = [500, 503]
+    notificaciones.avisar_fin(vista_trabajo("reintento-5xx", receptor.url))
+
+    assert esperar(lambda: notificaciones.contadores["entregados"] == 1)
+    assert len(receptor.recibidos) == 3
+    assert notificaciones.contadores["reintentos"] == 2
+
+
+def test_abandona_tras_agotar_intentos(receptor):
+    receptor.codigos = [502] * 10
+    notificaciones.avisar_fin(vista_trabajo("agotado", receptor.url))
+
+    assert esperar(terminado)
+    assert notificaciones.contadores["fallidos"] == 1
+    assert len(receptor.recibidos) == notificaciones.INTENTOS_WEBHOOK
+
+
+@pytest.mark.parametrize("codigo", [400, 404, 410])
+def test_no_reintenta_errores_4xx(receptor, codigo):
+    receptor.codigos = [codigo]
+    notificaciones.avisar_fin(vista_trabajo(f"sin-reintento-{codigo}", receptor.url))
+
+    assert esperar(terminado)
+    assert notificaciones.contadores["fallidos"] == 1
+    assert notificaciones.contadores["reintentos"] == 0
+    assert len(receptor.recibidos) == 1
+
+
+@pytest.mark.parametrize("codigo", notificaciones.CODIGOS_REINTENTABLES)
+def test_reintenta_4xx_reintentables(receptor, codigo):
+    receptor.codigos = [codigo]
+    notificaciones.avisar_fin(vista_trabajo(f"reintento-{codigo}", receptor.url))
+
+    assert esperar(lambda: notificaciones.contadores["entregados"] == 1)
+    assert notificaciones.contadores["reintentos"] == 1
+    assert len(receptor.recibidos) == 2
+
+
+def test_buzon_lleno_descarta_la_mas_reintentada(monkeypatch):
+    monkeypatch.setattr(notificaciones, "TAMANO_BUZON_WEBHOOKS", 3)
+    futuro = time.monotonic() + 3600
+    # Con el buzón tomado los hilos de envío no pueden sacar nada
+    with notificaciones.condicion_buzon:
+        for trabajo_id, intentos in (("uno", 1), ("cuatro", 4), ("dos", 2)):
+            entrega = {
+                "url": "http://127.0.0.1:9/aviso",
+                "carga": {"trabajo_id": trabajo_id},
+                "intentos": intentos,
+                "ultimo_error": "HTTP 503",
+            }
+            notificaciones.buzon.append(
+                (futuro, next(notificaciones.secuencia), entrega)
+            )
+        notificaciones._encolar("http://127.0.0.1:9/aviso", {"trabajo_id": "nuevo"})
+
+        pendientes = sorted(
+            entrega["carga"]["trabajo_id"] for _, _, entrega in notificaciones.buzon
+        )
+        assert pendientes == ["dos", "nuevo", "uno"]
+        assert notificaciones.contadores["descartados"] == 1
+        notificaciones.buzon.clear()
@@ -0,0 +1,449 @@
+"""
+Cola de trabajos de escaneo
+Cada escaneo recibe un ID, entra en una cola acotada y un pool de hilos
+trabajadores la va vaciando
+"""
+
+import os
+import queue
+import threading
+import uuid
+from collections import deque
+from datetime import datetime
+
+import motor_nmap
+
+# Configuración
+MAX_TRABAJADORES = int(os.environ.get("MAX_TRABAJADORES", 4))
+TAMANO_COLA = int(os.environ.get("TAMANO_COLA", 100))
+MAX_TRABAJOS_HISTORIAL = int(os.environ.get("MAX_TRABAJOS_HISTORIAL", 500))
+MAX_EVENTOS_TRABAJO = int(os.environ.get("MAX_EVENTOS_TRABAJO", 1000))
+
+ESTADOS_ACTIVOS = ("en_cola", "en_progreso")
+
+# Cola de IDs pendientes y registro de todos los trabajos conocidos
+cola_trabajos = queue.Queue(maxsize=TAMANO_COLA)
+trabajos = {}
+lock_trabajos = threading.Lock()
+
+# Avisa a quien espera eventos nuevos (comparte el lock del registro)
+condicion_eventos = threading.Condition(lock_trabajos)
+
+# Hilos del pool, función que ejecuta cada trabajo y función a la que se
+# avisa cuando uno termina
+hilos_trabajadores = []
+ejecutor_trabajos = None
+al_terminar_trabajo = None
+
+
+def configurar_ejecutor(funcion):
+    """Registra la función que ejecuta un trabajo: funcion(trabajo_id, parametros)"""
+    global ejecutor_trabajos
+    ejecutor_trabajos = funcion
+
+
+def configurar_al_terminar(funcion):
+    """
+    Registra la función a la que se avisa cuando un trabajo termina (o cambia
+    su reporte tras terminar): funcion(vista pública del trabajo)
+    """
+    global al_terminar_trabajo
+    al_terminar_trabajo = funcion
+
+
+def _avisar_fin(vista):
+    """Avisa del fin de un trabajo (llamar sin el lock tomado)"""
+    if al_terminar_trabajo is None or vista is None:
+        return
+    try:
+        al_terminar_trabajo(vista)
+    except Exception as e:
+        print(f"[!] Error al avisar del fin del trabajo {vista['id']}: {e}")
+
+
+def iniciar_trabajadores():
+    """Arranca el pool de hilos trabajadores si aún no está en marcha"""
+    with lock_trabajos:
+        if hilos_trabajadores:
+            return
+        for numero in range(MAX_TRABAJADORES):
+            hilo = threading.Thread(
+                target=bucle_trabajador, name=f"trabajador-{numero + 1}"
+            )
+            hilo.daemon = True
+            hilo.start()
+            hilos_trabajadores.append(hilo)
+
+
+def _nuevo_trabajo(parametros, clave=None):
+    """Crea el diccionario de un trabajo en cola (sin registrarlo)"""
+    return {
+        "id": str(uuid.uuid4()),
+        "estado": "en_cola",
+        "mensaje": "Escaneo en cola",
+        "parametros": dict(parametros),
+        # Clave del escaneo para unir peticiones idénticas
+        "clave": clave,
+        "reporte_id": None,
+        "reporte_parcial": None,
+        # Tiempos de las etapas (descubrimiento y escaneo de puertos)
+        "etapas": None,
+        # Opciones de tiempo elegidas por el perfil de red
+        "perfil_aplicado": None,
+        # Tiempos de cada fase del escaneo (ver rendimiento.py)
+        "rendimiento": None,
+        "creado": datetime.now().isoformat(),
+        "iniciado": None,
+        "finalizado": None,
+        "eventos": deque(maxlen=MAX_EVENTOS_TRABAJO),
+        "total_eventos": 0,
+        # Procesos nmap en marcha (pid = grupo de procesos) y aviso de cancelación
+        "procesos": set(),
+        "cancelacion": threading.Event(),
+    }
+
+
+def encolar_trabajo(parametros, clave=None, unir=True):
+    """
+    Registra un trabajo nuevo y lo coloca en la cola
+
+    Si se indica una clave y ya hay un trabajo activo con la misma, no se
+    crea otro: se devuelve ese, y todos sus solicitantes recibirán el mismo
+    reporte
+
+    Args:
+        parametros (dict): Parámetros que se pasarán al ejecutor
+        clave (str): Clave normalizada del escaneo
+        unir (bool): Si es False se crea siempre un trabajo nuevo (aunque
+                     otros podrán unirse a él)
+
+    Returns:
+        tuple: (vista pública del trabajo, True si se creó uno nuevo)
+
+    Raises:
+        queue.Full: Si la cola alcanzó TAMANO_COLA
+    """
+    iniciar_trabajadores()
+
+    trabajo = _nuevo_trabajo(parametros, clave)
+    trabajo_id = trabajo["id"]
+
+    with lock_trabajos:
+        if unir and clave is not None:
+            for existente in trabajos.values():
+                if (
+                    existente["clave"] == clave
+                    and existente["estado"] in ESTADOS_ACTIVOS
+                ):
+                    return _vista_publica(existente), False
+        trabajos[trabajo_id] = trabajo
+    try:
+        cola_trabajos.put_nowait(trabajo_id)
+    except queue.Full:
+        with lock_trabajos:
+            del trabajos[trabajo_id]
+        raise
+
+    return obtener_trabajo(trabajo_id), True
+
+
+def registrar_trabajo_terminado(parametros, reporte_id, mensaje):
+    """
+    Registra un trabajo ya completado que reutiliza un reporte existente
+    (sin pasar por la cola), para que el cliente lo siga como cualquier otro
+
+    Returns:
+        dict: Vista pública del trabajo
+    """
+    trabajo = _nuevo_trabajo(parametros)
+    ahora = datetime.now().isoformat()
+    trabajo.update(
+        estado="completado",
+        mensaje=mensaje,
+        reporte_id=reporte_id,
+        iniciado=ahora,
+        finalizado=ahora,
+    )
+    with lock_trabajos:
+        trabajos[trabajo["id"]] = trabajo
+        _agregar_evento(trabajo, "estado", _evento_estado(trabajo))
+        vista = _vista_publica(trabajo)
+    _podar_historial()
+    _avisar_fin(vista)
+    return vista
+
+
+def _agregar_evento(trabajo, tipo, datos):
+    """Añade un evento al historial del trabajo (llamar con el lock tomado)"""
+    trabajo["eventos"].append(
+        {"id": trabajo["total_eventos"], "tipo": tipo, "datos": datos}
+    )
+    trabajo["total_eventos"] += 1
+    condicion_eventos.notify_all()
+
+
+def _evento_estado(trabajo):
+    """Datos del evento "estado" de un trabajo"""
+    return {
+        "estado": trabajo["estado"],
+        "mensaje": trabajo["mensaje"],
+        "reporte_id": trabajo["reporte_id"],
+    }
+
+
+def publicar_evento(trabajo_id, tipo, datos):
+    """Publica un evento para los clientes que siguen el trabajo"""
+    if trabajo_id is None:
+        return
+    with lock_trabajos:
+        trabajo = trabajos.get(trabajo_id)
+        if trabajo is not None:
+            _agregar_evento(trabajo, tipo, datos)
+
+
+def esperar_eventos(trabajo_id, desde, timeout=15):
+    """
+    Espera eventos del trabajo con id >= desde
+
+    Returns:
+        tuple: (eventos, terminado), o None si el trabajo no existe
+    """
+
+    def hay_novedades():
+        trabajo = trabajos.get(trabajo_id)
+        return (
+            trabajo is None
+            or trabajo["total_eventos"] > desde
+            or trabajo["estado"] not in ESTADOS_ACTIVOS
+        )
+
+    with condicion_eventos:
+        condicion_eventos.wait_for(hay_novedades, timeout)
+        trabajo = trabajos.get(trabajo_id)
+        if trabajo is None:
+            return None
+        eventos = [evento for evento in trabajo["eventos"] if evento["id"] >= desde]
+        return eventos, trabajo["estado"] not in ESTADOS_ACTIVOS
+
+
+def actualizar_trabajo(trabajo_id, **campos):
+    """Actualiza los campos de un trabajo (ignora IDs desconocidos)"""
+    if trabajo_id is None:
+        return
+    with lock_trabajos:
+        trabajo = trabajos.get(trabajo_id)
+        if trabajo is not None:
+            trabajo.update(campos)
+            if "mensaje" in campos:
+                _agregar_evento(trabajo, "mensaje", {"mensaje": campos["mensaje"]})
+            if "reporte_parcial" in campos:
+                _agregar_evento(
+                    trabajo,
+                    "parcial",
+                    {"disponible": campos["reporte_parcial"] is not None},
+                )
+
+
+def registrar_proceso(trabajo_id, pid):
+    """Asocia un proceso nmap a un trabajo; si ya se canceló, lo detiene"""
+    with lock_trabajos:
+        trabajo = trabajos.get(trabajo_id)
+        if trabajo is None:
+            return
+        cancelado = trabajo["cancelacion"].is_set()
+        if not cancelado:
+            trabajo["procesos"].add(pid)
+    if cancelado:
+        motor_nmap.terminar_procesos([pid])
+
+
+def liberar_proceso(trabajo_id, pid):
+    """Olvida un proceso nmap que ya terminó"""
+    with lock_trabajos:
+        trabajo = trabajos.get(trabajo_id)
+        if trabajo is not None:
+            trabajo["procesos"].discard(pid)
+
+
+def evento_cancelacion(trabajo_id):
+    """Devuelve el threading.Event que se activa al cancelar el trabajo"""
+    with lock_trabajos:
+        trabajo = trabajos.get(trabajo_id)
+        return trabajo["cancelacion"] if trabajo is not None else threading.Event()
+
+
+def cancelar_trabajo(trabajo_id):
+    """
+    Cancela un trabajo activo
+
+    Un trabajo en cola ya no se ejecutará; en uno en progreso se detienen
+    sus procesos nmap (SIGTERM y, pasada la gracia, SIGKILL) y conserva el
+    estado de cancelado aunque el ejecutor termine después
+
+    Returns:
+        bool: True si el trabajo estaba activo
+    """
+    with lock_trabajos:
+        trabajo = trabajos.get(trabajo_id)
+        if trabajo is None or trabajo["estado"] not in ESTADOS_ACTIVOS:
+            return False
+        trabajo["estado"] = "cancelado"
+        trabajo["mensaje"] = "Escaneo detenido por el usuario"
+        trabajo["finalizado"] = datetime.now().isoformat()
+        trabajo["cancelacion"].set()
+        procesos = list(trabajo["procesos"])
+        _agregar_evento(trabajo, "estado", _evento_estado(trabajo))
+        vista = _vista_publica(trabajo)
+
+    if procesos:
+        motor_nmap.terminar_procesos(procesos)
+    _avisar_fin(vista)
+    return True
+
+
+def _finalizar_trabajo(trabajo_id, **campos):
+    """Cierra un trabajo en progreso sin pisar una cancelación previa"""
+    vista = None
+    with lock_trabajos:
+        trabajo = trabajos.get(trabajo_id)
+        if trabajo is None:
+            return
+        if trabajo["estado"] == "cancelado":
+            # Conservar el reporte si el ejecutor llegó a generarlo
+            if campos.get("reporte_id"):
+                trabajo["reporte_id"] = campos["reporte_id"]
+                _agregar_evento(trabajo, "estado", _evento_estado(trabajo))
+                vista = _vista_publica(trabajo)
+        else:
+            trabajo.update(campos, finalizado=datetime.now().isoformat())
+            _agregar_evento(trabajo, "estado", _evento_estado(trabajo))
+            vista = _vista_publica(trabajo)
+    _avisar_fin(vista)
+
+
+def _vista_publica(trabajo):
+    """Copia plana de un trabajo apta para serializar a JSON"""
+    vista = {
+        clave: valor
+        for clave, valor in trabajo.items()
+        if clave not in ("parametros", "eventos", "procesos", "cancelacion")
+    }
+    vista.update(trabajo["parametros"])
+    return vista
+
+
+def obtener_trabajo(trabajo_id):
+    """Devuelve una copia del trabajo o None si no existe"""
+    with lock_trabajos:
+        trabajo = trabajos.get(trabajo_id)
+        if trabajo is None:
+            return None
+        return _vista_publica(trabajo)
+
+
+def listar_trabajos():
+    """Lista todos los trabajos conocidos, del más reciente al más antiguo"""
+    with lock_trabajos:
+        ordenados = sorted(trabajos.values(), key=lambda t: t["creado"], reverse=True)
+        return [_vista_publica(trabajo) for trabajo in ordenados]
+
+
+def contar_trabajos():
+    """Cuenta los trabajos en cola y en progreso"""
+    with lock_trabajos:
+        en_cola = sum(1 for t in trabajos.values() if t["estado"] == "en_cola")
+        en_progreso = sum(1 for t in trabajos.values() if t["estado"] == "en_progreso")
+    return {"en_cola": en_cola, "en_progreso": en_progreso}
+
+
+def contar_procesos():
+    """Cuenta los procesos nmap en marcha de todos los trabajos"""
+    with lock_trabajos:
+        return sum(len(t["procesos"]) for t in trabajos.values())
+
+
+def proceso_vivo(pid):
+    """Indica si un proceso de esta máquina sigue en marcha"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def estado_compatible():
+    """
+    Resume los trabajos con el formato del antiguo estado_escaneo global
+    para los clientes que solo conocen /api/estado
+    """
+    with lock_trabajos:
+        ordenados = sorted(trabajos.values(), key=lambda t: t["creado"])
+        activos = [t for t in ordenados if t["estado"] in ESTADOS_ACTIVOS]
+        completados = [t for t in ordenados if t["reporte_id"]]
+
+        if activos:
+            referencia = activos[-1]
+        elif ordenados:
+            referencia = ordenados[-1]
+        else:
+            referencia = None
+
+        return {
+            "en_progreso": bool(activos),
+            "ultimo_reporte": completados[-1]["reporte_id"] if completados else None,
+            "mensaje": referencia["mensaje"] if referencia else "",
+            "proceso_actual": (
+                sorted(referencia["procesos"])[0]
+                if referencia and referencia["procesos"]
+                else None
+            ),
+            "trabajo_actual": referencia["id"] if referencia else None,
+            "trabajos_activos": len(activos),
+        }
+
+
+def _podar_historial():
+    """Descarta los trabajos terminados más antiguos por encima del límite"""
+    with lock_trabajos:
+        terminados = sorted(
+            (t for t in trabajos.values() if t["estado"] not in ESTADOS_ACTIVOS),
+            key=lambda t: t["creado"],
+        )
+        sobrantes = len(terminados) - MAX_TRABAJOS_HISTORIAL
+        for trabajo in terminados[: max(sobrantes, 0)]:
+            del trabajos[trabajo["id"]]
+        if sobrantes > 0:
+            condicion_eventos.notify_all()
+
+
+def bucle_trabajador():
+    """Bucle de cada hilo del pool: toma trabajos de la cola y los ejecuta"""
+    while True:
+        trabajo_id = cola_trabajos.get()
+        try:
+            with lock_trabajos:
+                trabajo = trabajos.get(trabajo_id)
+                if trabajo is None or trabajo["estado"] != "en_cola":
+                    continue
+                trabajo["estado"] = "en_progreso"
+                trabajo["iniciado"] = datetime.now().isoformat()
+                _agregar_evento(trabajo, "estado", _evento_estado(trabajo))
+                parametros = dict(trabajo["parametros"])
+
+            try:
+                reporte_id = ejecutor_trabajos(trabajo_id, parametros)
+                _finalizar_trabajo(
+                    trabajo_id, estado="completado", reporte_id=reporte_id
+                )
+            except Exception as e:
+                print(f"[!] Error en el trabajo {trabajo_id}: {e}")
+                _finalizar_trabajo(
+                    trabajo_id,
+                    estado="error",
+                    mensaje=f"Error durante el escaneo: {str(e)}",
+                )
+        finally:
+            cola_trabajos.task_done()
+            _podar_historial()